@@ -0,0 +1,184 @@
+import os
+import zipfile
+import argparse
+import numpy as np
+import logging
+from policy_export import NumpyPolicy
+
+log = logging.getLogger('simpleExample')
+
+# Inputs of the policy are normalized in [0, 1] and the ways (and MBA level) of the state are discrete, so the greedy
+# policy can be tabulated on a grid: every input is quantized to the nearest of its grid points, an exact point per
+# level for the discrete inputs and a fine grid for the continuous ones. The table holds the greedy action of every
+# grid point and its Q margin, the gap between the best and the second best action, a small margin means that the
+# network itself is close to indifferent there.
+
+BATCH = 1 << 16  # grid points evaluated at a time
+
+
+def grid_levels(num_observations, num_ways, num_mba=1, bins=1024, bandwidth_bins=64):
+    """
+    Number of grid points of every input of the state, [feature, ways] or [feature, ways, bandwidth, mba level].
+
+    Parameters:
+        num_observations: inputs of the policy
+        num_ways: number of the ways actions
+        num_mba: number of the MBA levels
+        bins: grid points of the feature
+        bandwidth_bins: grid points of the BE bandwidth, when MBA is managed
+
+    Returns:
+        a tuple with the grid points of every input
+    """
+
+    if num_observations == 2:
+        return bins, num_ways
+    if num_observations == 4:
+        return bins, num_ways, bandwidth_bins, num_mba
+    raise ValueError("No grid for a state of {} inputs".format(num_observations))
+
+
+def grid_states(levels, start, stop):
+    """ States of the grid points with flat indices in [start, stop). """
+
+    indices = np.unravel_index(np.arange(start, stop), levels)
+    return np.stack([index / max(n - 1, 1) for index, n in zip(indices, levels)], axis=1).astype(np.float32)
+
+
+def build_table(policy, levels):
+    """
+    Evaluates the policy on every grid point.
+
+    Returns:
+        the greedy actions and their Q margins, arrays shaped as the grid
+    """
+
+    size = int(np.prod(levels))
+    actions = np.empty(size, dtype=np.int32)
+    margins = np.empty(size, dtype=np.float32)
+    for start in range(0, size, BATCH):
+        stop = min(start + BATCH, size)
+        q_values = policy.batch_q_values(grid_states(levels, start, stop))
+        top = np.sort(q_values, axis=1)
+        actions[start:stop] = q_values.argmax(axis=1)
+        margins[start:stop] = top[:, -1] - top[:, -2] if q_values.shape[1] > 1 else np.inf
+
+    return actions.reshape(levels), margins.reshape(levels)
+
+
+def save_table(path, actions, margins, num_actions):
+    np.savez(path, actions=actions, margins=margins, num_actions=num_actions)
+
+
+def agreement(table, policy, samples=100000, seed=0):
+    """
+    Compares the table to the network on random states, uniform over the continuous inputs and over the levels of the
+    discrete ones, i.e. mostly off the grid points.
+
+    Returns:
+        the fraction of states where the actions agree and the mean and max Q loss, the Q value given up by taking the
+        action of the table instead of the greedy one
+    """
+
+    random = np.random.RandomState(seed)
+    states = random.random_sample((samples, len(table.levels))).astype(np.float32)
+    for i in table.discrete:
+        states[:, i] = random.randint(table.levels[i], size=samples) / max(table.levels[i] - 1, 1)
+
+    q_values = policy.batch_q_values(states)
+    table_actions = np.array([table.choose_action(state) for state in states])
+    loss = q_values.max(axis=1) - q_values[np.arange(samples), table_actions]
+
+    return (table_actions == q_values.argmax(axis=1)).mean(), loss.mean(), loss.max()
+
+
+class ActionTable:
+    """ Serves the greedy actions from a table with a lookup, the table can be replaced on disk while in use and is
+    picked up by reload_if_changed. It has the choose_action of the agent, exploration is always off. """
+
+    epsilon = 0.
+
+    def __init__(self, path, discrete=(1, 3)):
+        """
+        Parameters:
+            path: the .npz table written by this module
+            discrete: the inputs that take a grid point per level, ways and MBA level
+        """
+        self.path = path
+        self.discrete_inputs = discrete
+        self.mtime = None
+        self.reloads = 0
+        self._load()
+
+    def _load(self):
+        mtime = os.stat(self.path).st_mtime
+        with np.load(self.path) as artifact:
+            actions, margins, num_actions = artifact['actions'], artifact['margins'], int(artifact['num_actions'])
+        levels = actions.shape
+        scales = np.array([n - 1 for n in levels], dtype=np.float64)
+        strides = np.array([s // actions.itemsize for s in actions.strides])
+        # the table is swapped with a single assignment, a lookup sees either the old or the new one
+        self.state = (actions.ravel(), margins.ravel(), scales, strides)
+        self.levels = levels
+        self.discrete = [i for i in self.discrete_inputs if i < len(levels)]
+        self.num_actions = num_actions
+        self.mtime = mtime
+
+    def reload_if_changed(self):
+        """ Loads the table again if its file was modified, returns whether it did. """
+
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:  # in the middle of being replaced
+            return False
+        if mtime == self.mtime:
+            return False
+        try:
+            self._load()
+        except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile) as e:  # partially written, the next call will retry
+            log.warning("Could not reload action table {}: {}".format(self.path, e))
+            return False
+        self.reloads += 1
+        log.info("Reloaded action table {}, {} grid points.".format(self.path, len(self.state[0])))
+        return True
+
+    def _index(self, state, scales, strides):
+        indices = np.rint(np.clip(state, 0., 1.) * scales).astype(np.int64)
+        return int(indices @ strides)
+
+    def choose_action(self, state):
+        actions, _, scales, strides = self.state
+        return int(actions[self._index(state, scales, strides)])
+
+    def margin(self, state):
+        """ Q margin of the action of a state. """
+
+        _, margins, scales, strides = self.state
+        return float(margins[self._index(state, scales, strides)])
+
+
+if __name__ == '__main__':
+    from utils.functions import setup_logging
+
+    setup_logging()
+    parser = argparse.ArgumentParser(description='Tabulates the greedy actions of a policy exported by policy_export')
+    parser.add_argument('policy', help='Policy exported by policy_export.py')
+    parser.add_argument('-o', '--output', help='The .npz table to write, by default next to the policy')
+    parser.add_argument('--mba-levels', type=int, default=1, help='Number of MBA levels of the action space')
+    parser.add_argument('--bins', type=int, default=1024, help='Grid points of the feature')
+    parser.add_argument('--bandwidth-bins', type=int, default=64, help='Grid points of the BE bandwidth, with MBA')
+    parser.add_argument('--samples', type=int, default=100000, help='Random states to measure the agreement on')
+    args = parser.parse_args()
+
+    policy = NumpyPolicy(args.policy)
+    num_ways = policy.num_actions // args.mba_levels
+    levels = grid_levels(policy.num_observations, num_ways, args.mba_levels, args.bins, args.bandwidth_bins)
+    actions, margins = build_table(policy, levels)
+    output = args.output or args.policy.rsplit('.', 1)[0] + '_table.npz'
+    save_table(output, actions, margins, policy.num_actions)
+    log.info("Action table of {} grid points {} written to {}, min Q margin {:.4f}".format(
+        actions.size, levels, output, margins.min()))
+
+    matches, loss_mean, loss_max = agreement(ActionTable(output), policy, args.samples)
+    log.info("Table agrees with the network on {:.2%} of {} random states, Q loss mean {:.5f} max {:.5f}".format(
+        matches, args.samples, loss_mean, loss_max))
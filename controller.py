@@ -0,0 +1,120 @@
+import os
+import glob
+import time
+import threading
+import numpy as np
+import logging
+from policy_export import load_any
+
+log = logging.getLogger('simpleExample')
+
+POLICY_PATTERNS = ('*.npz', '*.pkl')
+
+
+class CheckpointWatcher(threading.Thread):
+    """ Watches a directory for new policies, exported .npz artifacts or checkpoints of the agent, and loads the most
+    recent one in the background. The control loop picks the current policy once per step, a new policy replaces the
+    old one with a single assignment, so a step is always served by one policy and the env is never touched. """
+
+    def __init__(self, directory, num_observations, num_actions, poll_s=5., settle_s=1.):
+        """
+        Parameters:
+            directory: directory to watch
+            num_observations: inputs of the env, policies of other dims are rejected
+            num_actions: actions of the env
+            poll_s: seconds between two scans of the directory
+            settle_s: a file is loaded once it has not been modified for that many seconds, i.e. it is fully written
+        """
+        super().__init__(name='checkpoint-watcher', daemon=True)
+        self.directory = directory
+        self.dims = (num_observations, num_actions)
+        self.poll = poll_s
+        self.settle = settle_s
+        self.policy = None
+        self.seen = None  # (path, mtime) of the last file tried, loaded or not
+        self.swaps = 0
+        self._stopped = threading.Event()
+
+    def _latest(self):
+        paths = [path for pattern in POLICY_PATTERNS for path in glob.glob(os.path.join(self.directory, pattern))]
+        candidates = []
+        for path in paths:
+            try:
+                candidates.append((os.stat(path).st_mtime, path))
+            except FileNotFoundError:  # removed in the meantime
+                continue
+        return max(candidates) if candidates else None
+
+    def check(self):
+        """ Loads the most recent policy of the directory if it is new, returns whether the policy was replaced. """
+
+        latest = self._latest()
+        if latest is None:
+            return False
+        mtime, path = latest
+        if (path, mtime) == self.seen or time.time() - mtime < self.settle:
+            return False
+        self.seen = (path, mtime)
+
+        try:
+            policy = load_any(path)
+        except Exception as e:  # a bad file must not stop the controller, the current policy is kept
+            log.error("Could not load policy {}: {}".format(path, e))
+            return False
+        if (policy.num_observations, policy.num_actions) != self.dims:
+            log.error("Policy {} has {} inputs and {} actions, the env {} and {}, ignored".format(
+                path, policy.num_observations, policy.num_actions, *self.dims))
+            return False
+
+        self.policy = policy
+        self.swaps += 1
+        log.info("Swapped in {} policy {}.".format(policy.arch, path))
+        return True
+
+    def wait_policy(self, stopped):
+        """ Blocks until there is a policy or stopped is set, returns the policy or None. """
+
+        while self.policy is None and not stopped.is_set():
+            if not self.check():
+                stopped.wait(self.poll)
+        return self.policy
+
+    def run(self):
+        while not self._stopped.wait(self.poll):
+            self.check()
+
+    def stop(self):
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
+
+
+class LoopStats:
+    """ Latencies of the control loop over the last steps, in ms. """
+
+    def __init__(self, names, capacity=1000):
+        self.names = names
+        self.capacity = capacity
+        self.values = np.zeros((capacity, len(names)))
+        self.count = 0
+
+    def record(self, *values):
+        self.values[self.count % self.capacity] = values
+        self.count += 1
+
+    def summary(self):
+        """ Mean, p99 and max of every latency, None if there is nothing recorded. """
+
+        if self.count == 0:
+            return None
+        values = self.values[:min(self.count, self.capacity)]
+        return {name: (values[:, i].mean(), np.percentile(values[:, i], 99), values[:, i].max())
+                for i, name in enumerate(self.names)}
+
+    def log(self):
+        summary = self.summary()
+        if summary is None:
+            return
+        log.info("Control loop over the last {} steps: {}".format(
+            min(self.count, self.capacity), ', '.join('{} mean {:.3f}ms p99 {:.3f}ms max {:.3f}ms'.format(name, *stats)
+                                                      for name, stats in summary.items())))
@@ -1,43 +1,69 @@
-from loader import MemCachedLoader
-from pqos_handler import PqosHandlerMock, PqosHandlerPid, PqosHandlerCore
-from rdt_env import Rdt
-from scheduler import RandomScheduler, QueueScheduler
+import ast
+from utils.config_constants import *
 from utils.constants import Loaders, Schedulers
 from utils.functions import parse_num_list
 
+# Backends are imported only when they are selected: pqos, docker and the simulator are optional, e.g. a replay or a
+# simulation runs without the pqos library and the docker client installed.
 
-def loader_factory(service_name, config):
+
+def loader_factory(service_name, config, simulation=None):
     """  """
     if service_name == Loaders.MEMCACHED:
+        from loader import MemCachedLoader
         loader = MemCachedLoader(config)
+    elif service_name == Loaders.SIMULATED:
+        from simulator import LoaderSim
+        loader = LoaderSim(config, simulation)
     else:
         raise ValueError("Loader option {} is not supported".format(service_name))
 
     return loader
 
 
-def scheduler_factory(scheduler_type, config):
+def scheduler_factory(scheduler_type, config, simulation=None):
     """  """
     if scheduler_type == Schedulers.RANDOM:
+        from scheduler import RandomScheduler
         scheduler = RandomScheduler(config)
     elif scheduler_type == Schedulers.QUEUE:
+        from scheduler import QueueScheduler
         scheduler = QueueScheduler(config)
+    elif scheduler_type == Schedulers.MAKESPAN:
+        from scheduler import MakespanScheduler
+        scheduler = MakespanScheduler(config)
+    elif scheduler_type == Schedulers.SIMULATED:
+        from simulator import SchedulerSim
+        scheduler = SchedulerSim(config, simulation)
     else:
         raise ValueError("Scheduler option {} is not supported".format(scheduler_type))
 
     return scheduler
 
 
-def pqos_factory(pqos_interface, cores_pid_hp, cores_pids_be):
+def pqos_factory(pqos_interface, cores_pid_hp, cores_pids_be, simulation=None, num_be_groups=1, socket=0,
+                 mba_levels=None, slot_size=None):
     """  """
     cores_pid_hp_range = parse_num_list(cores_pid_hp)
     cores_pids_be_range = parse_num_list(cores_pids_be)
+    if mba_levels is not None and mba_levels != 'auto':  # as read from the config, e.g. [20, 50, 100]
+        mba_levels = ast.literal_eval(mba_levels)
     if pqos_interface == 'MSR':
-        pqos_handler = PqosHandlerCore(cores_pid_hp_range, cores_pids_be_range)
+        from pqos_handler import PqosHandlerCore
+        pqos_handler = PqosHandlerCore(cores_pid_hp_range, cores_pids_be_range, num_be_groups, socket, mba_levels,
+                                       slot_size)
     elif pqos_interface == 'OS':
-        pqos_handler = PqosHandlerPid(cores_pid_hp_range, cores_pids_be_range)
+        if slot_size:
+            raise ValueError("Per slot monitoring groups (slot_groups) need the MSR interface")
+        from pqos_handler import PqosHandlerPid
+        pqos_handler = PqosHandlerPid(cores_pid_hp_range, cores_pids_be_range, num_be_groups, socket, mba_levels)
+    elif pqos_interface == 'SIM':
+        from simulator import PqosHandlerSim
+        pqos_handler = PqosHandlerSim(simulation, mba_levels)
     else:
-        pqos_handler = PqosHandlerMock()
+        from pqos_handler import PqosHandlerMock
+        pqos_handler = PqosHandlerMock(socket=socket, num_be_groups=num_be_groups, mba_levels=mba_levels,
+                                       num_slots=len(cores_pids_be_range) // slot_size if slot_size else 0)
 
     return pqos_handler
 
@@ -49,23 +75,88 @@ class EnvBuilder:
         self.loader = None
         self.scheduler = None
         self.pqos_handler = None
+        self.simulation = None
+        self.sampler = None
+        self.latency_source = None
+
+    def build_simulation(self, config=None, seed=None):
+        """ Builds the contention model shared by the simulated pqos handler, loader and scheduler. """
+        from simulator import ContentionModel
+        self.simulation = ContentionModel(config, seed)
+
+        return self
+
+    def _get_simulation(self):
+        if self.simulation is None:
+            self.build_simulation()
+        return self.simulation
 
     def build_loader(self, service_name, config):
-        self.loader = loader_factory(service_name, config)
+        simulation = self._get_simulation() if service_name == Loaders.SIMULATED else None
+        self.loader = loader_factory(service_name, config, simulation)
+
+        return self
+
+    def build_pqos(self, pqos_interface, cores_pid_hp_range, cores_pids_be_range, num_be_groups=1, socket=0,
+                   mba_levels=None, slot_size=None):
+        simulation = self._get_simulation() if pqos_interface == 'SIM' else None
+        self.pqos_handler = pqos_factory(pqos_interface, cores_pid_hp_range, cores_pids_be_range, simulation,
+                                         num_be_groups, socket, mba_levels, slot_size)
+
+        return self
+
+    def build_pqos_proxy(self, remote):
+        """ Uses a handler that lives in another process, the one that owns the pqos initialization. """
+        from multisocket import PqosHandlerProxy
+        self.pqos_handler = PqosHandlerProxy(remote)
+
+        return self
+
+    def build_sampler(self, config):
+        """ Builds a background sampler of the pqos handler, if a sampling interval is set in the pqos config. """
+        sample_interval = config.getint(SAMPLE_INTERVAL, fallback=0)
+        if sample_interval > 0:
+            from pqos_sampler import PqosSampler
+            self.sampler = PqosSampler(self.pqos_handler, sample_interval)
 
         return self
 
-    def build_pqos(self, pqos_interface, cores_pid_hp_range, cores_pids_be_range):
-        self.pqos_handler = pqos_factory(pqos_interface, cores_pid_hp_range, cores_pids_be_range)
+    def build_latency_source(self, source):
+        """ Sets the streaming latency source of the watchdog, by default the one of the loader if it has any. """
+        self.latency_source = source
 
         return self
 
     def build_scheduler(self, scheduler_type, config):
-        self.scheduler = scheduler_factory(scheduler_type, config)
+        simulation = self._get_simulation() if scheduler_type == Schedulers.SIMULATED else None
+        self.scheduler = scheduler_factory(scheduler_type, config, simulation)
 
         return self
 
     def build(self, config):
-        env = Rdt(config, self.loader, self.scheduler, self.pqos_handler)
+        from rdt_env import Rdt
+        if getattr(self.pqos_handler, 'monitors_slots', False) and not getattr(self.scheduler, 'fixed_slots', True):
+            raise ValueError("Per slot monitoring groups (slot_groups) need a scheduler with fixed slot cores")
+        if hasattr(self.pqos_handler, 'add_be_pids') and self.scheduler is not None:
+            self.scheduler.add_pid_listener(self.pqos_handler)  # pids of the BEs change as containers are reissued
+        env = Rdt(config, self.loader, self.scheduler, self.pqos_handler, self.sampler)
+        fraction = config.getfloat(WATCHDOG_FRACTION, fallback=None)
+        if fraction is not None:  # fast path that protects the LC service between two decisions
+            source = self.latency_source or getattr(self.loader, 'latency_source', None)
+            if source is None:
+                raise ValueError("The latency watchdog needs a streaming latency source")
+            from watchdog import LatencyWatchdog
+            env.watchdog = LatencyWatchdog(env, source, fraction, config.getint(WATCHDOG_INTERVAL, fallback=5))
+
+        return env
+
+    @staticmethod
+    def build_replay(config, trace_paths, seed=None):
+        """ Builds an environment that replays recorded step logs instead of using the hardware. """
+        from replay_env import ReplayRdt, TraceReplayer, load_traces
+
+        traces, interval = load_traces(trace_paths)
+        replayer = TraceReplayer(traces, interval, config.get(REPLAY_MODE, TraceReplayer.INTERPOLATE), seed=seed)
+        env = ReplayRdt(config, replayer, config.getint(REPLAY_STEPS, fallback=None))
 
         return env
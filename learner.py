@@ -0,0 +1,326 @@
+import ast
+import queue
+import numpy as np
+import torch
+import torch.optim as optim
+import torch.multiprocessing as mp
+import logging
+from rlsuite.builders.agent_builder import DQNAgentBuilder
+from replay_memory import memory_factory
+from utils.config_constants import *
+from utils.constants import PROGRESS_TAG
+from utils.functions import write_metrics, write_aggregates
+
+log = logging.getLogger('simpleExample')
+
+MEM_START_SIZE = 1000
+
+# fork is used on purpose, spawn would re-execute the main script that has no main guard. The process and its queues
+# come from the same context whatever the default start method is.
+ctx = mp.get_context('fork')
+
+# message tags exchanged between actor and learner
+INIT = 'init'
+TRANSITION = 'transition'
+STOP = 'stop'
+
+
+def agent_params(config_agent):
+    """ Extracts from the agent section of the config the parameters needed to build an agent. """
+
+    return {
+        'lr': config_agent.getfloat(LR),
+        'layers_dim': ast.literal_eval(config_agent[LAYERS_DIM]),
+        'target_update': config_agent.getint(TARGET_UPDATE),
+        'batch_size': config_agent.getint(BATCH_SIZE),
+        'arch': config_agent[ARCH],
+        'algo': config_agent[ALGO],
+        'mem_type': config_agent[MEM_PER],
+        'mem_size': config_agent.getint(MEM_SIZE),
+        'gamma': config_agent.getfloat(GAMMA),
+        'eps_decay': config_agent.getfloat(EPS_DECAY),
+        'eps_start': config_agent.getfloat(EPS_START),
+        'eps_end': config_agent.getfloat(EPS_END),
+        'checkpoint': config_agent[CHECKPOINT],
+    }
+
+
+def build_agent(params, num_of_observations, num_of_actions):
+    """ Builds a DQN agent in the same way as the main script does. """
+
+    criterion = torch.nn.MSELoss(reduction='none')
+
+    return DQNAgentBuilder(num_of_observations, num_of_actions, params['gamma'], params['eps_decay'],
+                           params['eps_start'], params['eps_end']) \
+        .set_criterion(criterion) \
+        .build_network(params['layers_dim'], params['arch']) \
+        .load_checkpoint(params['checkpoint']) \
+        .build_optimizer(optim.Adam, params['lr']) \
+        .build(params['algo'])
+
+
+def choose_actions(agent, states, generator=np.random):
+    """ Epsilon greedy selection of the actions of a batch of states with one forward pass of the policy net. """
+
+    with torch.no_grad():
+        q_values = agent.policy_net(torch.from_numpy(states).to(agent.device))
+    greedy = q_values.argmax(dim=1).cpu().numpy()
+    explore = generator.random_sample(len(states)) < agent.epsilon
+    random_actions = generator.randint(q_values.shape[1], size=len(states))
+
+    return np.where(explore, random_actions, greedy)
+
+
+def store_batch(memory, states, actions, next_states, rewards, dones):
+    """ Stores a batch of transitions, in bulk if the memory supports it. """
+
+    if hasattr(memory, 'store_batch'):
+        memory.store_batch(states, actions, next_states, rewards, dones)
+    else:
+        for transition in zip(states, actions, next_states, rewards, dones):
+            memory.store(*transition)
+
+
+def policy_weights(agent):
+    """ Returns a copy of the policy net weights that can be sent to another process. """
+
+    return {key: value.detach().cpu().clone() for key, value in agent.policy_net.state_dict().items()}
+
+
+def train_loop(env, agent, writer, params, memory=None, learner=None, run_log=None):
+    """
+    Training control loop shared by the entry points. At every step the agent acts on the env, the transition is
+    stored, in the memory or sent to the learner in actor/learner mode, the agent is trained and the metrics of the step
+    are written. The env is reset first and the loop runs until the env is done.
+
+    Parameters:
+        env: the Rdt environment
+        agent: the DQN agent, in actor/learner mode only its policy net is used and updated from the learner
+        writer: tensorboard writer
+        params: agent parameters as returned by agent_params
+        memory: the replay memory, None in actor/learner mode
+        learner: the started Learner of the actor/learner mode, if any
+        run_log: step log, if any
+
+    Returns:
+        a dict with the number of steps, the last state, the violations and the step at the end of exploration
+    """
+
+    done = False
+    step = 0
+    decaying_schedule = 0
+    total_reward = 0
+    exploration_viol = 0
+    end_exploration_step = 1
+    end_exploration_flag = False
+    learner_updates = 0
+    loss = None
+
+    if learner is not None:
+        learner.init(env.observation_space.shape[0], env.action_space.n)
+
+    state = np.float32(env.reset())
+
+    while not done:
+        action = agent.choose_action(state)
+        # training runs in parallel with this call only in actor/learner mode
+        next_state, reward, done, info = env.step(action)
+        next_state = np.float32(next_state)
+        if run_log is not None:
+            run_log.append(step, action, reward, agent.epsilon, env.measurements)
+        if info.pop('overridden', False):
+            pass  # the outcome is the one of the watchdog allocation, the transition would mislabel the action
+        elif learner is None:
+            memory.store(state, action, next_state, reward, done)  # Store the transition in memory
+        else:
+            learner.push(state, action, next_state, reward, done)  # the learner stores it in its memory
+        state = next_state
+
+        step += 1
+
+        if learner is None and params['mem_type'] == 'per' and memory.tree.n_entries < MEM_START_SIZE:
+            continue
+
+        # measure the violations of the exploration phase separately
+        if agent.epsilon < params['eps_end'] + 0.01 and not end_exploration_flag:
+            log.info("Conventional end of exploration at step: {}".format(step))
+            exploration_viol = env.violations
+            end_exploration_step = step
+            end_exploration_flag = True
+
+        total_reward += reward
+
+        if learner is None:
+            try:
+                transitions, indices, is_weights = memory.sample(params['batch_size'])
+            except ValueError:  # not enough samples in memory
+                continue
+
+            decaying_schedule += 1
+
+            loss, errors = agent.update(transitions, is_weights)  # Perform one step of optimization on the policy net
+            agent.adjust_exploration(decaying_schedule)  # rate is updated at every step
+            memory.batch_update(indices, errors)  # only applicable for per
+
+            if step % params['target_update'] == 0:  # Update the target network
+                agent.update_target_net()
+        else:
+            # gradient steps take place in the learner, here we only pick up the most recent weights
+            learner.check_alive()  # otherwise the actor would go on forever with the last weights
+            message = learner.poll_weights()
+            if message is not None:
+                weights, learner_updates, loss = message
+                agent.policy_net.load_state_dict(weights)
+            if learner_updates == 0:  # learner has not started training yet
+                continue
+
+            decaying_schedule += 1
+            agent.adjust_exploration(decaying_schedule)  # exploration follows the env steps, not the updates
+
+        for key, value in info.items():
+            write_metrics(writer, key, value, step)
+        for be, progress in env.slot_progress:
+            writer.add_scalar('{}/{}'.format(PROGRESS_TAG, be), progress, step)
+        if env.aggregates is not None:
+            write_aggregates(writer, env.aggregates, step)
+        writer.add_scalar('Agent/Action', action, step)
+        if env.num_mba > 1:  # the two resources of the action
+            action_be_ways, action_mba = env.decode_action(action)
+            writer.add_scalar('Agent/Ways BE', action_be_ways, step)
+            writer.add_scalar('Agent/MBA Level BE', env.mba_levels[action_mba], step)
+        writer.add_scalar('Agent/Reward', reward, step)
+        writer.add_scalar('Agent/Reward Cumulative', total_reward, step)
+        writer.add_scalar('Agent/Epsilon', agent.epsilon, step)
+        writer.add_scalar('Agent/Loss', loss, step)
+        if learner is not None:
+            writer.add_scalar('Agent/Learner Updates', learner_updates, step)
+        writer.add_scalar('Timing/Stats Overhead', env.get_stats_overhead(), step)
+        if env.watchdog is not None:
+            writer.add_scalar('Watchdog/Overrides', len(env.events), step)
+        writer.flush()
+
+    log.info("Experiment finished after {} steps.".format(step))
+
+    return {'steps': step, 'state': state, 'exploration_viol': exploration_viol,
+            'end_exploration_step': end_exploration_step}
+
+
+class Learner(ctx.Process):
+    """ Learner process of the actor/learner mode. It receives transitions from the control loop (actor), stores them
+    in the replay memory, performs the gradient steps and streams the updated policy weights back to the actor. """
+
+    def __init__(self, params, updates_per_step=1, save_file=None):
+        """
+        Parameters:
+            params: agent parameters as returned by agent_params
+            updates_per_step: number of gradient steps performed for each transition received
+            save_file: path where the checkpoint is saved when the learner stops
+        """
+        super().__init__(daemon=True)
+        self.params = params
+        self.updates_per_step = updates_per_step
+        self.save_file = save_file
+        self.transitions = ctx.Queue()
+        self.weights = ctx.Queue(maxsize=1)
+
+    def init(self, num_of_observations, num_of_actions):
+        """ Called by the actor, once the environment is built, to pass the dimensions of the network. """
+
+        self.transitions.put((INIT, (num_of_observations, num_of_actions)))
+
+    def push(self, state, action, next_state, reward, done):
+        """ Called by the actor to send a transition, it never blocks. """
+
+        self.transitions.put((TRANSITION, (state, action, next_state, reward, done)))
+
+    def check_alive(self):
+        """ Called by the actor, raises if the learner has died, e.g. on an error while training. """
+
+        if not self.is_alive():
+            raise RuntimeError("Learner exited with code {}".format(self.exitcode))
+
+    def poll_weights(self):
+        """ Called by the actor, returns the latest message of the learner or None if there is nothing new. """
+
+        try:
+            return self.weights.get_nowait()
+        except queue.Empty:
+            return None
+
+    def shutdown(self, timeout=60):
+        """ Called by the actor, asks the learner to save its checkpoint and waits for it to exit. """
+
+        self.transitions.put((STOP, None))
+        self.join(timeout)
+        if self.is_alive():
+            log.warning("Learner did not exit in time, terminating it.")
+            self.terminate()
+
+    def _publish(self, agent, updates, loss):
+        """ Publishes the latest weights, replacing any message the actor has not consumed yet. """
+
+        try:
+            self.weights.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self.weights.put_nowait((policy_weights(agent), updates, loss))
+        except queue.Full:  # the drained message was not gone yet from the pipe, the next publish catches up
+            pass
+
+    def run(self):
+        tag, dims = self.transitions.get()
+        assert tag == INIT, "Learner expects the dimensions of the network first"
+        agent = build_agent(self.params, *dims)
+        memory = memory_factory(self.params['mem_type'], self.params['mem_size'])
+        batch_size = self.params['batch_size']
+        target_update = self.params['target_update']
+
+        updates = 0
+        pending = 0
+        loss = None
+        running = True
+        while running:
+            # block only when there is no training to do
+            messages = [self.transitions.get()] if pending == 0 else []
+            while True:
+                try:
+                    messages.append(self.transitions.get_nowait())
+                except queue.Empty:
+                    break
+
+            for tag, payload in messages:
+                if tag == STOP:
+                    running = False
+                    break
+                memory.store(*payload)
+                pending += self.updates_per_step
+
+            if self.params['mem_type'] == 'per' and memory.tree.n_entries < MEM_START_SIZE:
+                pending = 0
+                continue
+
+            trained = False
+            while pending > 0 and running:
+                pending -= 1
+                try:
+                    transitions, indices, is_weights = memory.sample(batch_size)
+                except ValueError:  # not enough samples in memory
+                    pending = 0
+                    break
+                loss, errors = agent.update(transitions, is_weights)
+                memory.batch_update(indices, errors)  # only applicable for per
+                updates += 1
+                trained = True
+                if updates % target_update == 0:
+                    agent.update_target_net()
+                # pick up new transitions as soon as they arrive so as not to fall behind the actor
+                if not self.transitions.empty():
+                    break
+
+            if trained:
+                self._publish(agent, updates, loss)
+
+        log.info("Learner stopped after {} updates.".format(updates))
+        if self.save_file is not None:
+            agent.save_checkpoint(self.save_file)
@@ -1,15 +1,413 @@
 import socket
 import struct
 import subprocess
+import threading
+import time
+import numpy as np
 from time import sleep
-import logging.config
+import logging
 from abc import ABC, abstractmethod
 from utils.config_constants import *
 
-logging.config.fileConfig('logging.conf')
 log = logging.getLogger('simpleExample')
 
 
+class StatsChannel:
+    """ Long-lived stats session with the loader. The connection is opened once and reused for every request, it is
+    re-established transparently if the loader drops it and a warning is logged when no fresh stats have been received
+    for a while. The overhead of each request, i.e. the time spent on top of the measurement interval, is tracked.
+
+    The loader has to keep the connection open between requests. A loader that closes it after every reply is
+    detected, after CLOSED_IN_ROW such requests, and from then on a connection is opened per request. """
+
+    FMT = "dd"
+    REQUEST = b'get q95'  # The text can be anything it just unblocks the loader
+    CLOSED_IN_ROW = 3
+
+    def __init__(self, ip, port, interval_ms, timeout_margin=2.0, stale_after=5.0, max_retries=3):
+        """
+        Parameters:
+            ip: ip of the loader's stats server
+            port: port of the loader's stats server
+            interval_ms: measurement interval of the loader in ms, a request blocks for that long
+            timeout_margin: seconds to wait on top of the measurement interval before a request is considered lost
+            stale_after: seconds without fresh stats after which a request warns
+            max_retries: number of reconnections attempted for a single request
+        """
+        self.address = (ip, port)
+        self.interval = interval_ms / 1000.
+        self.timeout = self.interval + timeout_margin
+        self.stale_after = stale_after
+        self.max_retries = max_retries
+        self.fmt_size = struct.calcsize(self.FMT)
+        self.sock = None
+
+        self.last_fresh = None  # time of the last successful request
+        self.closed_in_row = 0  # requests in a row that found the connection closed by the loader
+        self.per_request = False  # the loader closes the connection after every reply
+        self.requests = 0
+        self.reconnects = 0
+        self.overhead_total = 0.
+        self.overhead_max = 0.
+        self.last_overhead = 0.
+
+    def connect(self):
+        """ Opens the connection, with keep-alive enabled and Nagle's algorithm disabled. """
+
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.sock = sock
+
+    def wait_ready(self, timeout, is_alive=None):
+        """ Readiness probe, returns as soon as the loader's stats port accepts a connection. The connection is kept
+        and used for the following requests. """
+
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self.connect()
+                return
+            except OSError:
+                if is_alive is not None and not is_alive():
+                    raise RuntimeError("Loader exited before binding its stats port")
+                if time.time() > deadline:
+                    raise TimeoutError("Loader stats port {}:{} not ready after {}s".format(*self.address, timeout))
+                sleep(0.05)
+
+    def close(self):
+        """ Closes the connection, a following request will open a new one. """
+
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def _recv_exact(self):
+        """ Reads exactly one stats record, recv may return less bytes than requested. """
+
+        data = b''
+        while len(data) < self.fmt_size:
+            chunk = self.sock.recv(self.fmt_size - len(data))  # this call will block
+            if not chunk:
+                raise ConnectionError("Loader closed the stats connection")
+            data += chunk
+        return data
+
+    def _warn_if_stale(self, now):
+        """ Warns, at the start of a request, if the previous fresh stats are older than expected. A request that
+        hangs is not reported here, it fails on the socket timeout. """
+
+        if self.last_fresh is not None and now - self.last_fresh > self.stale_after:
+            log.warning("No fresh stats from loader for {:.1f}s".format(now - self.last_fresh))
+
+    def _closed_by_loader(self):
+        """ Counts the requests that found the connection closed, switches to a connection per request when the loader
+        keeps closing it. """
+
+        self.closed_in_row += 1
+        if self.closed_in_row >= self.CLOSED_IN_ROW and not self.per_request:
+            self.per_request = True
+            log.info("Loader closes the stats connection after every reply, a connection per request is used.")
+
+    def request(self):
+        """ Requests the stats of the next measurement window. Blocks for the whole measurement interval. """
+
+        start = time.time()
+        self._warn_if_stale(start)
+
+        reused = self.sock is not None
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self.sock is None:
+                    self.connect()
+                    if attempt > 0 or (self.requests > 0 and not self.per_request):
+                        self.reconnects += 1
+                self.sock.sendall(self.REQUEST)
+                data = self._recv_exact()
+                break
+            except (OSError, ConnectionError) as e:  # socket.timeout is a subclass of OSError
+                self.close()
+                if attempt == 0 and reused and isinstance(e, ConnectionError):
+                    self._closed_by_loader()
+                    if self.per_request:
+                        continue  # expected from now on, not worth a warning
+                log.warning("Stats request failed ({}), reconnecting...".format(e))
+                if attempt == self.max_retries:
+                    raise
+        if reused and attempt == 0:
+            self.closed_in_row = 0
+        if self.per_request:
+            self.close()  # the loader closes its end anyway
+        latency, rps = struct.unpack(self.FMT, data)
+
+        end = time.time()
+        overhead = max(end - start - self.interval, 0.)
+        self.requests += 1
+        self.overhead_total += overhead
+        self.overhead_max = max(self.overhead_max, overhead)
+        self.last_overhead = overhead
+        self.last_fresh = end
+
+        return latency, rps
+
+    def get_overhead(self):
+        """ Returns the mean and max per request overhead in ms. """
+
+        mean = self.overhead_total / self.requests if self.requests > 0 else 0.
+        return mean * 1000, self.overhead_max * 1000
+
+    def log_overhead(self):
+        """ Reports the overhead of the stats channel. """
+
+        mean, max_ = self.get_overhead()
+        log.info("Stats channel: {} requests, {} reconnects, overhead mean {:.2f}ms max {:.2f}ms"
+                 .format(self.requests, self.reconnects, mean, max_))
+
+
+# Latency histograms are log-linear, as in HDR histograms: values up to 2 * SUB_BUCKETS us have their own bucket and
+# every following power of two is split in SUB_BUCKETS buckets, i.e. a relative error below 1 / SUB_BUCKETS.
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+NUM_BUCKETS = 30 * SUB_BUCKETS  # values up to ~2^33 us
+
+
+def bucket_index(value_us):
+    """ Index of the bucket of a latency in us. """
+
+    value_us = int(value_us)
+    magnitude = max(value_us.bit_length() - SUB_BUCKET_BITS - 1, 0)
+    return magnitude * SUB_BUCKETS + (value_us >> magnitude)
+
+
+def bucket_bounds(indices):
+    """ Lower and upper bound in us of the buckets with the given indices. """
+
+    indices = np.asarray(indices)
+    magnitude = np.maximum(indices // SUB_BUCKETS - 1, 0)
+    sub_bucket = indices - magnitude * SUB_BUCKETS
+    return sub_bucket << magnitude, (sub_bucket + 1) << magnitude
+
+
+_, _BUCKET_UPPER = bucket_bounds(np.arange(NUM_BUCKETS))
+BUCKET_VALUES_MS = (_BUCKET_UPPER - 1) / 1000.  # a quantile is reported as the highest value of its bucket
+
+
+def histogram_quantile(counts, quantile):
+    """ Quantile in ms of a histogram, 0 if it is empty. """
+
+    total = counts.sum()
+    if total == 0:
+        return 0.
+    rank = np.ceil(quantile * total)
+    return BUCKET_VALUES_MS[np.searchsorted(np.cumsum(counts), rank)]
+
+
+class LatencyStream:
+    """ Reads the stream of latency histograms that the loader pushes every sub-interval and keeps the recent ones
+    in a ring buffer. Histograms are mergeable, so the quantiles of any window of the history can be computed here,
+    for any quantile, without restarting the loader. It can be used in place of StatsChannel, request returns the
+    stats of the next measurement window, and as the latency source of the watchdog.
+
+    A frame is a header (magic, end of the sub-interval in seconds since the epoch, its duration in us, number of
+    non empty buckets) followed by (bucket index, count) pairs. """
+
+    MAGIC = b'HIST'
+    HEADER = struct.Struct('<4sdIH')
+    BUCKET = np.dtype([('index', '<u2'), ('count', '<u4')])
+    REQUEST = b'stream'
+
+    def __init__(self, ip, port, interval_ms, quantile, history_s=60., sub_interval_ms=10, watch_window_ms=50,
+                 timeout_margin=2.0):
+        """
+        Parameters:
+            ip: ip of the loader's stream server
+            port: port of the loader's stream server
+            interval_ms: measurement interval, the window of request
+            quantile: quantile reported by request and latest, e.g. .95
+            history_s: seconds of history kept
+            sub_interval_ms: period of the histograms pushed by the loader
+            watch_window_ms: window of the running tail latency returned by latest
+            timeout_margin: seconds to wait on top of the interval before a window is considered lost
+        """
+        self.address = (ip, port)
+        self.interval = interval_ms / 1000.
+        self.quantile = float(quantile)
+        self.watch_window = watch_window_ms / 1000.
+        self.timeout = self.interval + timeout_margin
+        self.capacity = max(int(history_s * 1000 / sub_interval_ms), 1)
+        self.times = np.zeros(self.capacity)
+        self.durations = np.zeros(self.capacity)
+        self.counts = np.zeros((self.capacity, NUM_BUCKETS), dtype=np.int64)
+        self.frames = 0  # frames received so far, the next one is written at frames % capacity
+        self.dropped = 0  # frames with buckets out of the histogram, they are read in full and dropped
+
+        self.sock = None
+        self.reader = None
+        self.closed = threading.Event()
+        self.cond = threading.Condition()
+
+        self.requests = 0
+        self.reconnects = 0
+        self.overhead_total = 0.
+        self.overhead_max = 0.
+        self.last_overhead = 0.
+
+    def connect(self):
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.sendall(self.REQUEST)
+        self.sock = sock
+
+    def wait_ready(self, timeout, is_alive=None):
+        """ Connects to the stream and starts the reader thread. """
+
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self.connect()
+                break
+            except OSError:
+                if is_alive is not None and not is_alive():
+                    raise RuntimeError("Loader exited before binding its stream port")
+                if time.time() > deadline:
+                    raise TimeoutError("Loader stream port {}:{} not ready after {}s".format(*self.address, timeout))
+                time.sleep(0.05)
+        self.closed.clear()
+        if self.reader is None or not self.reader.is_alive():
+            self.reader = threading.Thread(target=self._read, name='latency-stream', daemon=True)
+            self.reader.start()
+
+    def close(self):
+        self.closed.set()
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+                self.sock.close()
+            except OSError:
+                pass
+        if self.reader is not None:
+            self.reader.join()
+            self.reader = None
+        self.sock = None
+
+    def _recv_exact(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Loader closed the stream")
+            data += chunk
+        return bytes(data)
+
+    def _read(self):
+        """ Reader thread, parses the frames and reconnects if the loader drops the stream. """
+
+        while not self.closed.is_set():
+            try:
+                magic, timestamp, duration_us, num_buckets = self.HEADER.unpack(self._recv_exact(self.HEADER.size))
+                if magic != self.MAGIC:
+                    raise ConnectionError("Corrupted latency stream")
+                buckets = np.frombuffer(self._recv_exact(num_buckets * self.BUCKET.itemsize), dtype=self.BUCKET)
+                if num_buckets > 0 and buckets['index'].max() >= NUM_BUCKETS:
+                    self.dropped += 1
+                    log.warning("Dropped latency frame with bucket {} out of the {} buckets ({} dropped)".format(
+                        buckets['index'].max(), NUM_BUCKETS, self.dropped))
+                    continue
+                self._store(timestamp, duration_us / 1e6, buckets)
+            except (OSError, ConnectionError) as e:
+                if self.closed.is_set():
+                    break
+                log.warning("Latency stream failed ({}), reconnecting...".format(e))
+                try:
+                    self.sock.close()
+                    self.connect()
+                    self.reconnects += 1
+                except OSError:
+                    time.sleep(0.1)
+
+    def _store(self, timestamp, duration, buckets):
+        with self.cond:
+            index = self.frames % self.capacity
+            self.times[index] = timestamp
+            self.durations[index] = duration
+            self.counts[index] = 0
+            np.add.at(self.counts[index], buckets['index'], buckets['count'])
+            self.frames += 1
+            self.cond.notify_all()
+
+    def _select(self, start, end=None):
+        """ Ring positions of the frames that end after start and not after end. Caller holds the lock. """
+
+        positions = np.arange(max(self.frames - self.capacity, 0), self.frames) % self.capacity
+        times = self.times[positions]  # in arrival order, thus sorted
+        first = np.searchsorted(times, start, side='right')
+        last = len(times) if end is None else np.searchsorted(times, end, side='right')
+        return positions[first:last]
+
+    def window(self, start, end=None):
+        """ Merged histogram, number of requests and duration in seconds of the frames of a window. """
+
+        with self.cond:
+            positions = self._select(start, end)
+            counts = self.counts[positions].sum(axis=0)
+            duration = self.durations[positions].sum()
+        return counts, counts.sum(), duration
+
+    def quantiles(self, quantiles, window_s, end=None):
+        """ Quantiles in ms of the last window_s seconds, or of the window_s seconds up to end. """
+
+        with self.cond:
+            end = end if end is not None else (self.times[(self.frames - 1) % self.capacity] if self.frames else 0.)
+        counts, _, _ = self.window(end - window_s, end)
+        return [histogram_quantile(counts, quantile) for quantile in quantiles]
+
+    def latest(self):
+        """ LatencySource interface, the running tail latency over the watch window. """
+
+        with self.cond:
+            if self.frames == 0:
+                return None
+            end = self.times[(self.frames - 1) % self.capacity]
+            counts = self.counts[self._select(end - self.watch_window, end)].sum(axis=0)
+        return end, histogram_quantile(counts, self.quantile)
+
+    def request(self):
+        """ Same as StatsChannel.request, blocks for one measurement interval and returns the tail latency and the
+        rps of the window. """
+
+        start = time.time()
+        deadline = start + self.interval
+        with self.cond:  # wait for the frame that closes the window
+            ready = self.cond.wait_for(lambda: self.frames > 0 and self.times[(self.frames - 1) % self.capacity]
+                                       >= deadline, timeout=self.timeout)
+        if not ready:
+            raise TimeoutError("No latency histograms from loader for {:.1f}s".format(self.timeout))
+        counts, requests, duration = self.window(start, None)
+        latency = histogram_quantile(counts, self.quantile)
+        rps = requests / duration if duration > 0 else 0.
+
+        end = time.time()
+        overhead = max(end - start - self.interval, 0.)
+        self.requests += 1
+        self.overhead_total += overhead
+        self.overhead_max = max(self.overhead_max, overhead)
+        self.last_overhead = overhead
+
+        return latency, rps
+
+    def get_overhead(self):
+        mean = self.overhead_total / self.requests if self.requests > 0 else 0.
+        return mean * 1000, self.overhead_max * 1000
+
+    def log_overhead(self):
+        mean, max_ = self.get_overhead()
+        log.info("Latency stream: {} frames, {} windows, {} reconnects, overhead mean {:.2f}ms max {:.2f}ms"
+                 .format(self.frames, self.requests, self.reconnects, mean, max_))
+
+
 class Loader(ABC):
     """ Abstract class that handles all the functionality that concerns the service loader. """
     def __init__(self, config):
@@ -21,6 +419,27 @@ class Loader(ABC):
         self.measurement_interval = config[ACTION_INTERVAL]
         self.rps = config.getint(LOADER_RPS)
         self.cores_loader = config[CORES_LOADER]
+        self.ready_timeout = config.getfloat(LOADER_READY_TIMEOUT, fallback=30.0)
+        self.soft_reset = config.getboolean(LOADER_SOFT_RESET, fallback=True)
+        # stats are either requested per window or computed from the stream of histograms that the loader pushes
+        self.stats_mode = config.get(STATS_MODE, fallback='request')
+        self.sub_interval = config.getint(STREAM_SUB_INTERVAL, fallback=10)
+        if self.stats_mode == 'stream':
+            self.stats_channel = LatencyStream(self.service_ip, config.getint(STREAM_PORT, fallback=self.service_port),
+                                               int(self.measurement_interval), self.quantile,
+                                               sub_interval_ms=self.sub_interval,
+                                               watch_window_ms=config.getint(STREAM_WATCH_WINDOW, fallback=50),
+                                               timeout_margin=config.getfloat(STATS_TIMEOUT_MARGIN, fallback=2.0))
+        else:
+            self.stats_channel = StatsChannel(self.service_ip, self.service_port, int(self.measurement_interval),
+                                              timeout_margin=config.getfloat(STATS_TIMEOUT_MARGIN, fallback=2.0),
+                                              stale_after=config.getfloat(STATS_STALE_AFTER, fallback=5.0))
+
+    @property
+    def latency_source(self):
+        """ Streaming latency source for the watchdog, only in stream mode. """
+
+        return self.stats_channel if self.stats_mode == 'stream' else None
 
     @abstractmethod
     def start(self):
@@ -30,14 +449,45 @@ class Loader(ABC):
     def stop(self):
         """ Sends signal to stop the loader and checks for proper termination """
 
+        self.stats_channel.close()
+        self.stats_channel.log_overhead()
         self.client.terminate()
         sleep(0.5)
         while self.client.poll() is None:
             log.debug("Unable to shutdown loader. Retrying...")
             self.client.terminate()
 
+    @staticmethod
+    def now():
+        """ Clock that the measurement windows are timed with. """
+
+        return time.time()
+
+    def is_running(self):
+        """ Checks whether the loader subprocess is alive. """
+
+        return self.client is not None and self.client.poll() is None
+
+    def wait_ready(self):
+        """ Blocks until the loader accepts connections on its stats port. """
+
+        start = time.time()
+        self.stats_channel.wait_ready(self.ready_timeout, self.is_running)
+        log.debug("Loader ready after {:.2f}s".format(time.time() - start))
+
+    def clear_stats(self):
+        """ Clears the statistics window of a running loader, by consuming and discarding the current window. """
+
+        self.stats_channel.request()
+
     def reset(self):
-        """ Restart the loader. """
+        """ Resets the loader. A warm loader is kept running and only its statistics window is cleared (soft reset),
+        otherwise the loader is restarted. """
+
+        if self.soft_reset and self.is_running():
+            self.clear_stats()
+            log.debug("Loader soft reset.")
+            return
 
         if self.client is not None:
             self.stop()
@@ -45,16 +495,9 @@ class Loader(ABC):
 
     def get_stats(self):
         """ Collects the stats from the loader. Currently we are receiving the specified quantile
-        and the requests per second. """
-
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((self.service_ip, self.service_port))
-            s.sendall(b'get q95')  # The text can be anything it just unblocks the loader
+        and the requests per second. The same stats session is reused for the whole run. """
 
-            fmt = "dd"
-            fmt_size = struct.calcsize(fmt)
-            data = s.recv(fmt_size)  # this call will block
-            latency, rps = struct.unpack(fmt, data[:fmt_size])
+        latency, rps = self.stats_channel.request()
 
         # log.debug('Tail latency {}: {}'.format(self.quantile, latency))
         # log.debug('RPS: {}'.format(rps))
@@ -77,10 +520,12 @@ class MemCachedLoader(Loader):
         loader = '{}/loader'.format(self.loader_dir)
         dataset = '{}/twitter_dataset/twitter_dataset_30x'.format(self.loader_dir)
         servers = '{}/docker_servers.txt'.format(self.loader_dir)
+        # in stream mode the loader pushes a histogram every sub-interval, -q and -T only matter to request mode
+        stream = ['-H', str(self.sub_interval)] if self.stats_mode == 'stream' else []
         self.client = subprocess.Popen(['taskset', '--cpu-list', self.cores_loader, loader, '-a', dataset, '-s',
                                         servers, '-g', self.ratio, '-c', self.loader_conn, '-w', self.loader_threads,
-                                        '-T', self.measurement_interval, '-r', str(self.rps),  '-q', self.quantile,
-                                        self.exponential_dist])
-        sleep(10)  # wait in order to bind the socket
+                                        '-T', self.measurement_interval, '-r', str(self.rps),  '-q', self.quantile]
+                                       + stream + [self.exponential_dist])
+        self.wait_ready()  # wait in order to bind the socket
 
         log.debug("Loader started.")
@@ -1,29 +1,29 @@
-import torch
-import torch.optim as optim
-import numpy as np
 import ast
-from rlsuite.builders.factories import memory_factory
 from env_builder import EnvBuilder
-import logging.config
-from rlsuite.utils.functions import log_parameters_histograms
-from rlsuite.builders.agent_builder import DQNAgentBuilder
-from torch.utils.tensorboard import SummaryWriter
+import logging
 from utils.config_constants import *
 from utils.constants import Loaders, Schedulers
-from utils.functions import write_metrics, form_duration, config_parser
+from utils.metrics_sink import MetricsSink
+from utils.run_log import RunLog
+from utils.functions import form_duration, config_parser, setup_logging
+from replay_memory import memory_factory
 from utils.argparser import cmd_parser
 from datetime import datetime
 import os
 
-logging.config.fileConfig('logging.conf')
+setup_logging()
 log = logging.getLogger('simpleExample')
 
-MEM_START_SIZE = 1000
-
 time_at_start = datetime.now().strftime('%b%d_%H-%M-%S')
 parser = cmd_parser()
 args = parser.parse_args()
 
+import torch
+import torch.optim as optim
+from rlsuite.builders.agent_builder import DQNAgentBuilder
+from torch.utils.tensorboard import SummaryWriter
+from learner import Learner, agent_params, train_loop
+
 config = config_parser(args.config_file)
 
 # some arguments are set from command line args, that was useful for tuning
@@ -36,14 +36,41 @@ if config[AGENT][EPS_DECAY] == "-1":
 config[LOADER][QUANTILE] = args.quantile
 config[ENV][FEATURE] = args.feature
 
-env = EnvBuilder() \
-    .build_pqos(config[PQOS][PQOS_INTERFACE], config[PQOS][CORES_LC], config[SCHEDULER][CORES_BE]) \
-    .build_loader(Loaders.MEMCACHED, config[LOADER]) \
-    .build_scheduler(Schedulers.QUEUE, config[SCHEDULER]) \
-    .build(config[ENV])
-
 comment = f"_{args.comment}"
-writer = SummaryWriter(comment=comment)
+
+# the learner is forked before anything else (pqos, docker, cuda) is initialized in this process
+learner = None
+if args.async_learner:
+    learner = Learner(agent_params(config[AGENT]), args.updates_per_step,
+                      os.path.join('checkpoints', time_at_start + comment + '.pkl'))
+    learner.start()
+    log.info("Actor/learner mode, {} update(s) per step.".format(args.updates_per_step))
+
+# one monitoring group per BE slot, needed by the throughput reward
+slot_size = config[SCHEDULER].getint(CORES_PER_BE) if config[PQOS].getboolean(SLOT_GROUPS, fallback=False) else None
+
+if args.replay:  # offline training on recorded measurements
+    env = EnvBuilder.build_replay(config[ENV], args.replay)
+elif args.simulate:  # hardware free, on the analytic contention model
+    env = EnvBuilder() \
+        .build_simulation(config[SIMULATOR] if config.has_section(SIMULATOR) else None) \
+        .build_pqos('SIM', config[PQOS][CORES_LC], config[SCHEDULER][CORES_BE],
+                    mba_levels=config[PQOS].get(MBA_LEVELS)) \
+        .build_loader(Loaders.SIMULATED, config[LOADER]) \
+        .build_scheduler(Schedulers.SIMULATED, config[SCHEDULER]) \
+        .build(config[ENV])
+else:
+    env = EnvBuilder() \
+        .build_pqos(config[PQOS][PQOS_INTERFACE], config[PQOS][CORES_LC], config[SCHEDULER][CORES_BE],
+                    config[PQOS].getint(BE_GROUPS, fallback=1), mba_levels=config[PQOS].get(MBA_LEVELS),
+                    slot_size=slot_size) \
+        .build_sampler(config[PQOS]) \
+        .build_loader(Loaders.MEMCACHED, config[LOADER]) \
+        .build_scheduler(Schedulers(args.scheduler), config[SCHEDULER]) \
+        .build(config[ENV])
+
+writer = MetricsSink(SummaryWriter(comment=comment), policy=args.metrics_policy)  # writes in the background
+run_log = RunLog(os.path.join(args.step_log_dir, time_at_start + comment + '.steplog')) if args.step_log_dir else None
 
 num_of_observations = env.observation_space.shape[0]
 num_of_actions = env.action_space.n
@@ -71,7 +98,7 @@ init_weights = config[AGENT][WEIGHTS]
 criterion = torch.nn.MSELoss(reduction='none')  # torch.nn.SmoothL1Loss()  # Huber loss
 optimizer = optim.Adam
 
-memory = memory_factory(mem_type, mem_size)
+memory = memory_factory(mem_type, mem_size) if learner is None else None  # in actor/learner mode memory is remote
 
 agent = DQNAgentBuilder(num_of_observations, num_of_actions, gamma, eps_decay, eps_start, eps_end) \
     .set_criterion(criterion) \
@@ -80,86 +107,11 @@ agent = DQNAgentBuilder(num_of_observations, num_of_actions, gamma, eps_decay, e
     .build_optimizer(optimizer, lr) \
     .build(agent_algorithm)
 
-done = False
-step = 0
-decaying_schedule = 0
-total_reward = 0
-exploration_viol = 0
-end_exploration_step = 1
-end_exploration_flag = False
-
 try:
-    state = env.reset()
-    state = np.float32(state)
-
-    while not done:
-        action = agent.choose_action(state)
-        # measuring env step time
-        # start_step_time = time.time()
-        # could run in parallel with the rest of the loop but GIL prevents this
-        next_state, reward, done, info = env.step(action)
-        # end_step_time = time.time()
-        # step_interval = (end_step_time - start_step_time) * 1000
-        # writer.add_scalar('Timing/Env Step', step_interval, step)
-        next_state = np.float32(next_state)
-        memory.store(state, action, next_state, reward, done)  # Store the transition in memory
-        state = next_state
-
-        step += 1
-
-        if mem_type == 'per' and memory.tree.n_entries < MEM_START_SIZE:
-            continue
-
-        # measure the violations of the exploration phase separately
-        if agent.epsilon < eps_end + 0.01 and not end_exploration_flag:
-            log.info("Conventional end of exploration at step: {}".format(step))
-            exploration_viol = env.violations
-            end_exploration_step = step
-            end_exploration_flag = True
-
-        total_reward += reward
-
-        # experimental path used to create checkpoints: increase exploration when new be is started
-        # if new_be:
-        #     log.info("New be started at step: {}. Exploration rate increased.".format(step))
-        #     decaying_schedule = min(decaying_schedule, 0)  # resets exploration rate at 0.2 with 3210, 4500 for 0.1
-        #     # memory.flush()  # we didn't observe any benefit from emptying the memory
-        #
-        #     save_file = os.path.join('checkpoints', time_at_start + comment + '_' + str(step) + '.pkl')
-        #     agent.save_checkpoint(save_file)
-
-        try:
-            transitions, indices, is_weights = memory.sample(batch_size)
-        except ValueError:  # not enough samples in memory
-            continue
-
-        decaying_schedule += 1
-
-        loss, errors = agent.update(transitions, is_weights)  # Perform one step of optimization on the policy net
-        agent.adjust_exploration(decaying_schedule)  # rate is updated at every step
-        memory.batch_update(indices, errors)  # only applicable for per
-
-        if step % target_update == 0:  # Update the target network
-            agent.update_target_net()
-            # creates enormous amount of data and gives little information so we disable the logging of weights
-            # log_parameters_histograms(writer, agent.target_net, step, 'TargetNet')
-
-        for key, value in info.items():
-            write_metrics(writer, key, value, step)
-        writer.add_scalar('Agent/Action', action, step)
-        writer.add_scalar('Agent/Reward', reward, step)
-        writer.add_scalar('Agent/Reward Cumulative', total_reward, step)
-        writer.add_scalar('Agent/Epsilon', agent.epsilon, step)
-        writer.add_scalar('Agent/Loss', loss, step)
-        writer.flush()
-        # log_parameters_histograms(writer, agent.policy_net, step, 'PolicyNet')
-
-        # measuring training time
-        # end_training = time.time()
-        # training_interval = (end_training - end_step_time) * 1000
-        # writer.add_scalar('Timing/Training', training_interval, step)
-
-    log.info("Experiment finished after {} steps.".format(step))
+    results = train_loop(env, agent, writer, agent_params(config[AGENT]), memory, learner, run_log)
+    step, state = results['steps'], results['state']
+    exploration_viol, end_exploration_step = results['exploration_viol'], results['end_exploration_step']
+
     duration = env.get_experiment_duration()
     writer.add_graph(agent.policy_net, torch.tensor(state, device=agent.device))
     writer.add_hparams({'lr': lr, 'gamma': gamma, 'HL Dims': str(layers_dim), 'Target_upd_interval': target_update,
@@ -173,9 +125,13 @@ try:
     writer.add_text('duration', form_duration(duration))
 
 finally:
-    save_file = os.path.join('checkpoints', time_at_start + comment + '.pkl')
-    agent.save_checkpoint(save_file)
-
-    writer.flush()
-    writer.close()
+    if learner is None:
+        save_file = os.path.join('checkpoints', time_at_start + comment + '.pkl')
+        agent.save_checkpoint(save_file)
+    else:
+        learner.shutdown()  # the learner holds the trained state, it saves the checkpoint
+
+    writer.close()  # pending records are written before closing
+    if run_log is not None:
+        run_log.close()
     env.stop()
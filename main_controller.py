@@ -0,0 +1,106 @@
+import os
+import time
+import signal
+import threading
+import numpy as np
+import logging
+from datetime import datetime
+from controller import CheckpointWatcher, LoopStats
+from env_builder import EnvBuilder
+from utils.argparser import cmd_parser
+from utils.config_constants import *
+from utils.constants import Loaders, Schedulers
+from utils.functions import form_duration, config_parser, setup_logging
+from utils.run_log import RunLog
+
+# This script is a long running controller, it drives the env with a frozen policy and never trains. The most recent
+# policy of a checkpoint dir, exported .npz or checkpoint .pkl of the agent, is swapped in between two steps without
+# resetting pqos, the loader or the BEs. SIGTERM and SIGINT stop the controller at the end of the current step.
+
+setup_logging()
+log = logging.getLogger('simpleExample')
+
+time_at_start = datetime.now().strftime('%b%d_%H-%M-%S')
+parser = cmd_parser()
+parser.add_argument('--checkpoint-dir', default='checkpoints', help='Directory watched for new policies')
+parser.add_argument('--poll', type=float, default=5., help='Seconds between two scans of the checkpoint dir')
+parser.add_argument('--stats-every', type=int, default=300, help='Steps between two reports of the loop latencies')
+args = parser.parse_args()
+
+config = config_parser(args.config_file)
+if config[LOADER][ACTION_INTERVAL] == "-1":
+    config[LOADER][ACTION_INTERVAL] = args.interval
+config[LOADER][QUANTILE] = args.quantile
+config[ENV][FEATURE] = args.feature
+
+stopped = threading.Event()
+
+
+def request_stop(signum, frame):
+    if stopped.is_set():
+        log.warning("Already stopping, signal {} ignored.".format(signum))
+        return
+    log.warning("Received signal {}, stopping after the current step.".format(signum))
+    stopped.set()
+
+
+signal.signal(signal.SIGTERM, request_stop)
+signal.signal(signal.SIGINT, request_stop)
+
+slot_size = config[SCHEDULER].getint(CORES_PER_BE) if config[PQOS].getboolean(SLOT_GROUPS, fallback=False) else None
+
+if args.simulate:
+    env = EnvBuilder() \
+        .build_simulation(config[SIMULATOR] if config.has_section(SIMULATOR) else None) \
+        .build_pqos('SIM', config[PQOS][CORES_LC], config[SCHEDULER][CORES_BE],
+                    mba_levels=config[PQOS].get(MBA_LEVELS)) \
+        .build_loader(Loaders.SIMULATED, config[LOADER]) \
+        .build_scheduler(Schedulers.SIMULATED, config[SCHEDULER]) \
+        .build(config[ENV])
+else:
+    env = EnvBuilder() \
+        .build_pqos(config[PQOS][PQOS_INTERFACE], config[PQOS][CORES_LC], config[SCHEDULER][CORES_BE],
+                    config[PQOS].getint(BE_GROUPS, fallback=1), mba_levels=config[PQOS].get(MBA_LEVELS),
+                    slot_size=slot_size) \
+        .build_sampler(config[PQOS]) \
+        .build_loader(Loaders.MEMCACHED, config[LOADER]) \
+        .build_scheduler(Schedulers(args.scheduler), config[SCHEDULER]) \
+        .build(config[ENV])
+
+watcher = CheckpointWatcher(args.checkpoint_dir, env.observation_space.shape[0], env.action_space.n, args.poll)
+comment = "_controller_{}".format(args.comment)
+run_log = RunLog(os.path.join(args.step_log_dir, time_at_start + comment + '.steplog')) if args.step_log_dir else None
+stats = LoopStats(('Decision', 'Step', 'Stats Overhead'))
+
+done = False
+step = 0
+
+try:
+    log.info("Waiting for a policy in {}.".format(args.checkpoint_dir))
+    if watcher.wait_policy(stopped) is not None:
+        watcher.start()
+        state = env.reset()
+
+    while not (done or stopped.is_set()):
+        policy = watcher.policy  # the same policy serves the whole step
+        start = time.perf_counter()
+        action = policy.choose_action(np.float32(state))
+        decided = time.perf_counter()
+        state, reward, done, info = env.step(action)
+        stats.record((decided - start) * 1000, (time.perf_counter() - decided) * 1000, env.get_stats_overhead())
+        if run_log is not None:
+            run_log.append(step, action, reward, policy.epsilon, env.measurements)
+        step += 1
+
+        if step % args.stats_every == 0:
+            stats.log()
+
+    log.info("Controller stopped after {} steps, {} policy swaps, {}.".format(
+        step, watcher.swaps, form_duration(env.get_experiment_duration())))
+
+finally:
+    watcher.stop()
+    stats.log()
+    if run_log is not None:
+        run_log.close()
+    env.stop()  # runs once, releases only pqos if the env was never reset
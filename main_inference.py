@@ -0,0 +1,99 @@
+import os
+import time
+import numpy as np
+import logging
+from datetime import datetime
+from env_builder import EnvBuilder
+from action_table import ActionTable
+from policy_export import NumpyPolicy
+from utils.argparser import cmd_parser
+from utils.config_constants import *
+from utils.constants import Loaders, Schedulers
+from utils.functions import form_duration, config_parser, setup_logging
+from utils.run_log import RunLog
+
+# This script executes a trained policy, exported with policy_export.py or tabulated with action_table.py, without
+# training. Torch is never imported, the steps are written to the step log only. A table is reloaded as soon as its file
+# is replaced, e.g. by an atomic rename of a newly built table.
+
+setup_logging()
+log = logging.getLogger('simpleExample')
+
+time_at_start = datetime.now().strftime('%b%d_%H-%M-%S')
+parser = cmd_parser()
+policy_args = parser.add_mutually_exclusive_group(required=True)
+policy_args.add_argument('--policy', help='Policy exported by policy_export.py')
+policy_args.add_argument('--table', help='Action table built by action_table.py')
+args = parser.parse_args()
+
+config = config_parser(args.config_file)
+if config[LOADER][ACTION_INTERVAL] == "-1":
+    config[LOADER][ACTION_INTERVAL] = args.interval
+config[LOADER][QUANTILE] = args.quantile
+config[ENV][FEATURE] = args.feature
+
+slot_size = config[SCHEDULER].getint(CORES_PER_BE) if config[PQOS].getboolean(SLOT_GROUPS, fallback=False) else None
+
+if args.simulate:
+    env = EnvBuilder() \
+        .build_simulation(config[SIMULATOR] if config.has_section(SIMULATOR) else None) \
+        .build_pqos('SIM', config[PQOS][CORES_LC], config[SCHEDULER][CORES_BE],
+                    mba_levels=config[PQOS].get(MBA_LEVELS)) \
+        .build_loader(Loaders.SIMULATED, config[LOADER]) \
+        .build_scheduler(Schedulers.SIMULATED, config[SCHEDULER]) \
+        .build(config[ENV])
+else:
+    env = EnvBuilder() \
+        .build_pqos(config[PQOS][PQOS_INTERFACE], config[PQOS][CORES_LC], config[SCHEDULER][CORES_BE],
+                    config[PQOS].getint(BE_GROUPS, fallback=1), mba_levels=config[PQOS].get(MBA_LEVELS),
+                    slot_size=slot_size) \
+        .build_sampler(config[PQOS]) \
+        .build_loader(Loaders.MEMCACHED, config[LOADER]) \
+        .build_scheduler(Schedulers(args.scheduler), config[SCHEDULER]) \
+        .build(config[ENV])
+
+if args.table:
+    policy = ActionTable(args.table)
+    num_of_observations = len(policy.levels)
+    log.info("Executing action table {}, grid {}.".format(args.table, policy.levels))
+else:
+    policy = NumpyPolicy(args.policy)
+    num_of_observations = policy.num_observations
+    log.info("Executing {} policy {}, {} actions.".format(policy.arch, args.policy, policy.num_actions))
+if (num_of_observations, policy.num_actions) != (env.observation_space.shape[0], env.action_space.n):
+    raise ValueError("Policy has {} inputs and {} actions, the env {} and {}".format(
+        num_of_observations, policy.num_actions, env.observation_space.shape[0], env.action_space.n))
+
+comment = "_inference_{}".format(args.comment)
+run_log = RunLog(os.path.join(args.step_log_dir, time_at_start + comment + '.steplog')) if args.step_log_dir else None
+
+done = False
+step = 0
+decision_times = []
+
+try:
+    state = env.reset()
+
+    while not done:
+        if args.table:
+            policy.reload_if_changed()
+        start = time.perf_counter()
+        action = policy.choose_action(np.float32(state))
+        decision_times.append(time.perf_counter() - start)
+        state, reward, done, info = env.step(action)
+        if run_log is not None:
+            run_log.append(step, action, reward, policy.epsilon, env.measurements)
+        step += 1
+
+    duration = env.get_experiment_duration()
+    log.info("Experiment finished after {} steps, {}, violations {:.4f}.".format(step, form_duration(duration),
+                                                                                env.violations / step))
+
+finally:
+    if decision_times:
+        decision_times = np.array(decision_times) * 1e6
+        log.info("Decision time mean {:.1f}us p99 {:.1f}us max {:.1f}us".format(
+            decision_times.mean(), np.percentile(decision_times, 99), decision_times.max()))
+    if run_log is not None:
+        run_log.close()
+    env.stop()
@@ -1,20 +1,26 @@
 from env_builder import EnvBuilder
-import logging.config
+import logging
 from utils.argparser import cmd_parser
-from torch.utils.tensorboard import SummaryWriter
-from utils.functions import write_metrics, form_duration, config_parser
-from utils.constants import Loaders, Schedulers
+from utils.metrics_sink import MetricsSink
+from utils.run_log import RunLog
+from utils.functions import write_metrics, form_duration, config_parser, setup_logging
+from utils.constants import Loaders, Schedulers, PROGRESS_TAG
 from utils.config_constants import *
+from datetime import datetime
+import os
 
 # This script enforces static allocation and writes the metrics of the execution.
 
-logging.config.fileConfig('logging.conf')
+setup_logging()
 log = logging.getLogger('simpleExample')
 
 parser = cmd_parser()
 parser.add_argument('--ways-be', type=int, default=-1, help='Ways to be allocated to best effort group')
+parser.add_argument('--mba-be', type=int, default=-1, help='Index of the MBA level of best effort group, if managed')
 args = parser.parse_args()
 
+from torch.utils.tensorboard import SummaryWriter
+
 config = config_parser(args.config_file)
 
 if config[LOADER][ACTION_INTERVAL] == "-1":
@@ -23,14 +29,37 @@ if config[LOADER][ACTION_INTERVAL] == "-1":
 config[LOADER][QUANTILE] = args.quantile
 config[ENV][FEATURE] = args.feature
 
-env = EnvBuilder() \
-    .build_pqos(config[PQOS][PQOS_INTERFACE], config[PQOS][CORES_LC], config[SCHEDULER][CORES_BE]) \
-    .build_loader(Loaders.MEMCACHED, config[LOADER]) \
-    .build_scheduler(Schedulers.QUEUE, config[SCHEDULER]) \
-    .build(config[ENV])
+# one monitoring group per BE slot, needed by the throughput reward
+slot_size = config[SCHEDULER].getint(CORES_PER_BE) if config[PQOS].getboolean(SLOT_GROUPS, fallback=False) else None
+
+if args.simulate:  # hardware free, on the analytic contention model
+    env = EnvBuilder() \
+        .build_simulation(config[SIMULATOR] if config.has_section(SIMULATOR) else None) \
+        .build_pqos('SIM', config[PQOS][CORES_LC], config[SCHEDULER][CORES_BE],
+                    mba_levels=config[PQOS].get(MBA_LEVELS)) \
+        .build_loader(Loaders.SIMULATED, config[LOADER]) \
+        .build_scheduler(Schedulers.SIMULATED, config[SCHEDULER]) \
+        .build(config[ENV])
+else:
+    env = EnvBuilder() \
+        .build_pqos(config[PQOS][PQOS_INTERFACE], config[PQOS][CORES_LC], config[SCHEDULER][CORES_BE],
+                    config[PQOS].getint(BE_GROUPS, fallback=1), mba_levels=config[PQOS].get(MBA_LEVELS),
+                    slot_size=slot_size) \
+        .build_sampler(config[PQOS]) \
+        .build_loader(Loaders.MEMCACHED, config[LOADER]) \
+        .build_scheduler(Schedulers(args.scheduler), config[SCHEDULER]) \
+        .build(config[ENV])
+
+# the static action combines the ways and the MBA level, the BEs are not throttled unless an MBA level is given
+action = args.ways_be
+if args.ways_be >= 0:
+    mba_index = args.mba_be if args.mba_be >= 0 else env.num_mba - 1
+    action = args.ways_be * env.num_mba + mba_index
 
-comment = "_measurement_action_{}_{}".format(args.ways_be, args.comment)
-writer = SummaryWriter(comment=comment)
+comment = "_measurement_action_{}_{}".format(action, args.comment)
+writer = MetricsSink(SummaryWriter(comment=comment), policy=args.metrics_policy)  # writes in the background
+time_at_start = datetime.now().strftime('%b%d_%H-%M-%S')
+run_log = RunLog(os.path.join(args.step_log_dir, time_at_start + comment + '.steplog')) if args.step_log_dir else None
 
 done = False
 log.info("Num of ways that are going to be statically allocated to BEs: {}".format(args.ways_be))
@@ -39,20 +68,25 @@ try:
     state = env.reset()
 
     while not done:
-        next_state, reward, done, info = env.step(args.ways_be)
+        next_state, reward, done, info = env.step(action)
+        if run_log is not None:
+            run_log.append(env.steps, action, reward, float('nan'), env.measurements)
 
+        info.pop('overridden', False)  # a flag of the step and not a group of metrics
         for key, value in info.items():
             write_metrics(writer, key, value, env.steps)
+        for be, progress in env.slot_progress:
+            writer.add_scalar('{}/{}'.format(PROGRESS_TAG, be), progress, env.steps)
 
     duration = env.get_experiment_duration()
     log.info("Experiment finished after {} steps.".format(env.steps))
-    writer.add_hparams({'Action': args.ways_be},
+    writer.add_hparams({'Action': action},
                        {'Results/Violations Total': env.violations / env.steps, 'Results/Time': duration})
 
     writer.add_text('duration', form_duration(duration))
-    writer.flush()
 
 finally:
-    writer.flush()
-    writer.close()
+    writer.close()  # pending records are written before closing
+    if run_log is not None:
+        run_log.close()
     env.stop()
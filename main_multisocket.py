@@ -0,0 +1,152 @@
+import os
+import multiprocessing as mp
+import logging
+from datetime import datetime
+from env_builder import EnvBuilder
+from multisocket import socket_configs, serve, QueueWriter, MetricsForwarder, setup_controller_logging, \
+    start_log_listener
+from replay_memory import memory_factory
+from utils.argparser import cmd_parser
+from utils.config_constants import *
+from utils.constants import Loaders, Schedulers
+from utils.functions import config_parser, parse_num_list, setup_logging
+from utils.metrics_sink import MetricsSink
+from utils.run_log import RunLog
+
+# This script runs one agent per socket. Each socket has its own LC service, BEs and cache, its options override the
+# base config in a section socket<N>, e.g.
+#
+#   [multisocket]
+#   sockets = 0-1
+#
+#   [socket1]
+#   pqos.cores_lc = 20
+#   scheduler.cores_be = 21-29
+#   loader.hp_port = 42172
+#   loader.cores_loader = 30
+#
+# The pqos library is initialized once in this process, which serves the pqos calls of the controllers. A controller is
+# pinned to multisocket.cores_control, by default to the cores of its loader, and never to the cores of its LC or BEs.
+
+setup_logging()
+log = logging.getLogger('simpleExample')
+
+time_at_start = datetime.now().strftime('%b%d_%H-%M-%S')
+parser = cmd_parser()
+args = parser.parse_args()
+
+from torch.utils.tensorboard import SummaryWriter
+from learner import Learner, agent_params, build_agent, train_loop
+
+config = config_parser(args.config_file)
+if config[LOADER][ACTION_INTERVAL] == "-1":
+    config[LOADER][ACTION_INTERVAL] = args.interval
+if config[AGENT][EPS_DECAY] == "-1":
+    config[AGENT][EPS_DECAY] = args.decay
+config[LOADER][QUANTILE] = args.quantile
+config[ENV][FEATURE] = args.feature
+
+comment = f"_multisocket_{args.comment}"
+
+
+def run_controller(socket, config, remote, cores, log_queue, metrics_queue):
+    """ Control loop of a socket, runs in its own process pinned to the control cores of the socket. """
+
+    setup_controller_logging(log_queue, socket)
+    if cores:
+        os.sched_setaffinity(0, cores)
+
+    params = agent_params(config[AGENT])
+    save_file = os.path.join('checkpoints', '{}{}_socket{}.pkl'.format(time_at_start, comment, socket))
+    # the learner is forked before the env is built, as in main_agent
+    learner = None
+    if args.async_learner:
+        learner = Learner(params, args.updates_per_step, save_file)
+        learner.start()
+
+    env = EnvBuilder() \
+        .build_pqos_proxy(remote) \
+        .build_sampler(config[PQOS]) \
+        .build_loader(Loaders.MEMCACHED, config[LOADER]) \
+        .build_scheduler(Schedulers(args.scheduler), config[SCHEDULER]) \
+        .build(config[ENV])
+    writer = QueueWriter(metrics_queue, socket)
+    run_log = RunLog(os.path.join(args.step_log_dir, '{}{}_socket{}.steplog'.format(time_at_start, comment, socket))) \
+        if args.step_log_dir else None
+
+    num_of_observations = env.observation_space.shape[0]
+    num_of_actions = env.action_space.n
+    log.info("Controller pinned to cores {}, {} actions.".format(cores or 'all', num_of_actions))
+
+    agent = build_agent(params, num_of_observations, num_of_actions)
+    memory = memory_factory(params['mem_type'], params['mem_size']) if learner is None else None
+
+    try:
+        step = train_loop(env, agent, writer, params, memory, learner, run_log)['steps']
+        writer.add_hparams({'socket': socket}, {'Results/Violations Total': env.violations / step,
+                                                'Results/Time': env.get_experiment_duration()})
+    finally:
+        if learner is None:
+            agent.save_checkpoint(save_file)
+        else:
+            learner.shutdown()  # the learner holds the trained state, it saves the checkpoint
+        if run_log is not None:
+            run_log.close()
+        env.stop()
+
+
+def control_cores(config):
+    """ Cores of the controller of a socket, the ones of its loader unless set in the multisocket section. """
+
+    cores = config[MULTISOCKET].get(CORES_CONTROL, fallback=config[LOADER].get(CORES_LOADER))
+    return parse_num_list(cores) if cores else []
+
+
+sockets = parse_num_list(config[MULTISOCKET][SOCKETS])
+configs = socket_configs(config, sockets)
+
+# one handler per socket, the first one initializes pqos, the rest share it
+pqos_handlers = [EnvBuilder()
+                 .build_pqos(cfg[PQOS][PQOS_INTERFACE], cfg[PQOS][CORES_LC], cfg[SCHEDULER][CORES_BE],
+                             cfg[PQOS].getint(BE_GROUPS, fallback=1), socket, cfg[PQOS].get(MBA_LEVELS),
+                             cfg[SCHEDULER].getint(CORES_PER_BE) if cfg[PQOS].getboolean(SLOT_GROUPS, fallback=False)
+                             else None)
+                 .pqos_handler for socket, cfg in zip(sockets, configs)]
+pqos_handlers[0].reset()  # monitoring and allocation are reset once, for all the sockets
+
+# fork so that the controllers inherit the parsed args and configs, they never touch pqos directly
+ctx = mp.get_context('fork')
+log_queue, metrics_queue = ctx.Queue(), ctx.Queue()
+
+remotes, controllers = [], []
+for socket, cfg, pqos_handler in zip(sockets, configs, pqos_handlers):
+    parent, child = ctx.Pipe()
+    controller = ctx.Process(target=run_controller, name='socket{}'.format(socket),
+                             args=(socket, cfg, child, control_cores(cfg), log_queue, metrics_queue))
+    controller.start()
+    child.close()
+    remotes.append(parent)
+    controllers.append(controller)
+
+# threads of the parent are started after the controllers are forked
+listener = start_log_listener(log_queue)
+writer = MetricsSink(SummaryWriter(comment=comment), policy=args.metrics_policy)
+forwarder = MetricsForwarder(metrics_queue, writer)
+forwarder.start()
+log.info("Started {} controllers, on sockets {}.".format(len(controllers), sockets))
+
+try:
+    serve(pqos_handlers, remotes)
+finally:
+    for controller in controllers:
+        controller.join()
+        if controller.exitcode != 0:
+            log.error("Controller {} exited with code {}".format(controller.name, controller.exitcode))
+
+    forwarder.stop()
+    writer.close()
+    listener.stop()
+
+    pqos_handlers[0].reset_allocation_association()
+    for pqos_handler in pqos_handlers:
+        pqos_handler.finish()
@@ -0,0 +1,139 @@
+import os
+import ast
+import logging
+from datetime import datetime
+from env_builder import EnvBuilder
+from vec_env import VecRdt, SubprocVecRdt, transition_next_states
+from replay_memory import memory_factory
+from utils.argparser import cmd_parser
+from utils.config_constants import *
+from utils.constants import Loaders, Schedulers
+from utils.functions import config_parser, setup_logging
+from utils.metrics_sink import MetricsSink
+
+# This script trains an agent on N simulated or replayed environments that are stepped together. Actions of all the
+# environments are selected with one forward pass and their transitions are stored in bulk.
+
+setup_logging()
+log = logging.getLogger('simpleExample')
+
+MEM_START_SIZE = 1000
+
+time_at_start = datetime.now().strftime('%b%d_%H-%M-%S')
+parser = cmd_parser()
+parser.add_argument('--num-envs', type=int, default=4, help='Number of environments stepped together')
+parser.add_argument('--subproc', action='store_true', help='Step the environments in a pool of worker processes')
+parser.add_argument('--num-workers', type=int, default=None, help='Size of the worker pool, one per env by default')
+parser.add_argument('--rps-levels', type=int, nargs='+', default=None, help='RPS of the simulated envs, round robin')
+args = parser.parse_args()
+
+if not (args.simulate or args.replay):
+    parser.error("Vectorized training needs a hardware free backend, use --simulate or --replay")
+
+import numpy as np
+from torch.utils.tensorboard import SummaryWriter
+from learner import agent_params, build_agent, choose_actions, store_batch
+
+
+def make_env(i):
+    """ Returns a callable that builds the ith environment, each one with its own seed, RPS and BE mix. """
+
+    def env_fn():
+        config = config_parser(args.config_file)
+        if config[LOADER][ACTION_INTERVAL] == "-1":
+            config[LOADER][ACTION_INTERVAL] = args.interval
+        config[LOADER][QUANTILE] = args.quantile
+        config[ENV][FEATURE] = args.feature
+
+        if args.replay:
+            return EnvBuilder.build_replay(config[ENV], args.replay, seed=i)
+
+        if args.rps_levels:
+            config[LOADER][LOADER_RPS] = str(args.rps_levels[i % len(args.rps_levels)])
+        config[SCHEDULER][SEED] = str(config[SCHEDULER].getint(SEED, fallback=1) + i)
+        bes = ast.literal_eval(config[SCHEDULER][BES_LIST])
+        if bes:  # rotate the queue of BEs so that each env sees a different mix
+            shift = i % len(bes)
+            config[SCHEDULER][BES_LIST] = str(bes[shift:] + bes[:shift])
+
+        return EnvBuilder() \
+            .build_simulation(config[SIMULATOR] if config.has_section(SIMULATOR) else None, seed=i) \
+            .build_pqos('SIM', config[PQOS][CORES_LC], config[SCHEDULER][CORES_BE]) \
+            .build_loader(Loaders.SIMULATED, config[LOADER]) \
+            .build_scheduler(Schedulers.SIMULATED, config[SCHEDULER]) \
+            .build(config[ENV])
+
+    return env_fn
+
+
+config = config_parser(args.config_file)
+if config[AGENT][EPS_DECAY] == "-1":
+    config[AGENT][EPS_DECAY] = args.decay
+params = agent_params(config[AGENT])
+
+env_fns = [make_env(i) for i in range(args.num_envs)]
+envs = SubprocVecRdt(env_fns, args.num_workers) if args.subproc else VecRdt(env_fns)
+
+comment = f"_vec_{args.comment}"
+writer = MetricsSink(SummaryWriter(comment=comment), policy=args.metrics_policy)
+
+num_of_observations = envs.observation_space.shape[0]
+num_of_actions = envs.action_space.n
+log.info("{} environments, {} actions, {} input features.".format(args.num_envs, num_of_actions,
+                                                                  num_of_observations))
+
+agent = build_agent(params, num_of_observations, num_of_actions)
+memory = memory_factory(params['mem_type'], params['mem_size'])
+target_update = params['target_update']
+
+step = 0
+decaying_schedule = 0
+loss = None
+
+try:
+    states = envs.reset()
+
+    # run until every environment has completed its experiment at least once
+    while not (envs.episodes > 0).all():
+        actions = choose_actions(agent, states)
+        next_states, rewards, dones, infos = envs.step(actions)
+        # transitions of steps overridden by the watchdog measure its allocation and not the action, they are dropped
+        kept = np.array([not info.pop('overridden', False) for info in infos])
+        store_batch(memory, states[kept], actions[kept], transition_next_states(next_states, dones, infos)[kept],
+                    rewards[kept], dones[kept])
+        states = next_states
+
+        step += 1
+
+        if params['mem_type'] == 'per' and memory.tree.n_entries < MEM_START_SIZE:
+            continue
+
+        # as many gradient steps as the transitions gathered, times the requested ratio
+        for _ in range(args.num_envs * args.updates_per_step):
+            try:
+                transitions, indices, is_weights = memory.sample(params['batch_size'])
+            except ValueError:  # not enough samples in memory
+                break
+            loss, errors = agent.update(transitions, is_weights)
+            memory.batch_update(indices, errors)  # only applicable for per
+            decaying_schedule += 1
+            if decaying_schedule % target_update == 0:
+                agent.update_target_net()
+
+        agent.adjust_exploration(step)  # decays with the steps of a single env
+
+        writer.add_scalar('Agent/Reward Mean', float(rewards.mean()), step)
+        writer.add_scalar('Agent/Epsilon', agent.epsilon, step)
+        if loss is not None:
+            writer.add_scalar('Agent/Loss', loss, step)
+        writer.add_scalar('Results/Violations Total', float(envs.get_violations().sum()) / (step * args.num_envs),
+                          step)
+
+    log.info("Training finished after {} steps of {} environments.".format(step, args.num_envs))
+
+finally:
+    save_file = os.path.join('checkpoints', time_at_start + comment + '.pkl')
+    agent.save_checkpoint(save_file)
+
+    writer.close()
+    envs.stop()
@@ -0,0 +1,271 @@
+import configparser
+import logging
+import logging.handlers
+import queue
+import threading
+from multiprocessing.connection import wait
+from utils.config_constants import *
+
+log = logging.getLogger('simpleExample')
+
+# Pqos().init is global to a process and the library can not be initialized again in a forked child. In multi socket
+# mode the parent process owns the pqos handlers of all the sockets and serves the calls of the controllers, one
+# process per socket, over a pipe each. Logging and metrics of the controllers are sent to the parent through queues.
+
+OK = 'ok'
+ERROR = 'error'
+METRIC_SCALAR = 'scalar'
+METRIC_HPARAMS = 'hparams'
+METRIC_TEXT = 'text'
+
+
+def socket_configs(config, sockets):
+    """
+    Builds the config of every socket. Options of section socket<N> override the base config, they are written as
+    section.option, e.g. loader.hp_port = 42172.
+
+    Parameters:
+        config: the base config
+        sockets: list of socket ids
+
+    Returns:
+        a list with a config per socket
+    """
+
+    configs = []
+    for socket in sockets:
+        socket_config = configparser.ConfigParser()
+        socket_config.read_dict(config)
+        section = SOCKET_SECTION.format(socket)
+        if config.has_section(section):
+            for key, value in config[section].items():
+                try:
+                    section_name, option = key.split('.', 1)
+                except ValueError:
+                    raise ValueError("Option {} of section {} should be of the form section.option".format(key,
+                                                                                                          section))
+                socket_config[section_name][option] = value
+        else:
+            log.warning("No section {} in config, socket {} uses the base config".format(section, socket))
+        configs.append(socket_config)
+
+    return configs
+
+
+class PqosHandlerProxy:
+    """ Pqos handler of a controller process, every call is executed by the handler of its socket in the parent. """
+
+    def __init__(self, remote):
+        self.remote = remote
+        self.lock = threading.Lock()  # the pqos sampler calls from its own thread
+        self.socket, self.num_actions, self.mba_levels, self.actions, self.monitors_slots = self._call('describe')
+
+    def _call(self, method, *args):
+        with self.lock:
+            self.remote.send((method, args))
+            status, result = self.remote.recv()
+        if status == ERROR:
+            raise RuntimeError("Pqos call {} failed on socket server: {}".format(method, result))
+
+        return result
+
+    def setup_groups(self):
+        self._call('setup_groups')
+
+    def reset(self):
+        self._call('reset')
+
+    def update(self):
+        self._call('update')
+
+    def get_hp_metrics(self, time_interval):
+        return self._call('get_hp_metrics', time_interval)
+
+    def get_be_metrics(self, time_interval):
+        return self._call('get_be_metrics', time_interval)
+
+    def stop(self):
+        self._call('stop')
+
+    def set_association_class(self):
+        self._call('set_association_class')
+
+    def set_allocation_class(self, ways_be):
+        self._call('set_allocation_class', ways_be)
+
+    def set_mba_class(self, level):
+        self._call('set_mba_class', level)
+
+    def get_slot_metrics(self, time_interval):
+        return self._call('get_slot_metrics', time_interval)
+
+    def reset_allocation_association(self):
+        self._call('reset_allocation_association')
+
+    def print_association_config(self):
+        self._call('print_association_config')
+
+    def print_allocation_config(self):
+        self._call('print_allocation_config')
+
+    def finish(self):
+        """ The parent finishes pqos once every controller is done. """
+        self.remote.close()
+
+
+class SocketHandlerServer:
+    """ Serves the pqos calls of one controller. Operations that are global to the library (reset of monitoring and
+    of allocation) would affect all the sockets, so they are scoped to the socket of the handler. """
+
+    def __init__(self, pqos_handler):
+        self.pqos_handler = pqos_handler
+        self.monitoring = False
+
+    def describe(self):
+        return (self.pqos_handler.socket, self.pqos_handler.num_actions, self.pqos_handler.mba_levels,
+                getattr(self.pqos_handler, 'actions', None), getattr(self.pqos_handler, 'monitors_slots', False))
+
+    def setup_groups(self):
+        self.pqos_handler.setup_groups()
+        self.monitoring = True
+
+    def stop(self):
+        if self.monitoring:
+            self.pqos_handler.stop()
+            self.monitoring = False
+
+    def reset(self):
+        self.stop()
+        self.reset_allocation_association()
+
+    def reset_allocation_association(self):
+        # associations are overwritten by the next set_association_class, it suffices to share all the ways
+        self.pqos_handler.set_allocation_class(-1)
+        self.pqos_handler.set_mba_class(-1)
+
+    def handle(self, method, args):
+        target = self if hasattr(self, method) else self.pqos_handler
+        return getattr(target, method)(*args)
+
+
+def serve(pqos_handlers, remotes):
+    """
+    Serves the calls of the controllers until all of them have closed their pipes.
+
+    Parameters:
+        pqos_handlers: handler of every socket
+        remotes: parent end of the pipe of every controller, in the same order
+    """
+
+    servers = {remote: SocketHandlerServer(handler) for remote, handler in zip(remotes, pqos_handlers)}
+    open_remotes = list(remotes)
+    calls = 0
+    while open_remotes:
+        for remote in wait(open_remotes):
+            try:
+                method, args = remote.recv()
+            except EOFError:  # controller is done
+                open_remotes.remove(remote)
+                continue
+            try:
+                reply = (OK, servers[remote].handle(method, args))
+            except Exception as e:
+                log.exception("Pqos call {} of socket {} failed".format(method, servers[remote].pqos_handler.socket))
+                reply = (ERROR, repr(e))
+            try:
+                remote.send(reply)
+            except (BrokenPipeError, EOFError):
+                open_remotes.remove(remote)
+            calls += 1
+
+    for server in servers.values():  # controllers that crashed may have left their groups running
+        server.stop()
+    log.info("Pqos server served {} calls.".format(calls))
+
+
+class QueueWriter:
+    """ Tensorboard writer of a controller, records are sent to the parent that writes them to a single sink. Tags are
+    prefixed with the socket so that the controllers can be told apart. """
+
+    def __init__(self, metrics_queue, socket):
+        self.metrics_queue = metrics_queue
+        self.prefix = 'Socket{}/'.format(socket)
+
+    def add_scalar(self, tag, value, step):
+        self.metrics_queue.put((METRIC_SCALAR, (self.prefix + tag, float(value), step)))
+
+    def add_hparams(self, hparams, metrics):
+        metrics = {self.prefix + key: value for key, value in metrics.items()}
+        self.metrics_queue.put((METRIC_HPARAMS, (hparams, metrics)))
+
+    def add_text(self, tag, text):
+        self.metrics_queue.put((METRIC_TEXT, (self.prefix + tag, text)))
+
+    def add_graph(self, model, input_to_model):
+        pass  # models can not be sent to another process, the graph is the same for every socket anyway
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MetricsForwarder(threading.Thread):
+    """ Moves the records of the controllers from the metrics queue to the writer of the parent. """
+
+    def __init__(self, metrics_queue, writer):
+        super().__init__(name='metrics-forwarder', daemon=True)
+        self.metrics_queue = metrics_queue
+        self.writer = writer
+        self._stopped = threading.Event()
+
+    def run(self):
+        while True:
+            try:
+                kind, record = self.metrics_queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stopped.is_set():
+                    break
+                continue
+            if kind == METRIC_SCALAR:
+                self.writer.add_scalar(*record)
+            elif kind == METRIC_HPARAMS:
+                self.writer.add_hparams(*record)
+            elif kind == METRIC_TEXT:
+                self.writer.add_text(*record)
+
+    def stop(self):
+        """ Stops once the queue is drained, the controllers must have exited. """
+        self._stopped.set()
+        self.join()
+
+
+class SocketFilter(logging.Filter):
+    """ Prefixes the messages of a controller with its socket. """
+
+    def __init__(self, socket):
+        super().__init__()
+        self.prefix = '[socket {}] '.format(socket)
+
+    def filter(self, record):
+        record.msg = self.prefix + str(record.msg)
+        return True
+
+
+def setup_controller_logging(log_queue, socket):
+    """ Called in a controller process, its records are sent to the parent instead of being written directly. """
+
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(SocketFilter(socket))
+    for logger in (logging.getLogger(), logging.getLogger('simpleExample'), logging.getLogger('rlsuite')):
+        logger.handlers = [handler]
+
+
+def start_log_listener(log_queue):
+    """ Called in the parent, writes the records of the controllers with the handlers of the parent. """
+
+    listener = logging.handlers.QueueListener(log_queue, *log.handlers, respect_handler_level=True)
+    listener.start()
+
+    return listener
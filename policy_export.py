@@ -0,0 +1,244 @@
+import argparse
+import numpy as np
+import logging
+
+log = logging.getLogger('simpleExample')
+
+# A trained DQN policy is a stack of linear layers with ReLU activations, vanilla nets have a single stack and dueling
+# nets a shared stack followed by a value and an advantage stream, Q = V + A - mean(A). The artifact is a .npz file
+# with the weights of every stack, transposed to (in, out) float32 arrays, so that the policy can be executed with
+# numpy alone. Torch is only imported to read the checkpoint during the export.
+
+VANILLA = 'vanilla'
+DUELING = 'dueling'
+STACKS = ('trunk', 'value', 'advantage')
+
+
+def _stack_of(prefix):
+    """ Stack of a layer by the name of its module, the streams of a dueling net are named after value and advantage. """
+
+    name = prefix.lower()
+    if 'adv' in name:
+        return 'advantage'
+    if 'val' in name:
+        return 'value'
+    return 'trunk'
+
+
+def _policy_state_dict(checkpoint):
+    """ Finds the weights of the policy net in a loaded checkpoint, either the state dict itself or a dict of them. """
+
+    if all(hasattr(value, 'shape') for value in checkpoint.values()):
+        return checkpoint
+    for key in ('policy_net', 'policy_net_state_dict', 'model_state_dict', 'state_dict'):
+        if key in checkpoint:
+            return checkpoint[key]
+    raise ValueError("No policy net weights in checkpoint, keys: {}".format(list(checkpoint.keys())))
+
+
+def state_dict_layers(state_dict):
+    """
+    Groups the linear layers of a policy net state dict by stack, in the order they were registered.
+
+    Parameters:
+        state_dict: mapping of parameter names to arrays
+
+    Returns:
+        the arch, vanilla or dueling, and a dict with the list of (weight, bias) of every stack, weights are (in, out)
+    """
+
+    stacks = {stack: [] for stack in STACKS}
+    for key, weight in state_dict.items():
+        prefix, _, kind = key.rpartition('.')
+        if kind == 'bias':
+            continue
+        if kind != 'weight' or weight.ndim != 2:
+            raise ValueError("Only linear layers can be exported, found {} of shape {}".format(key, weight.shape))
+        bias = state_dict[prefix + '.bias']
+        stacks[_stack_of(prefix)].append((np.ascontiguousarray(weight.T, dtype=np.float32),
+                                          np.asarray(bias, dtype=np.float32)))
+
+    arch = DUELING if stacks['value'] or stacks['advantage'] else VANILLA
+    if arch == DUELING and not (stacks['value'] and stacks['advantage']):
+        raise ValueError("Dueling net should have both a value and an advantage stream")
+    if arch == DUELING and stacks['value'][-1][0].shape[1] != 1:
+        raise ValueError("Value stream should have a single output")
+    for stack in STACKS:  # the dims of consecutive layers must match
+        layers = stacks['trunk'] + stacks[stack] if stack != 'trunk' else stacks['trunk']
+        for (w_in, _), (w_out, _) in zip(layers, layers[1:]):
+            if w_in.shape[1] != w_out.shape[0]:
+                raise ValueError("Layers of stack {} do not form a chain: {} -> {}".format(stack, w_in.shape,
+                                                                                           w_out.shape))
+
+    return arch, stacks
+
+
+def save_policy(path, arch, stacks):
+    """ Writes the layers of a policy as a .npz artifact. """
+
+    arrays = {'arch': np.array(arch)}
+    for stack, layers in stacks.items():
+        for i, (weight, bias) in enumerate(layers):
+            arrays['{}_w{}'.format(stack, i)] = weight
+            arrays['{}_b{}'.format(stack, i)] = bias
+    np.savez(path, **arrays)
+
+
+def load_policy(path):
+    """ Reads the arch and the layers of every stack from a .npz artifact. """
+
+    with np.load(path) as artifact:
+        arch = str(artifact['arch'])
+        stacks = {}
+        for stack in STACKS:
+            layers = []
+            while '{}_w{}'.format(stack, len(layers)) in artifact:
+                i = len(layers)
+                layers.append((artifact['{}_w{}'.format(stack, i)], artifact['{}_b{}'.format(stack, i)]))
+            stacks[stack] = layers
+
+    return arch, stacks
+
+
+def checkpoint_layers(checkpoint_path):
+    """ Reads the arch and the layers of every stack from a checkpoint saved by the agent. """
+    import torch  # only reading checkpoints needs torch
+
+    checkpoint = torch.load(checkpoint_path, map_location='cpu')
+    state_dict = {key: value.detach().numpy() for key, value in _policy_state_dict(checkpoint).items()}
+
+    return state_dict_layers(state_dict)
+
+
+def export_checkpoint(checkpoint_path, path):
+    """
+    Exports the policy net of a checkpoint as a numpy artifact.
+
+    Parameters:
+        checkpoint_path: checkpoint saved by the agent
+        path: the .npz file to write
+
+    Returns:
+        the arch of the exported net
+    """
+
+    arch, stacks = checkpoint_layers(checkpoint_path)
+    save_policy(path, arch, stacks)
+
+    return arch
+
+
+def load_any(path):
+    """ Numpy policy of an exported artifact or, importing torch, of a checkpoint of the agent. """
+
+    if path.endswith('.npz'):
+        return NumpyPolicy(path)
+    return NumpyPolicy(path, checkpoint_layers(path))
+
+
+def verify_export(agent, policy, samples=1000, tolerance=1e-4, seed=0):
+    """ Compares the q values of the numpy policy with those of the torch policy net on random states. """
+    import torch
+
+    states = np.random.RandomState(seed).standard_normal((samples, policy.num_observations)).astype(np.float32)
+    with torch.no_grad():
+        expected = agent.policy_net(torch.from_numpy(states).to(agent.device)).cpu().numpy()
+    error = max(np.abs(policy.q_values(state) - q).max() for state, q in zip(states, expected))
+    if error > tolerance:
+        raise ValueError("Exported policy differs from the checkpoint, max error {:.2e}".format(error))
+
+    return error
+
+
+class NumpyPolicy:
+    """ Greedy policy of a trained net on numpy, with all the intermediate buffers allocated once. It has the
+    choose_action of the agent, exploration is always off. """
+
+    epsilon = 0.
+
+    def __init__(self, path, layers=None):
+        """
+        Parameters:
+            path: the .npz artifact
+            layers: the arch and stacks of the policy, if given path is not read
+        """
+        self.path = path
+        self.arch, stacks = layers if layers is not None else load_policy(path)
+        self.num_observations = (stacks['trunk'] or stacks['advantage'])[0][0].shape[0]
+        self.num_actions = (stacks['advantage'] or stacks['trunk'])[-1][0].shape[1]
+        self.input = np.zeros(self.num_observations, dtype=np.float32)
+        # a layer is its weight, bias and output buffer
+        self.stacks = {stack: [(weight, bias, np.zeros(weight.shape[1], dtype=np.float32))
+                               for weight, bias in layers] for stack, layers in stacks.items()}
+
+    @staticmethod
+    def _forward(x, layers, activate_last):
+        for i, (weight, bias, out) in enumerate(layers):
+            np.dot(x, weight, out=out)
+            out += bias
+            if activate_last or i < len(layers) - 1:
+                np.maximum(out, 0., out=out)
+            x = out
+        return x
+
+    def q_values(self, state):
+        """ Q values of a state, the returned array is reused by the next call. """
+
+        self.input[:] = state
+        if self.arch == VANILLA:
+            return self._forward(self.input, self.stacks['trunk'], False)
+
+        features = self._forward(self.input, self.stacks['trunk'], True)
+        value = self._forward(features, self.stacks['value'], False)
+        advantage = self._forward(features, self.stacks['advantage'], False)
+        advantage += value[0] - advantage.mean()
+
+        return advantage
+
+    def choose_action(self, state):
+        return int(self.q_values(state).argmax())
+
+    def batch_q_values(self, states):
+        """ Q values of a batch of states, allocates its outputs, meant for offline use. """
+
+        def forward(x, layers, activate_last):
+            for i, (weight, bias, _) in enumerate(layers):
+                x = x @ weight + bias
+                if activate_last or i < len(layers) - 1:
+                    x = np.maximum(x, 0.)
+            return x
+
+        states = np.asarray(states, dtype=np.float32)
+        if self.arch == VANILLA:
+            return forward(states, self.stacks['trunk'], False)
+
+        features = forward(states, self.stacks['trunk'], True)
+        advantage = forward(features, self.stacks['advantage'], False)
+        return forward(features, self.stacks['value'], False) + advantage - advantage.mean(axis=1, keepdims=True)
+
+
+if __name__ == '__main__':
+    from utils.functions import setup_logging
+
+    setup_logging()
+    parser = argparse.ArgumentParser(description='Exports a checkpoint of the agent as a torch free numpy policy')
+    parser.add_argument('checkpoint', help='Checkpoint saved by the agent')
+    parser.add_argument('-o', '--output', help='The .npz file to write, next to the checkpoint by default')
+    parser.add_argument('-c', '--config-file', help='Config the agent was trained with, to verify the export')
+    args = parser.parse_args()
+
+    output = args.output or args.checkpoint.rsplit('.', 1)[0] + '.npz'
+    arch = export_checkpoint(args.checkpoint, output)
+    policy = NumpyPolicy(output)
+    log.info("Exported {} policy, {} inputs, {} actions, to {}".format(arch, policy.num_observations,
+                                                                       policy.num_actions, output))
+
+    if args.config_file:
+        from learner import agent_params, build_agent
+        from utils.config_constants import AGENT
+        from utils.functions import config_parser
+
+        params = agent_params(config_parser(args.config_file)[AGENT])
+        params['checkpoint'] = args.checkpoint
+        agent = build_agent(params, policy.num_observations, policy.num_actions)
+        log.info("Export verified, max q value error {:.2e}".format(verify_export(agent, policy)))
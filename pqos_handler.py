@@ -1,33 +1,114 @@
-from pqos import Pqos
-from pqos.capability import PqosCap, CPqosMonitor
-from pqos.cpuinfo import PqosCpuInfo
-from pqos.monitoring import PqosMon
-from pqos.l3ca import PqosCatL3
-from pqos.allocation import PqosAlloc
-import logging.config
+import os
+import threading
+import logging
 from random import randint, randrange
 from abc import ABC, abstractmethod
 
-logging.config.fileConfig('logging.conf')
 log = logging.getLogger('simpleExample')
 
-# NOTE we define all possible masks for our server which has 20 ways in LLC (L3)
-# Due to pqos limitation on the left side the min value of ways is 2 so HP service will always have at least two ways
+# The pqos library is imported only by the handlers that use it, so the mock handler and the helpers of this module
+# work on a machine without it.
 
-L3_NUM_WAYS = 20  # NOTE consider getting this number by CpuInfo
+_pqos_users = 0  # Pqos().init is process global, handlers of different sockets share it
 
-# ways that can be assigned to BEs
-ways = [0x00001, 0x00003, 0x00007, 0x0000f,
-        0x0001f, 0x0003f, 0x0007f, 0x000ff,
-        0x001ff, 0x003ff, 0x007ff, 0x00fff,
-        0x01fff, 0x03fff, 0x07fff, 0x0ffff,
-        0x1ffff, 0x3ffff, 0x7ffff, 0xfffff]
+MBA_UNTHROTTLED = 100  # percentage of the available memory bandwidth
+MBA_AUTO = 'auto'
 
-# ways = [(1 << i) - 1 for i in range(1, L3_NUM_WAYS + 1)]
+# NOTE masks are computed from the capabilities of the socket. Ways are split in contiguous, non overlapping
+# partitions, BE groups take the lowest ways and HP the highest. Every group gets at least the minimum number of bits
+# that pqos accepts in a mask, so HP service will always have at least that many ways.
 
-base = (1 << L3_NUM_WAYS) - 1  #
 
-# base = ways[-1]
+def contiguous_mask(num_ways, offset=0):
+    """ Mask of num_ways contiguous ways starting from way offset. """
+
+    return ((1 << num_ways) - 1) << offset
+
+
+def partition_masks(ways_per_group):
+    """ Contiguous non overlapping masks, one per group, the first group takes the lowest ways. """
+
+    masks = []
+    offset = 0
+    for num_ways in ways_per_group:
+        masks.append(contiguous_mask(num_ways, offset))
+        offset += num_ways
+
+    return masks
+
+
+def allocation_actions(num_ways, min_cbm_bits=1, num_be_groups=1):
+    """
+    Enumerates the ways splits that an action can select.
+
+    Parameters:
+        num_ways: number of ways of the L3 cache
+        min_cbm_bits: minimum number of ways of a group
+        num_be_groups: number of BE groups, each one has its own class of service
+
+    Returns:
+        a list of tuples with the ways of each BE group followed by the ways of HP. For a single BE group, action i
+        gives i + 1 ways to the BEs as it always did, so --ways-be and old checkpoints keep their meaning. Actions
+        below min_cbm_bits give min_cbm_bits ways. With more BE groups splits are enumerated in lexicographic order,
+        the index is not monotone in the ways of the BEs.
+    """
+
+    if num_be_groups == 1:
+        return [(max(ways_be, min_cbm_bits), num_ways - max(ways_be, min_cbm_bits))
+                for ways_be in range(1, num_ways - min_cbm_bits + 1)]
+
+    def splits(total, groups):
+        if groups == 1:
+            yield (total,)
+            return
+        for first in range(min_cbm_bits, total - min_cbm_bits * (groups - 1) + 1):
+            for rest in splits(total - first, groups - 1):
+                yield (first,) + rest
+
+    return list(splits(num_ways, num_be_groups + 1))
+
+
+def mba_auto_levels(throttle_max=90, throttle_step=10):
+    """ Throttle levels, in percent of bandwidth and in ascending order, from the MBA capabilities. """
+
+    return list(range(MBA_UNTHROTTLED - throttle_max, MBA_UNTHROTTLED + 1, throttle_step))
+
+
+def split_groups(items, num_groups):
+    """ Splits a list in num_groups contiguous and (almost) equal parts. """
+
+    size, remainder = divmod(len(items), num_groups)
+    groups = []
+    start = 0
+    for i in range(num_groups):
+        end = start + size + (1 if i < remainder else 0)
+        groups.append(items[start:end])
+        start = end
+
+    return groups
+
+
+def pqos_init(interface):
+    """ Initializes the pqos library once per process, every handler that calls it must call pqos_fini. """
+
+    from pqos import Pqos
+
+    global _pqos_users
+    pqos = Pqos()
+    if _pqos_users == 0:
+        pqos.init(interface)
+    _pqos_users += 1
+
+    return pqos
+
+
+def pqos_fini(pqos):
+    """ Finalizes the pqos library when its last user is done with it. """
+
+    global _pqos_users
+    _pqos_users -= 1
+    if _pqos_users == 0:
+        pqos.fini()
 
 
 def bytes_to_kb(num_bytes):
@@ -59,6 +140,7 @@ def get_event_name(event_type):
     :param event_type: monitoring event type
     :return: a string label
     """
+    from pqos.capability import CPqosMonitor
 
     event_map = {
         CPqosMonitor.PQOS_MON_EVENT_L3_OCCUP: 'l3_occup',
@@ -89,6 +171,16 @@ def get_metrics(group_values, time_interval):
     return ipc, misses, llc, mbl_ps, mbr_ps, cycles, instructions
 
 
+def aggregate_metrics(metrics):
+    """ Combines the metrics of several groups, as returned by get_metrics, into the metrics of their union. """
+
+    ipc, misses, llc, mbl_ps, mbr_ps, cycles, instructions = zip(*metrics)
+    cycles, instructions = sum(cycles), sum(instructions)
+
+    return instructions / cycles if cycles > 0 else 0., sum(misses), sum(llc), sum(mbl_ps), sum(mbr_ps), cycles, \
+        instructions
+
+
 def get_metrics_random():
     """ Mock method that returns same arguments as the func get_metrics """
     ipc = randrange(0, 2)
@@ -105,20 +197,52 @@ def get_metrics_random():
 class PqosHandler(ABC):
     """ Generic class for monitoring """
 
-    def __init__(self, interface, socket=0, cos_id_hp=1, cos_id_be=2):
-        self.pqos = Pqos()
-        self.pqos.init(interface)
+    def __init__(self, interface, socket=0, cos_id_hp=1, cos_id_be=2, num_be_groups=1, mba_levels=None):
+        from pqos.capability import PqosCap
+        from pqos.cpuinfo import PqosCpuInfo
+        from pqos.monitoring import PqosMon
+        from pqos.l3ca import PqosCatL3
+        from pqos.allocation import PqosAlloc
+        from pqos.mba import PqosMba
+
+        self.pqos = pqos_init(interface)
         self.mon = PqosMon()
         self.alloc = PqosAlloc()
         self.l3ca = PqosCatL3()
+        self.mba = PqosMba()
         self.cap = PqosCap()
         self.cpu_info = PqosCpuInfo()
         self.socket = socket  # The experiment takes place at a signle socket
         self.cos_id_hp = cos_id_hp
         self.cos_id_be = cos_id_be
+        self.cos_ids_be = [cos_id_be + i for i in range(num_be_groups)]  # one class of service per BE group
         self.group_hp, self.group_be = None, None
         self.events = self.get_supported_events()
 
+        l3ca_cap = self.cap.get_type('l3ca')
+        self.num_ways = l3ca_cap.num_ways
+        self.num_classes = l3ca_cap.num_classes
+        self.min_cbm_bits = self.get_min_cbm_bits()
+        if max(self.cos_ids_be + [cos_id_hp]) >= self.num_classes:
+            raise ValueError("Socket supports {} classes of service, {} BE groups do not fit"
+                             .format(self.num_classes, num_be_groups))
+        log.info("L3 CAT: {} ways, {} classes of service, min {} bits per mask".format(
+            self.num_ways, self.num_classes, self.min_cbm_bits))
+        if num_be_groups == 1 and self.min_cbm_bits > 1:
+            log.warning("Actions 0-{} all give {} ways to the BEs, the minimum mask".format(self.min_cbm_bits - 2,
+                                                                                             self.min_cbm_bits))
+
+        # every action needs a single l3ca.set call with the precomputed classes of service
+        self.actions = allocation_actions(self.num_ways, self.min_cbm_bits, num_be_groups)
+        self.cos_sets = [self._cos_set(partition_masks(action)) for action in self.actions]
+        full_mask = contiguous_mask(self.num_ways)
+        self.cos_set_shared = self._cos_set([full_mask] * (num_be_groups + 1))
+
+        # MBA throttles the BEs only, a single level means that MBA is not managed
+        self.mba_levels = self.get_mba_levels(mba_levels)
+        self.mba_sets = [self._mba_set(level) for level in self.mba_levels]
+        self.mba_set_unthrottled = self._mba_set(MBA_UNTHROTTLED)
+
     @abstractmethod
     def setup_groups(self):  # NOTE this MUST follow reset of monitoring
         """Sets up monitoring groups. Needs to be implemented by a derived class."""
@@ -137,7 +261,60 @@ class PqosHandler(ABC):
         raise NotImplementedError
 
     def finish(self):
-        self.pqos.fini()
+        pqos_fini(self.pqos)
+
+    def get_min_cbm_bits(self):
+        """ Returns the minimum number of bits that must be set in a mask, 1 if the library can not report it. """
+
+        try:
+            return self.l3ca.get_min_cbm_bits()
+        except Exception:
+            log.warning("Minimum number of mask bits is not available, assuming 1")
+            return 1
+
+    def get_mba_levels(self, mba_levels):
+        """
+        Returns the MBA levels of the BEs, in percent of the available bandwidth.
+
+        Parameters:
+            mba_levels: None to leave MBA unmanaged, 'auto' for the levels supported by the socket or a list of levels
+        """
+
+        if mba_levels is None:
+            return [MBA_UNTHROTTLED]
+        try:
+            mba_cap = self.cap.get_type('mba')
+        except Exception:
+            log.warning("MBA is not supported, memory bandwidth will not be managed")
+            return [MBA_UNTHROTTLED]
+        if mba_levels == MBA_AUTO:
+            mba_levels = mba_auto_levels(mba_cap.throttle_max, mba_cap.throttle_step)
+        mba_levels = sorted(mba_levels)
+        if mba_levels[0] <= 0 or mba_levels[-1] > MBA_UNTHROTTLED:
+            raise ValueError("MBA levels should be in (0, 100], got {}".format(mba_levels))
+        log.info("MBA: BE levels {}".format(mba_levels))
+
+        return mba_levels
+
+    def _mba_set(self, level):
+        """ MBA classes of service that throttle the BEs to level, HP is never throttled. """
+
+        coses = [self.mba.COS(cos_id, level) for cos_id in self.cos_ids_be]
+        coses.append(self.mba.COS(self.cos_id_hp, MBA_UNTHROTTLED))
+
+        return coses
+
+    def _cos_set(self, masks):
+        """ Classes of service for the given masks, the last mask is the one of HP. """
+
+        coses = [self.l3ca.COS(cos_id, mask) for cos_id, mask in zip(self.cos_ids_be, masks[:-1])]
+        coses.append(self.l3ca.COS(self.cos_id_hp, masks[-1]))
+
+        return coses
+
+    @property
+    def num_actions(self):
+        return len(self.actions)
 
     def get_supported_events(self):
         """ Returns a list of supported monitoring events. """
@@ -151,6 +328,11 @@ class PqosHandler(ABC):
 
         return events
 
+    def get_socket_cores(self):
+        """ Returns the cores of the socket of the handler. """
+
+        return self.cpu_info.get_cores(self.socket)
+
     def get_all_cores(self):
         """ Returns a list of all available cores. Used for informational reasons only. """
 
@@ -190,23 +372,36 @@ class PqosHandler(ABC):
         Sets up allocation classes of service on selected CPU sockets
 
         Parameters:
-            ways_be: num of ways to be assigned for bes
+            ways_be: index of the action, i.e. of the ways split between the groups
         """
         if ways_be == -1:  # default setting, all ways can be accessed by both groups
-            mask_be = ways[-1]
-            mask_hp = ways[-1]
+            coses = self.cos_set_shared
         else:
-            mask_be = ways[ways_be]
-            mask_hp = mask_be ^ base
-        cos_hp = self.l3ca.COS(self.cos_id_hp, mask_hp)
-        cos_be = self.l3ca.COS(self.cos_id_be, mask_be)
+            coses = self.cos_sets[ways_be]
 
         try:
-            self.l3ca.set(self.socket, [cos_hp, cos_be])
+            self.l3ca.set(self.socket, coses)
         except:
             log.error("Setting up cache allocation class of service failed!")
             raise
 
+    def set_mba_class(self, level):
+        """
+        Sets up MBA classes of service on the socket.
+
+        Parameters:
+            level: index of the MBA level of the BEs, -1 for no throttling
+        """
+        if len(self.mba_levels) == 1:  # MBA is not managed
+            return
+        coses = self.mba_set_unthrottled if level == -1 else self.mba_sets[level]
+
+        try:
+            self.mba.set(self.socket, coses)
+        except:
+            log.error("Setting up MBA class of service failed!")
+            raise
+
     def print_allocation_config(self):
         """  """
         sockets = [self.socket]  # self.cpu_info.get_sockets()
@@ -217,7 +412,7 @@ class PqosHandler(ABC):
                 log.debug("L3CA COS definitions for Socket %u:" % socket)
 
                 for cos in coses:
-                    if cos.class_id == self.cos_id_be or cos.class_id == self.cos_id_hp:
+                    if cos.class_id in self.cos_ids_be or cos.class_id == self.cos_id_hp:
                         cos_params = (cos.class_id, cos.mask)
                         log.debug("    L3CA COS%u => MASK 0x%x" % cos_params)
             except:
@@ -238,25 +433,67 @@ class PqosHandler(ABC):
 class PqosHandlerCore(PqosHandler):
     """ PqosHandler per core. """
 
-    def __init__(self, cores_hp, cores_be):
+    def __init__(self, cores_hp, cores_be, num_be_groups=1, socket=0, mba_levels=None, slot_size=None):
         """
         Initializes object of this class with cores and events to monitor.
 
         Parameters:
             cores_hp: a list of cores assigned to hp
             cores_be: a list of cores assigned to bes
+            num_be_groups: cores_be are split in this many groups, each one with its own class of service
+            socket: socket of the cores, classes of service are defined on it
+            mba_levels: MBA levels of the BEs, see PqosHandler.get_mba_levels
+            slot_size: if set, cores_be are monitored in groups of that many cores, one per BE slot of the scheduler
         """
 
         interface = "MSR"
-        super(PqosHandlerCore, self).__init__(interface)
+        super(PqosHandlerCore, self).__init__(interface, socket=socket, num_be_groups=num_be_groups,
+                                              mba_levels=mba_levels)
         self.cores_hp = cores_hp
         self.cores_be = cores_be
+        self.cores_be_groups = split_groups(cores_be, num_be_groups)
+        # a core can be monitored by a single group, so with per slot groups the BE metrics are their aggregate
+        self.cores_slots = [cores_be[i:i + slot_size] for i in range(0, len(cores_be), slot_size)] if slot_size \
+            else []
+        self.groups_slot = []
+
+    @property
+    def monitors_slots(self):
+        return bool(self.cores_slots)
 
     def setup_groups(self):
         """ Starts monitoring for each group of cores. """
 
         self.group_hp = self.mon.start(self.cores_hp, self.events)
-        self.group_be = self.mon.start(self.cores_be, self.events)
+        if self.cores_slots:
+            self.groups_slot = [self.mon.start(cores, self.events) for cores in self.cores_slots]
+        else:
+            self.group_be = self.mon.start(self.cores_be, self.events)
+
+    def update(self):
+        if self.groups_slot:
+            self.mon.poll([self.group_hp] + self.groups_slot)
+        else:
+            super(PqosHandlerCore, self).update()
+
+    def get_be_metrics(self, time_interval):
+        if self.groups_slot:
+            return aggregate_metrics(self.get_slot_metrics(time_interval))
+        return super(PqosHandlerCore, self).get_be_metrics(time_interval)
+
+    def get_slot_metrics(self, time_interval):
+        """ Returns the metrics of every BE slot, empty if slots are not monitored separately. """
+
+        return [get_metrics(group.values, time_interval) for group in self.groups_slot]
+
+    def stop(self):
+        if self.groups_slot:
+            self.group_hp.stop()
+            for group in self.groups_slot:
+                group.stop()
+            self.groups_slot = []
+        else:
+            super(PqosHandlerCore, self).stop()
 
     def set_association_class(self):
         """ Sets up association classes of service on selected CPUs. """
@@ -264,8 +501,9 @@ class PqosHandlerCore(PqosHandler):
         try:
             for core_hp in self.cores_hp:
                 self.alloc.assoc_set(core_hp, self.cos_id_hp)
-            for core_be in self.cores_be:
-                self.alloc.assoc_set(core_be, self.cos_id_be)
+            for cos_id, cores in zip(self.cos_ids_be, self.cores_be_groups):
+                for core_be in cores:
+                    self.alloc.assoc_set(core_be, cos_id)
         except:
             log.error("Setting association between core and class of service failed!")
             raise
@@ -279,44 +517,118 @@ class PqosHandlerCore(PqosHandler):
 
 
 class PqosHandlerPid(PqosHandler):
-    """ PqosHandler per PID (OS interface only). """
+    """ PqosHandler per PID (OS interface only). PIDs of BEs can be added and removed while monitoring runs, see
+    add_be_pids and remove_be_pids. """
 
-    def __init__(self, pid_hp, pids_be):
+    def __init__(self, pid_hp, pids_be, num_be_groups=1, socket=0, mba_levels=None):
         """
         Initializes object of this class with PIDs and events to monitor.
 
         Parameters:
             pid_hp: pid of hp
             pids_be: a list of PIDs to monitor
+            num_be_groups: pids_be are split in this many groups, each one with its own class of service
+            socket: socket where the pids run, classes of service are defined on it
+            mba_levels: MBA levels of the BEs, see PqosHandler.get_mba_levels
         """
 
         interface = "OS"
-        super(PqosHandlerPid, self).__init__(interface)
+        super(PqosHandlerPid, self).__init__(interface, socket=socket, num_be_groups=num_be_groups,
+                                             mba_levels=mba_levels)
         self.pid_hp = pid_hp
-        self.pids_be = pids_be
+        self.pids_be = list(pids_be)
+        # class of service of every BE pid, pids added later take the class of the slot of their BE
+        self.pid_cos_be = {pid: cos_id for cos_id, pids in zip(self.cos_ids_be, split_groups(self.pids_be,
+                                                                                                num_be_groups))
+                           for pid in pids}
+        self.lock = threading.Lock()  # pids are published by the scheduler while the sampler may poll
+
+    def _alive_pids_be(self):
+        return [pid for pid in self.pids_be if os.path.exists('/proc/{}'.format(pid))]
 
     def setup_groups(self):
         """ Starts monitoring for group of PID(s). """
 
-        # NOTE there is the ability to add/remove pids_be to/from a group
-
         self.group_hp = self.mon.start_pids([self.pid_hp], self.events)
-        self.group_be = self.mon.start_pids(self.pids_be, self.events)
+        pids_be = self._alive_pids_be()
+        # a group can not be empty, the BE group is started with the first pids that are published
+        self.group_be = self.mon.start_pids(pids_be, self.events) if pids_be else None
+
+    def update(self):
+        with self.lock:
+            self.mon.poll([group for group in (self.group_hp, self.group_be) if group is not None])
+
+    def get_be_metrics(self, time_interval):
+        if self.group_be is None:
+            return 0., 0, 0., 0., 0., 0, 0
+        return super(PqosHandlerPid, self).get_be_metrics(time_interval)
+
+    def stop(self):
+        self.group_hp.stop()
+        self.group_hp = None
+        if self.group_be is not None:
+            self.group_be.stop()
+            self.group_be = None
+
+    def add_be_pids(self, pids, slot=0):
+        """
+        Adds the pids of a BE to the monitoring group and associates them with the class of service of the BE.
+
+        Parameters:
+            pids: the pids of the processes of the BE
+            slot: slot of the BE, it selects the class of service when there are more than one BE groups
+        """
+
+        cos_id = self.cos_ids_be[slot % len(self.cos_ids_be)]
+        with self.lock:
+            for pid in pids:
+                self.pid_cos_be[pid] = cos_id
+                self.pids_be.append(pid)
+            if self.group_hp is None:  # monitoring is not running, pids are picked up by the next setup_groups
+                return
+            try:
+                if self.group_be is None:
+                    self.group_be = self.mon.start_pids(list(pids), self.events)
+                else:
+                    self.group_be.add_pids(list(pids))
+                for pid in pids:
+                    self.alloc.assoc_set_pid(pid, cos_id)
+            except Exception as e:  # processes that exit in the meantime are not an error
+                log.warning("Adding BE pids {} failed ({})".format(pids, e))
+
+    def remove_be_pids(self, pids, slot=0):
+        """ Removes the pids of a BE from the monitoring group. The pids may have already exited. """
+
+        with self.lock:
+            pids = [pid for pid in pids if pid in self.pid_cos_be]
+            for pid in pids:
+                del self.pid_cos_be[pid]
+                self.pids_be.remove(pid)
+            if self.group_be is None or not pids:
+                return
+            try:
+                if not self.pids_be:  # a group can not be left empty
+                    self.group_be.stop()
+                    self.group_be = None
+                else:
+                    self.group_be.remove_pids(pids)
+            except Exception as e:
+                log.warning("Removing BE pids {} failed ({})".format(pids, e))
 
     def set_association_class(self):
         """ Sets up association classes of service on hp pid as well as in be pids. """
 
         try:
             self.alloc.assoc_set_pid(self.pid_hp, self.cos_id_hp)
-            for pid in self.pids_be:
-                self.alloc.assoc_set_pid(pid, self.cos_id_be)
+            for pid in self._alive_pids_be():
+                self.alloc.assoc_set_pid(pid, self.pid_cos_be[pid])
         except:
             log.error("Setting association between pid and class of service failed!")
             raise
 
     def print_association_config(self):
         """  """
-        pids = [self.pid_hp] + self.pids_be
+        pids = [self.pid_hp] + self._alive_pids_be()
         for pid in pids:
             class_id = self.alloc.assoc_get_pid(pid)
             log.debug("Pid %u => COS%u" % (pid, class_id))
@@ -325,12 +637,33 @@ class PqosHandlerPid(PqosHandler):
 class PqosHandlerMock:
     """ Mock class for use in environments where pqos cannot be installed. """
 
-    def __int__(self, socket=0, cos_id_hp=1, cos_id_be=2):
-        pass
+    def __init__(self, socket=0, cos_id_hp=1, cos_id_be=2, num_be_groups=1, num_ways=20, min_cbm_bits=1,
+                 mba_levels=None, num_slots=0):
+        self.socket = socket
+        self.num_slots = num_slots
+        if mba_levels is None:
+            mba_levels = [MBA_UNTHROTTLED]
+        elif mba_levels == MBA_AUTO:
+            mba_levels = mba_auto_levels()
+        self.mba_levels = sorted(mba_levels)
+        self.num_ways = num_ways
+        self.min_cbm_bits = min_cbm_bits
+        self.actions = allocation_actions(num_ways, min_cbm_bits, num_be_groups)
+
+    @property
+    def num_actions(self):
+        return len(self.actions)
+
+    @property
+    def monitors_slots(self):
+        return self.num_slots > 0
 
     def setup_groups(self):
         pass
 
+    def get_socket_cores(self):
+        return None
+
     def reset(self):
         pass
 
@@ -343,6 +676,9 @@ class PqosHandlerMock:
     def get_be_metrics(self, time_interval):
         return get_metrics_random()
 
+    def get_slot_metrics(self, time_interval):
+        return [get_metrics_random() for _ in range(self.num_slots)]
+
     def stop(self):
         pass
 
@@ -352,6 +688,9 @@ class PqosHandlerMock:
     def set_allocation_class(self, ways_be):
         pass
 
+    def set_mba_class(self, level):
+        pass
+
     def reset_allocation_association(self):
         pass
 
@@ -0,0 +1,143 @@
+import time
+import threading
+import numpy as np
+import logging
+from utils.constants import pqos_counters
+
+log = logging.getLogger('simpleExample')
+
+GROUPS = ('hp', 'be')
+
+# columns of a sample, per group, in the order of pqos_handler.get_metrics
+IPC, MISSES, LLC, MBL, MBR, CYCLES, INSTRUCTIONS = range(len(pqos_counters))
+
+
+class PqosSampler(threading.Thread):
+    """ Polls the monitoring groups of a pqos handler at a sub-interval rate on a background thread. Samples are kept
+    in a fixed size ring buffer, from which per window aggregates (mean, max, p95, slope) of every counter are
+    computed, so that short bursts that are averaged away in a single delta over the whole window become visible.
+    While the sampler runs it is the only one that polls the handler. """
+
+    def __init__(self, pqos_handler, period_ms, capacity=4096):
+        """
+        Parameters:
+            pqos_handler: the handler to poll, PqosHandlerCore, PqosHandlerPid or the mock
+            period_ms: sampling period in ms
+            capacity: number of samples kept, it should cover the longest window
+        """
+        super().__init__(name='pqos-sampler', daemon=True)
+        self.pqos_handler = pqos_handler
+        self.period = period_ms / 1000.
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.intervals = np.zeros(capacity)
+        self.samples = np.zeros((capacity, len(GROUPS), len(pqos_counters)))
+        self.count = 0  # samples taken so far, the next one is written at count % capacity
+
+        self.jitter_total = 0.
+        self.jitter_max = 0.
+
+        self._running = threading.Event()  # cleared while paused
+        self._stopped = threading.Event()
+        self._idle = threading.Event()  # set while the thread does not touch the handler
+        self._idle.set()
+
+    def resume(self):
+        """ Starts or resumes sampling, the handler must have its monitoring groups set up. """
+
+        if not self.is_alive():
+            self.start()
+        self._running.set()
+
+    def pause(self):
+        """ Pauses sampling and waits until the handler is not in use, e.g. before the handler is reset. """
+
+        self._running.clear()
+        self._idle.wait()
+
+    def stop(self):
+        self._stopped.set()
+        self._running.set()  # wake up if paused
+        if self.is_alive():
+            self.join()
+        self.log_jitter()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._running.wait()
+            # the first poll after (re)starting only sets the baseline of the deltas
+            self._idle.clear()
+            self.pqos_handler.update()
+            self._idle.set()
+            last = time.monotonic()
+            deadline = last
+            while self._running.is_set() and not self._stopped.is_set():
+                deadline += self.period
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                if not self._running.is_set():
+                    break
+                self._idle.clear()
+                now = time.monotonic()
+                self.pqos_handler.update()
+                interval = now - last
+                self._store(now, interval)
+                self._idle.set()
+
+                jitter = abs(interval - self.period)
+                self.jitter_total += jitter
+                self.jitter_max = max(self.jitter_max, jitter)
+                last = now
+
+    def _store(self, now, interval):
+        index = self.count % self.capacity
+        self.times[index] = now
+        self.intervals[index] = interval
+        self.samples[index, 0] = self.pqos_handler.get_hp_metrics(interval)
+        self.samples[index, 1] = self.pqos_handler.get_be_metrics(interval)
+        self.count += 1
+
+    def mark(self):
+        """ Marks the start of a window, returns the position to pass to window. """
+
+        return self.count
+
+    def window(self, start):
+        """ Aggregates the samples taken since start.
+
+        Returns:
+            a dict per group with the totals of the window, in the format of pqos_handler.get_metrics, and the mean,
+            max, p95 and slope (per second) of every counter
+        """
+        end = self.count
+        start = max(start, end - self.capacity)
+        if end == start:  # window shorter than a period, nothing to aggregate
+            return None
+        indices = np.arange(start, end) % self.capacity
+        times = self.times[indices]
+        intervals = self.intervals[indices]
+        samples = self.samples[indices]
+        duration = intervals.sum()
+
+        aggregates = {}
+        for g, group in enumerate(GROUPS):
+            values = samples[:, g]
+            cycles, instructions = values[:, CYCLES].sum(), values[:, INSTRUCTIONS].sum()
+            totals = (instructions / cycles if cycles > 0 else 0., values[:, MISSES].sum(), values[-1, LLC],
+                      (values[:, MBL] * intervals).sum() / duration, (values[:, MBR] * intervals).sum() / duration,
+                      cycles, instructions)
+            if len(values) > 1:
+                slope = np.polyfit(times - times[0], values, 1)[0]
+            else:
+                slope = np.zeros(len(pqos_counters))
+            aggregates[group] = {'totals': totals, 'mean': values.mean(axis=0), 'max': values.max(axis=0),
+                                 'p95': np.percentile(values, 95, axis=0), 'slope': slope}
+        aggregates['samples'] = len(indices)
+
+        return aggregates
+
+    def log_jitter(self):
+        if self.count > 0:
+            log.info("Pqos sampler: {} samples, period {:.1f}ms, jitter mean {:.2f}ms max {:.2f}ms".format(
+                self.count, self.period * 1000, self.jitter_total / self.count * 1000, self.jitter_max * 1000))
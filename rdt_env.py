@@ -1,14 +1,14 @@
 import gym
+import json
+import threading
 from gym import spaces
 import numpy as np
-import logging.config
-from utils.constants import LC_TAG, BE_TAG
+import logging
+from utils.constants import LC_TAG, BE_TAG, SLOT_TAG, Rewards, pqos_counters
 from utils.config_constants import *
-import time
 
 from utils.functions import form_duration
 
-logging.config.fileConfig('logging.conf')
 log = logging.getLogger('simpleExample')
 
 features_min_max_values = {
@@ -19,15 +19,31 @@ features_min_max_values = {
     'Bandwidth': (0, 3*1e4)
     }
 
+lc_fields = ['lc_' + counter for counter in pqos_counters]
+be_fields = ['be_' + counter for counter in pqos_counters]
+
+INSTRUCTIONS = pqos_counters.index('instructions')
+
+
+def load_baselines(path):
+    """ Loads the instructions per second of each BE when it runs alone, a json object of name -> rate. """
+
+    if path is None:
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
 
 class Rdt(gym.Env):
     metadata = {'render.modes': ['human']}
     UPDATE_INTERVAL = 1000  # in ms, update status of BEs every 1s
 
-    def __init__(self, config, loader, scheduler, pqos_handler):
+    def __init__(self, config, loader, scheduler, pqos_handler, sampler=None):
         self.loader = loader
         self.scheduler = scheduler
         self.pqos_handler = pqos_handler
+        self.sampler = sampler  # polls pqos at a sub-interval rate, if present
+        self.aggregates = None  # per window aggregates of the sampler
 
         self.latency_thr = int(config[LATENCY_thr])
         self.violations = 0
@@ -35,28 +51,95 @@ class Rdt(gym.Env):
         self.penalty_coef = float(config[PEN_COEF])
         self.feature = config[FEATURE]
 
+        self.reward_type = Rewards(config.get(REWARD, fallback=Rewards.WAYS))
+        self.be_baselines = load_baselines(config.get(BE_BASELINES, fallback=None))
+        self.be_best_seen = {}  # stands in for the rate alone of the BEs without a baseline
+        self.slot_metrics = []  # metrics of every BE slot in the last window, if the handler monitors slots
+        self.slot_progress = []  # (be, progress) of every running BE in the last window
+        self.slot_interval = None  # seconds covered by the counters of slot_metrics
+        if self.reward_type == Rewards.THROUGHPUT and not getattr(pqos_handler, 'monitors_slots', False):
+            raise ValueError("Throughput reward needs per slot monitoring groups, set slot_groups in pqos config")
+
         feature_min, feature_max = features_min_max_values[self.feature]
         log.info("Feature {} will be used with limits: {} - {}".format(self.feature, feature_min, feature_max))
 
-        self.action_space = spaces.Discrete(int(config[NUM_WAYS]))
+        # an action is a pair of (ways, MBA level) of the BEs, action = ways * num_mba + mba
+        self.num_ways_actions = self._num_actions(config.get(NUM_WAYS, fallback='auto'))
+        self.mba_levels = getattr(pqos_handler, 'mba_levels', None) or [100]
+        self.num_mba = len(self.mba_levels)
+        # ways of the BEs in every ways split, counted from 0, i.e. the action index itself for a single BE group
+        splits = getattr(pqos_handler, 'actions', None)
+        if splits is not None and len(splits) >= self.num_ways_actions:
+            self.ways_be = [sum(split[:-1]) - 1 for split in splits[:self.num_ways_actions]]
+        else:
+            self.ways_be = list(range(self.num_ways_actions))
+        self.action_space = spaces.Discrete(self.num_ways_actions * self.num_mba)
         # latency, mpki_be # used to be 2*1e6, 5*1e7, ways_be # 14 me 30 gia mpc kai be=mcf
         # for gradient boost high in misses raised to 20 from 14
-        self.observation_space = spaces.Box(low=np.array([feature_min, 0]),
-                                            high=np.array([feature_max, self.action_space.n-1], dtype=np.float32),
+        low, high = [feature_min, min(self.ways_be)], [feature_max, max(self.ways_be)]
+        if self.num_mba > 1:  # bandwidth of the BEs and their MBA level
+            low += [0, 0]
+            high += [features_min_max_values['Bandwidth'][1], self.num_mba - 1]
+            log.info("MBA levels of BEs: {}".format(self.mba_levels))
+        self.observation_space = spaces.Box(low=np.array(low), high=np.array(high, dtype=np.float32),
                                             dtype=np.float32)
 
         self.previous_action = -1  # -1 action means all ways available to all groups
+        self.measurements = {}
+
+        # the latency watchdog, if any, may override the allocation between two steps
+        self.watchdog = None
+        self.events = []  # overrides of the watchdog
+        self.overridden = False
+        self.enforce_lock = threading.Lock()
+        self.started = False  # set by reset, before it there is no loader, BE or monitoring group to stop
+        self.stopped = False  # stop releases pqos, the loader and the BEs, it must run only once
 
         self.update_interval_in_steps = self.UPDATE_INTERVAL // int(self.loader.measurement_interval)
 
+    def _num_actions(self, num_ways):
+        """ Actions follow the ways splits supported by the pqos handler, a number in the config caps them. """
+
+        supported = getattr(self.pqos_handler, 'num_actions', None)
+        if num_ways == 'auto':
+            if supported is None:
+                raise ValueError("num_ways = auto needs a pqos handler that reports its actions")
+            return supported
+        if supported is not None and int(num_ways) > supported:
+            log.warning("num_ways {} exceeds the {} ways splits of the cache, using {}".format(num_ways, supported,
+                                                                                              supported))
+            return supported
+
+        return int(num_ways)
+
+    def decode_action(self, action):
+        """ Returns the ways index and the MBA level index of an action. An action out of the action space stands
+        for the initial state, all ways shared and no throttling. """
+
+        if action < 0 or action >= self.action_space.n:
+            return self.num_ways_actions, self.num_mba - 1
+
+        return divmod(action, self.num_mba)
+
+    def _ways_be(self, ways_index):
+        """ Ways of the BEs of a ways index, the index past the last action stands for all ways shared. """
+
+        return self.ways_be[ways_index] if ways_index < self.num_ways_actions else max(self.ways_be) + 1
+
     def _reset_pqos(self):
+        if self.sampler is not None:
+            self.sampler.pause()
         self.pqos_handler.reset()
         self.pqos_handler.setup_groups()
         self.pqos_handler.set_association_class()
         self.pqos_handler.print_association_config()
         self.previous_action = -1
+        if self.sampler is not None:
+            self.sampler.resume()
 
     def _stop_pqos(self):
+        if self.sampler is not None:
+            self.sampler.stop()
         self.pqos_handler.stop()
         self.pqos_handler.reset()
         self.pqos_handler.finish()
@@ -71,20 +154,79 @@ class Rdt(gym.Env):
         else:
             return (metric - min_val) / (max_val - min_val)
 
-    def _get_next_state(self, action_be_ways):
-        """  """
+    def _measure_sampled(self):
+        """ Measures a window of the action interval from the samples of the background sampler. """
+
+        start_time = self.loader.now()
+        first = self.sampler.mark()
+        tail_latency, rps = self.loader.get_stats()  # NOTE this call will block
+        time_interval = self.loader.now() - start_time
+
+        self.aggregates = self.sampler.window(first)
+        if self.aggregates is None:
+            raise RuntimeError("No pqos samples in the window, sampling period is longer than the action interval")
+        measurements = dict(zip(lc_fields, self.aggregates['hp']['totals']))
+        measurements.update(zip(be_fields, self.aggregates['be']['totals']))
+        measurements.update(time=start_time, interval=time_interval, latency=tail_latency, rps=rps)
+        # the sampler does not aggregate slots, their counters are the ones of the last sample
+        self.slot_metrics = self._measure_slots(self.sampler.period)
+        self.slot_interval = self.sampler.period
+
+        return measurements
+
+    def _measure_slots(self, time_interval):
+        get_slot_metrics = getattr(self.pqos_handler, 'get_slot_metrics', None)
+
+        return get_slot_metrics(time_interval) if get_slot_metrics is not None else []
+
+    def _measure(self):
+        """ Measures a window of the action interval. Returns the raw measurements of the window. """
+        if self.sampler is not None:
+            return self._measure_sampled()
+
         # poll metrics so the next poll will contains deltas from this point just after the action
         self.pqos_handler.update()
-        start_time = time.time()
+        start_time = self.loader.now()
         # start the stats record, the recorder will go to sleep and the it 'll send the results
         tail_latency, rps = self.loader.get_stats()  # NOTE this call will block
 
         self.pqos_handler.update()
-        time_interval = time.time() - start_time
-        ipc_hp, misses_hp, llc_hp, mbl_hp_ps, mbr_hp_ps, cycles_hp, instructions_hp =\
-            self.pqos_handler.get_hp_metrics(time_interval)
-        ipc_be, misses_be, llc_be, mbl_be_ps, mbr_be_ps, cycles_be, instructions_be =\
-            self.pqos_handler.get_be_metrics(time_interval)
+        time_interval = self.loader.now() - start_time
+
+        measurements = dict(zip(lc_fields, self.pqos_handler.get_hp_metrics(time_interval)))
+        measurements.update(zip(be_fields, self.pqos_handler.get_be_metrics(time_interval)))
+        measurements.update(time=start_time, interval=time_interval, latency=tail_latency, rps=rps)
+        self.slot_metrics = self._measure_slots(time_interval)
+        self.slot_interval = time_interval
+
+        return measurements
+
+    def _be_progress(self, time_interval):
+        """ Progress of the BE of every slot, its instructions per second relative to running alone. """
+
+        progress = []
+        slot_bes = self.scheduler.slot_bes if self.scheduler is not None else []
+        for be, metrics in zip(slot_bes, self.slot_metrics):
+            if be is None or metrics is None:
+                continue
+            rate = metrics[INSTRUCTIONS] / time_interval
+            baseline = self.be_baselines.get(be)
+            if baseline is None:
+                baseline = self.be_best_seen[be] = max(self.be_best_seen.get(be, 0.), rate)
+            progress.append((be, rate / baseline if baseline > 0 else 0.))
+
+        return progress
+
+    def _get_next_state(self, action):
+        """  """
+        # raw measurements of the window, before any transformation, kept for the step log
+        self.measurements = self._measure()
+
+        ipc_hp, misses_hp, llc_hp, mbl_hp_ps, mbr_hp_ps, cycles_hp, instructions_hp = \
+            [self.measurements[field] for field in lc_fields]
+        ipc_be, misses_be, llc_be, mbl_be_ps, mbr_be_ps, cycles_be, instructions_be = \
+            [self.measurements[field] for field in be_fields]
+        tail_latency, rps = self.measurements['latency'], self.measurements['rps']
 
         # bw_socket_wide = mbl_hp_ps + mbl_be_ps
         # bw_lc = mbl_hp_ps + mbr_hp_ps
@@ -111,8 +253,17 @@ class Rdt(gym.Env):
 
         info = {LC_TAG: (ipc_hp, misses_hp, llc_hp, mbl_hp_ps, mbr_hp_ps, tail_latency, rps),
                 BE_TAG: (ipc_be, misses_be, llc_be, mbl_be_ps, mbr_be_ps, None, None)}
-
-        state = [feature, action_be_ways]
+        for i, metrics in enumerate(self.slot_metrics):
+            if metrics is not None:
+                ipc, misses, llc, mbl_ps, mbr_ps, cycles, _ = metrics
+                info[SLOT_TAG.format(i)] = (ipc, misses / (cycles / 1000.) if cycles > 0 else 0., llc, mbl_ps,
+                                            mbr_ps, None, None)
+        self.slot_progress = self._be_progress(self.slot_interval)
+
+        action_be_ways, action_mba = self.decode_action(action)
+        state = [feature, self._ways_be(action_be_ways)]
+        if self.num_mba > 1:
+            state += [mbl_be_ps, action_mba]
 
         # we normalize as well the be_ways, as it is included in the state
         state_normalized = [self._normalize(metric, min_val, max_val) for metric, min_val, max_val in
@@ -120,15 +271,26 @@ class Rdt(gym.Env):
 
         return state_normalized, info, tail_latency
 
-    def _reward_func(self, action_be_ways, hp_tail_latency):
+    def _reward_func(self, action, hp_tail_latency):
         """ Reward function. """
 
+        if self.reward_type == Rewards.THROUGHPUT:
+            # aggregate speedup of the BEs, at most one per slot, the penalty is scaled accordingly
+            if hp_tail_latency < self.latency_thr:
+                reward = sum(progress for _, progress in self.slot_progress)
+            else:
+                reward = - self.penalty_coef * max(len(self.slot_metrics), 1)
+                self.violations += 1
+            return reward
+
         if hp_tail_latency < self.latency_thr:
-            reward = action_be_ways
+            action_be_ways, action_mba = self.decode_action(action)
+            reward = self._ways_be(action_be_ways) * self.mba_levels[action_mba] / 100.
             # NOTE by shaping the reward function in this way, we are making the assumption that progress of BEs is
-            # depended by the LLC ways that are allocated to them at any point of their execution.
+            # depended by the LLC ways that are allocated to them at any point of their execution, scaled by the
+            # memory bandwidth they are allowed to use.
         else:
-            reward = - self.penalty_coef * self.action_space.n
+            reward = - self.penalty_coef * self.num_ways_actions
             self.violations += 1
 
         return reward
@@ -136,9 +298,12 @@ class Rdt(gym.Env):
     def reset(self):
         """ In case that this environment is used in episodic format. """
 
+        self.started = True
         self._reset_pqos()
         self.loader.reset()
         self.scheduler.reset()
+        if self.watchdog is not None and not self.watchdog.is_alive():
+            self.watchdog.start()
 
         state, _, _ = self._get_next_state(self.action_space.n)  # we start with both groups sharing all ways
 
@@ -146,29 +311,69 @@ class Rdt(gym.Env):
 
         return state
 
-    def step(self, action_be_ways):
-        """ At each step the agent specifies the number of ways that are assigned to the be"""
-
-        # log.debug("Action selected: {}".format(action_be_ways))
-        # self.new_be = False
+    def override(self, latency):
+        """ Called by the watchdog, gives the LC service the most ways and throttles the BEs the most until the next
+        step. Only the first crossing of a window is acted upon. """
+
+        with self.enforce_lock:
+            if self.overridden:
+                return
+            action_be_ways, action_mba = self.decode_action(self.previous_action)
+            if action_be_ways != 0:
+                self.pqos_handler.set_allocation_class(0)
+            if self.num_mba > 1 and action_mba != 0:
+                self.pqos_handler.set_mba_class(0)
+            self.overridden = True
+            self.events.append({'time': self.loader.now(), 'step': self.steps, 'latency': latency,
+                                'action': self.previous_action})
+            self.previous_action = -1  # the next action of the policy is enforced in full
+
+    def _poll_done(self):
+        """ Checks whether the BEs have finished. """
 
         done = False  # update the status of BEs once in a while to reduce docker demon cpu utilization
-        if self.steps % self.update_interval_in_steps == 0:
+        # completions pushed by the event stream are free to check at every step, if the stream stops docker is polled
+        interval = 1 if getattr(self.scheduler, 'event_driven', False) else self.update_interval_in_steps
+        if self.steps % interval == 0:
             done = self.scheduler.update_status()
 
-        # err_msg = "%r (%s) invalid" % (action_be_ways, type(action_be_ways))
-        # assert self.action_space.contains(action_be_ways), err_msg
+        return done
 
-        # avoid enforcing decision when nothing changes. Does this cause any inconsistencies ?
-        if action_be_ways != self.previous_action:
-            # enforce the decision with PQOS
+    def _enforce(self, action):
+        """ Enforces the decision with PQOS, only the resources that change are set. """
+
+        action_be_ways, action_mba = self.decode_action(action)
+        previous_ways, previous_mba = self.decode_action(self.previous_action)
+        if action_be_ways != previous_ways:
             self.pqos_handler.set_allocation_class(action_be_ways)
-            # self.pqos_handler.print_allocation_config()
-            self.previous_action = action_be_ways
+        if self.num_mba > 1 and (action_mba != previous_mba or self.previous_action == -1):
+            self.pqos_handler.set_mba_class(action_mba)
+        # self.pqos_handler.print_allocation_config()
+
+    def step(self, action):
+        """ At each step the agent specifies the ways and the MBA level that are assigned to the be"""
+
+        # log.debug("Action selected: {}".format(action))
+        # self.new_be = False
+
+        done = self._poll_done()
+
+        # err_msg = "%r (%s) invalid" % (action, type(action))
+        # assert self.action_space.contains(action), err_msg
 
-        state, info, tail_latency = self._get_next_state(action_be_ways)
+        # avoid enforcing decision when nothing changes. Does this cause any inconsistencies ?
+        with self.enforce_lock:
+            if action != self.previous_action:
+                self._enforce(action)
+                self.previous_action = action
+            self.overridden = False  # the policy is in control again
+
+        state, info, tail_latency = self._get_next_state(action)
+        with self.enforce_lock:
+            # the measurements were taken, at least in part, under the allocation of the watchdog and not the action
+            info['overridden'] = self.overridden
 
-        reward = self._reward_func(action_be_ways, tail_latency)  # based on new metrics
+        reward = self._reward_func(action, tail_latency)  # based on new metrics
 
         self.steps += 1
 
@@ -177,19 +382,33 @@ class Rdt(gym.Env):
     def render(self, **kwargs):
         pass
 
+    def get_stats_overhead(self):
+        """ Returns the overhead, in ms, of the last stats request to the loader. """
+
+        return self.loader.stats_channel.last_overhead * 1000
+
     def get_experiment_duration(self):
         """ Properly shapes and returns the time needed for the experiment to finish. """
 
         return self.scheduler.get_experiment_duration()
 
     def stop(self):
+        if self.stopped:
+            return
+        self.stopped = True
+        if not self.started:  # only the pqos library was initialized
+            log.warning('Environment was never reset, releasing pqos only.')
+            self.pqos_handler.finish()
+            return
         log.warning('Stopping everything!')
 
         duration = form_duration(self.get_experiment_duration())
 
-        log.info('Percentage of violations: {}'.format(self.violations / self.steps))
+        log.info('Percentage of violations: {}'.format(self.violations / max(self.steps, 1)))
         log.info('Duration of experiment: {}'.format(duration))
 
+        if self.watchdog is not None:
+            self.watchdog.stop()
         self.scheduler.stop_bes()  # stop and remove the be containers
         self.loader.stop()  # stop the service loader
         self._stop_pqos()  # stop pqos
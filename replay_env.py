@@ -0,0 +1,172 @@
+import numpy as np
+import logging
+from rdt_env import Rdt, lc_fields, be_fields
+from utils.run_log import load_run_log
+from utils.config_constants import *
+
+log = logging.getLogger('simpleExample')
+
+# fields of a step log that are served back as measurements
+replay_fields = lc_fields + be_fields + ['latency', 'rps']
+
+
+def load_traces(paths):
+    """ Loads step logs of static allocation runs (main_measurements.py) and groups their rows by action.
+
+    Returns:
+        a dict that maps each recorded action to a 2D float array, one row per step and one column per replay field,
+        and the median action interval of the traces in ms
+    """
+
+    traces = {}
+    intervals = []
+    for path in paths:
+        steps = load_run_log(path)
+        intervals.append(np.asarray(steps['interval']))
+        for action in np.unique(steps['action']):
+            rows = steps[steps['action'] == action]
+            columns = np.column_stack([np.asarray(rows[field], dtype=np.float64) for field in replay_fields])
+            columns = np.nan_to_num(columns)
+            if action in traces:  # several runs of the same action are played back to back
+                columns = np.concatenate([traces[action], columns])
+            traces[int(action)] = columns
+        log.info("Loaded trace {} with {} steps.".format(path, len(steps)))
+
+    interval = float(np.median(np.concatenate(intervals))) * 1000
+
+    return traces, interval
+
+
+class TraceReplayer:
+    """ Serves recorded measurements by action and phase of the experiment. The phase is the fraction of the
+    experiment that has elapsed, so that traces of different length are aligned on the phases of the BEs. """
+
+    NEAREST = 'nearest'
+    INTERPOLATE = 'interpolate'
+
+    def __init__(self, traces, interval, mode=INTERPOLATE, jitter=2, seed=None):
+        """
+        Parameters:
+            traces: dict of action to recorded measurements, as returned by load_traces
+            interval: action interval in ms that the traces were recorded with
+            mode: 'nearest' picks a recorded row around the phase, 'interpolate' interpolates in time and actions
+            jitter: max number of rows that the nearest mode randomly deviates from the phase
+            seed: seed of the jitter of the nearest mode, the interpolate mode is deterministic and does not use it
+        """
+        if mode not in (self.NEAREST, self.INTERPOLATE):
+            raise ValueError("Replay mode {} is not supported".format(mode))
+        self.traces = traces
+        # -1 (all ways shared by both groups) is not on the same axis as the rest of the actions
+        self.actions = np.array(sorted(action for action in traces.keys() if action != -1))
+        self.num_actions = int(self.actions[-1]) + 1  # actions in between that were not recorded are interpolated
+        self.measurement_interval = interval
+        self.mode = mode
+        self.jitter = jitter
+        self.generator = np.random.default_rng(seed)
+
+    def reset(self, seed=None):
+        """ Reseeds the jitter of the nearest mode, if a seed is given. """
+
+        if seed is not None:
+            self.generator = np.random.default_rng(seed)
+
+    def __len__(self):
+        """ Length of the shortest trace, an episode lasts that many steps. """
+
+        return min(len(trace) for trace in self.traces.values())
+
+    def _sample_trace(self, action, phase):
+        trace = self.traces[action]
+        position = phase * (len(trace) - 1)
+        if self.mode == self.NEAREST:
+            index = int(round(position)) + self.generator.integers(-self.jitter, self.jitter + 1)
+            return trace[min(max(index, 0), len(trace) - 1)]
+
+        low = int(position)
+        high = min(low + 1, len(trace) - 1)
+        weight = position - low
+        return (1 - weight) * trace[low] + weight * trace[high]
+
+    def sample(self, action, phase):
+        """ Returns the measurements of an action at a phase of the experiment. Actions that were not recorded are
+        interpolated between the closest recorded actions (or served by the closest one in nearest mode). """
+
+        if action in self.traces:
+            return self._sample_trace(action, phase)
+
+        position = np.searchsorted(self.actions, action)
+        if position == 0 or position == len(self.actions) or self.mode == self.NEAREST:
+            closest = self.actions[np.argmin(np.abs(self.actions - action))]
+            return self._sample_trace(closest, phase)
+
+        low, high = self.actions[position - 1], self.actions[position]
+        weight = (action - low) / (high - low)
+        return (1 - weight) * self._sample_trace(low, phase) + weight * self._sample_trace(high, phase)
+
+
+class ReplayRdt(Rdt):
+    """ Rdt environment that serves recorded measurements instead of measuring the hardware. It has the same spaces
+    and reward as Rdt, but a step takes microseconds instead of an action interval. """
+
+    def __init__(self, config, replayer, episode_steps=None):
+        """
+        Parameters:
+            config: the env section of the config
+            replayer: a TraceReplayer with the recorded measurements, it takes the place of the loader
+            episode_steps: steps of an episode, defaults to the length of the shortest trace
+        """
+        self.replayer = replayer  # the number of actions is taken from it by Rdt
+        super().__init__(config, replayer, scheduler=None, pqos_handler=None)
+        self.episode_steps = episode_steps or len(replayer)
+        self.clock = 0.
+        self.phase = 0.
+
+    def _num_actions(self, num_ways):
+        """ There is no pqos handler, auto takes the actions up to the highest one recorded in the traces. """
+
+        if num_ways == 'auto':
+            return self.replayer.num_actions
+        return int(num_ways)
+
+    def _measure(self):
+        action = self.previous_action
+        if action == -1 and -1 not in self.replayer.traces:
+            action = self.action_space.n - 1  # closest to all ways being shared is all ways given to the BEs
+        values = self.replayer.sample(action, self.phase)
+        measurements = dict(zip(replay_fields, values))
+        interval = self.replayer.measurement_interval / 1000.
+        measurements.update(time=self.clock, interval=interval)
+        self.clock += interval
+
+        return measurements
+
+    def _poll_done(self):
+        self.phase = min((self.steps - 1) / self.episode_steps, 1.)
+
+        return self.steps >= self.episode_steps
+
+    def _enforce(self, action_be_ways):
+        pass
+
+    def reset(self):
+        self.replayer.reset()
+        self.violations = 0
+        self.steps = 1
+        self.clock = 0.
+        self.phase = 0.
+        self.previous_action = -1
+        state, _, _ = self._get_next_state(self.action_space.n)
+
+        return state
+
+    def get_stats_overhead(self):
+        return 0.
+
+    def get_experiment_duration(self):
+        """ Duration of the replayed experiment in minutes. """
+
+        return self.clock / 60
+
+    def stop(self):
+        log.info('Replay finished after {} steps. Percentage of violations: {}'
+                 .format(self.steps, self.violations / self.steps))
@@ -0,0 +1,101 @@
+import numpy as np
+import logging
+
+log = logging.getLogger('simpleExample')
+
+ARRAY = 'array'
+
+
+def memory_factory(mem_type, mem_size):
+    """ Builds the replay memory of a mem_type, array is the memory of this module and the rest come from rlsuite. """
+
+    if mem_type == ARRAY:
+        return ArrayReplayMemory(mem_size)
+
+    from rlsuite.builders.factories import memory_factory as rlsuite_memory_factory
+    return rlsuite_memory_factory(mem_type, mem_size)
+
+
+class ArrayReplayMemory:
+    """ Uniform replay memory on preallocated numpy arrays, one per field of the transitions, used as a ring buffer.
+    The arrays are allocated on the first store, when the dims of the state are known.
+
+    The rlsuite agents update from a list of (state, action, next_state, reward, done) rows, so sample still builds the
+    rows, from the arrays gathered with one index per field. There is no zero-copy tensor batch until the agent update
+    takes arrays. The gain is on storing, no object per transition and bulk store_batch, and on the memory footprint.
+    Unlike the uniform memory of rlsuite, the indices of a batch are sampled with replacement. """
+
+    def __init__(self, capacity, seed=None):
+        """
+        Parameters:
+            capacity: number of transitions kept, the oldest ones are overwritten
+            seed: seed of the sampling
+        """
+        self.capacity = capacity
+        self.random = np.random.RandomState(seed)
+        self.count = 0  # transitions stored so far, the next one is written at count % capacity
+        self.states = None
+
+    def _allocate(self, state):
+        shape = (self.capacity,) + np.shape(state)
+        self.states = np.zeros(shape, dtype=np.float32)
+        self.next_states = np.zeros(shape, dtype=np.float32)
+        self.actions = np.zeros(self.capacity, dtype=np.int64)
+        self.rewards = np.zeros(self.capacity, dtype=np.float32)
+        self.dones = np.zeros(self.capacity, dtype=np.bool_)
+        log.info("Replay memory of {} transitions, {:.1f}MB".format(self.capacity, sum(
+            array.nbytes for array in (self.states, self.next_states, self.actions, self.rewards, self.dones)) / 2**20))
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def store(self, state, action, next_state, reward, done):
+        if self.states is None:
+            self._allocate(state)
+        index = self.count % self.capacity
+        self.states[index] = state
+        self.actions[index] = action
+        self.next_states[index] = next_state
+        self.rewards[index] = reward
+        self.dones[index] = done
+        self.count += 1
+
+    def store_batch(self, states, actions, next_states, rewards, dones):
+        """ Stores the transitions of a batch of envs with one assignment per field. """
+
+        states = np.asarray(states)
+        if self.states is None:
+            self._allocate(states[0])
+        size = len(states)
+        if size > self.capacity:  # only the last ones would survive anyway
+            states, actions, next_states, rewards, dones = (np.asarray(field)[-self.capacity:] for field in
+                                                            (states, actions, next_states, rewards, dones))
+            self.count += size - self.capacity
+            size = self.capacity
+        indices = np.arange(self.count, self.count + size) % self.capacity
+        self.states[indices] = states
+        self.actions[indices] = actions
+        self.next_states[indices] = next_states
+        self.rewards[indices] = rewards
+        self.dones[indices] = dones
+        self.count += size
+
+    def _indices(self, batch_size):
+        if len(self) < batch_size:
+            raise ValueError("Not enough transitions in memory: {} < {}".format(len(self), batch_size))
+        return self.random.randint(len(self), size=batch_size)  # with replacement, no O(capacity) permutation
+
+    def sample(self, batch_size):
+        """ Samples a batch as a list of (state, action, next_state, reward, done) rows, as the rlsuite memories do. The
+        indices are drawn uniformly with replacement, a batch may hold a transition twice. Indices and importance
+        sampling weights only apply to prioritized memories, they are None. """
+
+        indices = self._indices(batch_size)
+        transitions = list(zip(self.states[indices], self.actions[indices].tolist(), self.next_states[indices],
+                               self.rewards[indices].tolist(), self.dones[indices].tolist()))
+
+        return transitions, None, None
+
+    def batch_update(self, indices, errors):
+        """ Priorities only apply to prioritized memories. """
+        pass
@@ -1,35 +1,128 @@
 import time
+import calendar
 import ast
-import docker
+import queue
 import random
-import logging.config
-from utils.functions import parse_num_list
+import json
+import os
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from utils.functions import parse_num_list, read_avail_dockers, process_tree
 from utils.config_constants import *
 from abc import ABC, abstractmethod
 
-logging.config.fileConfig('logging.conf')
 log = logging.getLogger('simpleExample')
 
 
-def read_avail_dockers(docker_file):
-    """ Gets a dictionary with the available BEs and their parameters needed for execution. """
+def docker_time(stamp):
+    """ Seconds since the epoch of a timestamp of the docker api, e.g. 2020-05-04T10:21:33.123456789Z. """
 
-    with open(docker_file, "r") as file:
-        contents = file.read()
-        bes = ast.literal_eval(contents)
+    date, _, fraction = stamp.rstrip('Z').partition('.')
+    return calendar.timegm(time.strptime(date, '%Y-%m-%dT%H:%M:%S')) + float('0.' + (fraction or '0'))
 
-        return bes
+
+class DockerEventSource:
+    """ Stream of the container exit events of the docker daemon. """
+
+    def __init__(self, client):
+        self.client = client
+        self.stream = None
+
+    def events(self):
+        self.stream = self.client.events(decode=True, filters={'type': 'container', 'event': 'die'})
+        return self.stream
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+
+
+class QueueEventSource:
+    """ Event source that is fed by hand with events in the format of the docker daemon. Stands in for the daemon
+    when testing the scheduler locally. """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+
+    def emit(self, container_id, name, exit_code=0, status='die'):
+        now = time.time()
+        self.queue.put({'Type': 'container', 'status': status, 'id': container_id, 'time': int(now),
+                        'timeNano': int(now * 1e9),
+                        'Actor': {'ID': container_id, 'Attributes': {'name': name, 'exitCode': str(exit_code)}}})
+
+    def events(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                return
+            yield event
+
+    def close(self):
+        self.queue.put(None)
+
+
+class CompletionWatcher(threading.Thread):
+    """ Subscribes to an event source on a background thread and keeps the ids of the BE containers that exited, with
+    the time they exited. """
+
+    def __init__(self, source, prefix='be_'):
+        super().__init__(name='be-completion', daemon=True)
+        self.source = source
+        self.prefix = prefix
+        self.exited = {}  # container id -> exit time
+        self.lock = threading.Lock()
+
+    def run(self):
+        try:
+            for event in self.source.events():
+                if event.get('status') != 'die':
+                    continue
+                name = event.get('Actor', {}).get('Attributes', {}).get('name', '')
+                if name.startswith(self.prefix):
+                    exit_time = event['timeNano'] / 1e9 if 'timeNano' in event else event.get('time', time.time())
+                    with self.lock:
+                        self.exited[event['id']] = exit_time
+        except Exception as e:
+            log.warning("Docker event stream stopped ({}), falling back to polling.".format(e))
+
+    def pop(self, container_id):
+        """ Returns the exit time, only once, if the container has exited and None otherwise. """
+
+        with self.lock:
+            return self.exited.pop(container_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.exited.clear()
+
+    def stop(self):
+        self.source.close()
 
 
 class Scheduler(ABC):
     """ Handles all the operations needed to execute the Best Effort applications.
      Dockers containers are used to handle the execution. """
 
-    def __init__(self, config):
+    fixed_slots = True  # the ith slot always runs on cores_map(i), so per slot monitoring groups can follow it
+    max_start_retries = 3  # starts of a BE that may fail in a row before the scheduler gives up
+
+    def __init__(self, config, event_source=None, client=None):
+        """
+        Parameters:
+            config: the scheduler section of the config
+            event_source: source of the container exit events, the docker daemon by default
+            client: the docker client, one for the local daemon by default
+        """
         self.cores_per_be = config.getint(CORES_PER_BE)
         self.cores_pids_be_range = parse_num_list(config[CORES_BE])
         self.container_bes = []
-        self.client = docker.from_env()
+        self.slot_bes = []  # name of the BE that runs in each slot
+        if client is None:
+            import docker
+            client = docker.from_env()
+        self.client = client
 
         self.finished_bes = 0
         self.bes_available = read_avail_dockers(config[DOCKER_FILE])
@@ -47,12 +140,53 @@ class Scheduler(ABC):
         self.stop_time_bes = None
         self.experiment_duration = 0  # in minutes
 
+        # container start/stop/remove run on a worker pool so that the control loop never blocks on docker
+        self.num_slots = len(self.cores_pids_be_range) // self.cores_per_be
+        self.executor = ThreadPoolExecutor(max_workers=config.getint(LIFECYCLE_WORKERS, fallback=self.num_slots),
+                                           thread_name_prefix='be-lifecycle')
+        self.pending = {}  # slot -> future of the container that is being started there
+        self.start_failures = {}  # slot -> starts that failed in a row
+        self.lifecycle_latencies = {'start': [], 'stop': []}  # in seconds
+        self.idle_core_time = 0.  # core seconds that BE cores waited for the next BE to start
+        self.idle_lock = threading.Lock()  # idle time is added by the workers
+        self.exit_times = {}  # slot -> time its container exited, until the slot is reissued
+
+        # opt-in pool of containers of the next BEs, created ahead so that a start skips container creation. It has
+        # its own worker so that a replacement waiting for a warm container never starves its creation.
+        self.prewarm = config.getboolean(PREWARM, fallback=False)
+        self.prewarm_size = config.getint(PREWARM_SIZE, fallback=self.num_slots)
+        self.warm = deque()  # (be, future of the created container) in selection order
+        self.warm_count = 0
+        self.warm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='be-prewarm')
+
+        # pids of the processes of each BE are published to the listeners as containers start and stop
+        self.pid_listeners = []
+        self.slot_root_pids = {}  # slot -> pid of the main process of its container
+        self.slot_pids = {}  # slot -> pids last published for the slot
+
+        # completions are detected from the docker events stream, polling is used only as a fallback
+        self.watcher = None
+        if config.get(BE_COMPLETION, fallback='events') == 'events':
+            self.watcher = CompletionWatcher(event_source or DockerEventSource(self.client))
+            self.watcher.start()
+
+    @property
+    def event_driven(self):
+        """ Whether completions are pushed by the event stream, in which case checking them costs nothing. """
+
+        return self.watcher is not None and self.watcher.is_alive()
+
     def cores_map(self, i):
         """ Returns the cores that corresponds to the ith container. """
         cores_range = self.cores_pids_be_range[i * self.cores_per_be: (i + 1) * self.cores_per_be]
         cores_range_string = map(str, cores_range)
         return ','.join(cores_range_string)
 
+    @staticmethod
+    def _container_name(cores):
+        """ Name of the container that runs on the specified cores. """
+        return 'be_' + cores.replace(",", "_")
+
     @abstractmethod
     def _select_be(self):
         raise NotImplementedError
@@ -61,10 +195,52 @@ class Scheduler(ABC):
     def reset(self):
         raise NotImplementedError
 
+    def add_pid_listener(self, listener):
+        """ Registers a listener, e.g. PqosHandlerPid, that is told the pids of the BEs through its add_be_pids
+        and remove_be_pids methods. Pids include the children of the container process. """
+
+        self.pid_listeners.append(listener)
+
+    def _track_pids(self, i):
+        """ Publishes the pids of the ith container that appeared or disappeared since the last call. """
+
+        if not self.pid_listeners:
+            return
+        if i not in self.slot_root_pids:
+            container_be = self.container_bes[i]
+            container_be.reload()
+            self.slot_root_pids[i] = container_be.attrs['State']['Pid']  # 0 if the container has already exited
+        root_pid = self.slot_root_pids[i]
+        pids = set(process_tree(root_pid)) if root_pid else set()
+        previous = self.slot_pids.get(i, set())
+        self.slot_pids[i] = pids
+        removed, added = sorted(previous - pids), sorted(pids - previous)
+        for listener in self.pid_listeners:
+            if removed:
+                listener.remove_be_pids(removed, i)
+            if added:
+                listener.add_be_pids(added, i)
+
+    def _untrack_pids(self, i):
+        """ Publishes that the processes of the ith container are gone. """
+
+        self.slot_root_pids.pop(i, None)
+        pids = sorted(self.slot_pids.pop(i, ()))
+        if pids:
+            for listener in self.pid_listeners:
+                listener.remove_be_pids(pids, i)
+
+    def _refresh_pids(self):
+        """ Picks up processes that the BEs have spawned or reaped since they started. Walking /proc is not free, it
+        is done only when containers start or exit. """
+
+        for i in list(self.slot_root_pids):
+            self._track_pids(i)
+
     def _restart_scheduling(self):
         """ Stops currently running BEs and starts new ones. """
 
-        self.stop_bes()
+        self._stop_containers()
         self.start_bes()
         log.debug('BEs started')
 
@@ -81,6 +257,40 @@ class Scheduler(ABC):
             self.be_quota += 1
             return self.last_be
 
+    def _remove_leftover(self, name):
+        """ Force removes the container with the given name, if there is one, e.g. left behind by a start that failed
+        after creating it or by a stop that failed. """
+
+        for container_be in self.client.containers.list(all=True, filters={'name': '^{}$'.format(name)}):
+            container_be.remove(force=True)
+
+    def _run_be(self, be, cores, name=None):
+        """ Runs the container of the given be on specified cores, named after the cores unless a name is given. """
+
+        start = time.time()
+        name = name or self._container_name(cores)
+        container, command, volume = self.bes_available[be][:3]
+        try:
+            container_be = self.client.containers.run(container, command=command, name=name, cpuset_cpus=cores,
+                                                      volumes_from=[volume] if volume is not None else [], detach=True)
+        except Exception:
+            try:
+                self._remove_leftover(name)
+            except Exception as e:
+                log.warning("Removing container {} after a failed start failed ({})".format(name, e))
+            raise
+        self.lifecycle_latencies['start'].append(time.time() - start)
+        # self.issued_bes += 1
+
+        return container_be
+
+    def _retry_be(self, be, cores, name):
+        """ Runs a BE again after a failed start. A container of the same name, e.g. the previous one of the slot if
+        stopping it failed, would make the start fail again, it is removed first. Executed by the worker pool. """
+
+        self._remove_leftover(name)
+        return self._run_be(be, cores, name)
+
     def _start_be(self, cores):
         """ Start a container on specified cores. """
 
@@ -88,58 +298,220 @@ class Scheduler(ABC):
 
         be = self._select_be()
         log.info('Selected Job: {}'.format(be))
-        container, command, volume = self.bes_available[be]
-        container_be = self.client.containers.run(container, command=command, name='be_' + cores.replace(",", "_"),
-                                                  cpuset_cpus=cores, volumes_from=[volume] if volume is not None
-                                                  else [], detach=True)
-        # self.issued_bes += 1
+
+        return self._run_be(be, cores)
+
+    def _create_be(self, be, name):
+        """ Creates, without starting it, the container of the given be. Executed by the pre-warm worker. """
+
+        from docker.errors import ImageNotFound
+
+        container, command, volume = self.bes_available[be][:3]
+        kwargs = dict(command=command, name=name, volumes_from=[volume] if volume is not None else [])
+        try:
+            return self.client.containers.create(container, **kwargs)
+        except ImageNotFound:  # unlike run, create does not pull the image
+            self.client.images.pull(container)
+            return self.client.containers.create(container, **kwargs)
+
+    def _start_warm_be(self, container_be, cores):
+        """ Pins a pre-created container to the specified cores and starts it. """
+
+        start = time.time()
+        container_be.update(cpuset_cpus=cores)
+        container_be.rename(self._container_name(cores))
+        container_be.start()
+        self.lifecycle_latencies['start'].append(time.time() - start)
+
+        return container_be
+
+    def _prewarm_next(self):
+        """ Selects the next BE and creates its container in the background. """
+
+        try:
+            be = self._select_be()
+        except IndexError:  # queue is exhausted, nothing left to pre-warm
+            return
+        log.info('Pre-warming Job: {}'.format(be))
+        self.warm_count += 1
+        self.warm.append((be, self.warm_executor.submit(self._create_be, be, 'be_warm_{}'.format(self.warm_count))))
+
+    def _replace_be(self, container_be, be, cores, finished_at, warm_future=None):
+        """ Stops the finished container and runs the next one in its place. Executed by the worker pool. """
+
+        self._stop_be(container_be)
+        if warm_future is not None:
+            container_be = self._start_warm_be(warm_future.result(), cores)
+        else:
+            container_be = self._run_be(be, cores)
+        with self.idle_lock:
+            self.idle_core_time += (time.time() - finished_at) * self.cores_per_be
 
         return container_be
 
     def start_bes(self):
-        """ Launches bes. """
+        """ Launches bes. The containers are started in parallel, but the call waits for all of them. """
 
-        num_startup_bes = len(self.cores_pids_be_range) // self.cores_per_be
         # NOTE: each BE launched should be directly placed at the containers list. Otherwise if an error pops up
         #   during the process the list will haven't been formed yet so the launched bes are not going to be stopped.
-        for i in range(num_startup_bes):
-            self.container_bes.append(self._start_be(self.cores_map(i)))
+        # BEs are selected here, in order, so that the selection does not depend on the scheduling of the workers
+        for i in range(self.num_slots):
+            be = self._select_be()
+            log.info('Selected Job: {}'.format(be))
+            self.container_bes.append(None)
+            self.slot_bes.append(be)
+            self.pending[i] = self.executor.submit(self._run_be, be, self.cores_map(i))
+        wait(list(self.pending.values()))
+        self._collect_pending()
 
         self.start_time_bes = time.time()
 
+        if self.prewarm:
+            for _ in range(self.prewarm_size):
+                self._prewarm_next()
+
     def reissue_bes(self, have_finished):
-        """ Issue new bes on cores that finished execution, if there are any. """
+        """ Issue new bes on cores that finished execution, if there are any. The replacement takes place in the
+        background, the slot is pending until the new container runs. """
 
         for i, has_finished in enumerate(have_finished):
             if has_finished:
-                self._stop_be(self.container_bes[i])
-                self.container_bes[i] = self._start_be(self.cores_map(i))
+                warm_future = None
+                if self.prewarm and self.warm:
+                    be, warm_future = self.warm.popleft()
+                    self._prewarm_next()
+                else:
+                    be = self._select_be()
+                log.info('Selected Job: {}'.format(be))
+                self.slot_bes[i] = be
+                self._untrack_pids(i)
+                self.pending[i] = self.executor.submit(self._replace_be, self.container_bes[i], be, self.cores_map(i),
+                                                       self.exit_times.pop(i, time.time()), warm_future)
+                self.container_bes[i] = None
                 log.info("Finished Bes: {}/{}".format(self.finished_bes, self.num_total_bes))
 
+    def _collect_pending(self, retry=True):
+        """ Places the containers whose start has completed to their slots. A failed start is submitted again and the
+        slot stays pending, up to max_start_retries times in a row. Returns the number of containers placed. """
+
+        started = 0
+        for i, future in list(self.pending.items()):
+            if future.done():
+                del self.pending[i]
+                try:
+                    self.container_bes[i] = future.result()
+                except Exception as e:
+                    failures = self.start_failures.get(i, 0) + 1
+                    self.start_failures[i] = failures
+                    if not retry:  # stopping, the slot is left empty
+                        log.error("Starting BE {} on core(s) {} failed ({})".format(self.slot_bes[i], self.cores_map(i),
+                                                                                  e))
+                        continue
+                    if failures > self.max_start_retries:
+                        log.error("Starting BE {} on core(s) {} failed!".format(self.slot_bes[i], self.cores_map(i)))
+                        raise
+                    log.warning("Starting BE {} on core(s) {} failed ({}), retry {}/{}".format(
+                        self.slot_bes[i], self.cores_map(i), e, failures, self.max_start_retries))
+                    cores = self.cores_map(i)
+                    self.pending[i] = self.executor.submit(self._retry_be, self.slot_bes[i], cores,
+                                                           self._container_name(cores))
+                    continue
+                self.start_failures.pop(i, None)
+                self._track_pids(i)
+                started += 1
+
+        return started
+
+    def _has_exited(self, container_be):
+        """ Checks if a container has exited, through the event stream or by reloading its status. Returns the time
+        it exited or None if it still runs. """
+
+        if self.event_driven:
+            return self.watcher.pop(container_be.id)
+        container_be.reload()
+        if container_be.status != 'exited':
+            return None
+        try:
+            return docker_time(container_be.attrs['State']['FinishedAt'])
+        except (KeyError, ValueError):
+            return time.time()
+
     def _poll_bes(self):
-        """ Reloads the status of containers and checks if they have exited. """
+        """ Checks which of the containers have exited. Slots that are pending are skipped. """
 
+        started = self._collect_pending()
         have_finished = []
-        for container_be in self.container_bes:
-            container_be.reload()
-            if container_be.status == 'exited':
+        for i, container_be in enumerate(self.container_bes):
+            if container_be is None:
+                have_finished.append(False)
+                continue
+            exit_time = self._has_exited(container_be)
+            if exit_time is not None:
+                self.exit_times[i] = exit_time
                 have_finished.append(True)
                 self.finished_bes += 1
             else:
                 have_finished.append(False)
+        if started or any(have_finished):  # processes of the other BEs are refreshed on container events only
+            self._refresh_pids()
 
         return have_finished
 
-    @staticmethod
-    def _stop_be(container_be):
+    def _stop_be(self, container_be):
         """ Stops and removes exited containers.  """
+        start = time.time()
         container_be.stop()
         container_be.remove()
+        self.lifecycle_latencies['stop'].append(time.time() - start)
+
+    def _stop_containers(self):
+        """ Stops all the containers, in parallel. Waits for pending starts first so that no container is left behind.
+        """
+        wait(list(self.pending.values()))
+        self._collect_pending(retry=False)
+        self.start_failures.clear()
+        for i in list(self.slot_root_pids):
+            self._untrack_pids(i)
+        futures = [self.executor.submit(self._stop_be, container_be) for container_be in self.container_bes
+                   if container_be is not None]
+        self.container_bes = []
+        self.slot_bes = []
+        self.exit_times.clear()
+        for future in futures:
+            future.result()  # raises if stopping failed
+        self._remove_warm()
+        if self.watcher is not None:
+            self.watcher.clear()  # the exits caused by stopping are not completions
+        self.log_lifecycle_latencies()
 
     def stop_bes(self):
-        """ Stops all the containers. """
-        for container_be in self.container_bes:
-            self._stop_be(container_be)
+        """ Stops all the containers, the worker pools and the completion watcher, at the end of the experiment. """
+
+        self._stop_containers()
+        self.executor.shutdown()
+        self.warm_executor.shutdown()
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher.join(timeout=5)
+
+    def _remove_warm(self):
+        """ Removes the pre-created containers that were never started. """
+
+        while self.warm:
+            be, warm_future = self.warm.popleft()
+            try:
+                warm_future.result().remove(force=True)
+            except Exception as e:
+                log.warning("Removing pre-warmed container of {} failed ({})".format(be, e))
+
+    def log_lifecycle_latencies(self):
+        """ Reports the latencies of starting and stopping containers. """
+
+        for operation, latencies in self.lifecycle_latencies.items():
+            if latencies:
+                log.info("Container {}: {} times, mean {:.2f}s max {:.2f}s".format(
+                    operation, len(latencies), sum(latencies) / len(latencies), max(latencies)))
+        log.info("Idle BE core time between jobs: {:.1f} core seconds".format(self.idle_core_time))
 
     def update_status(self):
         """ Polls the status of the containers and determines which of them have finished. If the  """
@@ -164,8 +536,8 @@ class Scheduler(ABC):
 class RandomScheduler(Scheduler):
     """ Initializes a random generator given a specific seed. The choices of the bes are made by the generator. """
 
-    def __init__(self, config):
-        super().__init__(config)
+    def __init__(self, config, event_source=None, client=None):
+        super().__init__(config, event_source, client)
         self.seed = config.getint(SEED)
         self.generator = random.Random(self.seed)
 
@@ -180,8 +552,8 @@ class RandomScheduler(Scheduler):
 class QueueScheduler(Scheduler):
     """ It takes a list of BEs as input. The choices of the bes are made as in a queue. """
 
-    def __init__(self, config):
-        super().__init__(config)
+    def __init__(self, config, event_source=None, client=None):
+        super().__init__(config, event_source, client)
         self.bes_list = config[BES_LIST]
         self.bes_selected = ast.literal_eval(self.bes_list)
         # num of total bes can be less than the provided BEs, but never bigger
@@ -193,3 +565,172 @@ class QueueScheduler(Scheduler):
     def reset(self):
         self.bes_selected = ast.literal_eval(self.bes_list)
         self._restart_scheduling()
+
+
+class RuntimeEstimator:
+    """ Keeps the mean runtime of each BE over past runs, persisted in a json file. """
+
+    def __init__(self, path):
+        self.path = path
+        self.runtimes = {}  # be -> [mean runtime in seconds, number of runs]
+        if os.path.exists(path):
+            with open(path) as file:
+                self.runtimes = json.load(file)
+
+    def estimate(self, be):
+        """ Estimated runtime of a BE, BEs never seen before get the mean of the known ones. """
+
+        if be in self.runtimes:
+            return self.runtimes[be][0]
+        if self.runtimes:
+            return sum(mean for mean, _ in self.runtimes.values()) / len(self.runtimes)
+        return 1.
+
+    def update(self, be, runtime):
+        mean, runs = self.runtimes.get(be, [0., 0])
+        self.runtimes[be] = [(mean * runs + runtime) / (runs + 1), runs + 1]
+        with open(self.path, 'w') as file:
+            json.dump(self.runtimes, file, indent=2)
+
+
+class MakespanScheduler(Scheduler):
+    """ Places the BEs of a list so as to minimise their makespan. BEs may ask for their own number of cores (fourth
+    element of their entry in the docker file, cores_per_be otherwise). Jobs are placed longest processing time first,
+    based on runtimes learned from past runs. The longest job that does not fit reserves the time at which enough
+    cores are expected to be free, shorter jobs backfill the cores in the meantime only if they are expected to end
+    before it (EASY backfilling), so that backfilling never delays it. """
+
+    fixed_slots = False  # slots take whichever cores are free when their BE is placed
+
+    def __init__(self, config, event_source=None, client=None):
+        # validated before the base class starts the completion watcher and the workers
+        bes = ast.literal_eval(config[BES_LIST])
+        bes_available = read_avail_dockers(config[DOCKER_FILE])
+        num_cores = len(parse_num_list(config[CORES_BE]))
+        too_big = sorted({be for be in bes if self.requested_cores(bes_available[be], config.getint(CORES_PER_BE))
+                          > num_cores})
+        if too_big:
+            raise ValueError("BEs {} ask for more cores than the {} BE cores".format(too_big, num_cores))
+
+        super().__init__(config, event_source, client)
+        self.bes_list = config[BES_LIST]
+        self.num_total_bes = min(self.num_total_bes, len(bes))
+        self.estimator = RuntimeEstimator(config.get(RUNTIME_DB, fallback='be_runtimes.json'))
+        self.prewarm = False  # selection order depends on placement, containers can not be created ahead
+        self.queue = []
+        self.free_cores = []
+        self.slot_cores = []  # cores of each slot, slots are created as BEs are placed
+        self.slot_started = []
+        self.sequence = 0
+
+    @staticmethod
+    def requested_cores(entry, cores_per_be):
+        """ Number of cores of an entry of the docker file. """
+
+        return entry[3] if len(entry) > 3 else cores_per_be
+
+    def be_cores(self, be):
+        """ Number of cores that a BE asks for. """
+
+        return self.requested_cores(self.bes_available[be], self.cores_per_be)
+
+    def cores_map(self, i):
+        return ','.join(map(str, self.slot_cores[i]))
+
+    def _container_name(self, cores):
+        # the same cores may be reused before the previous container is removed, so names are made unique. Called only
+        # by the control thread, the name is passed to the worker that runs the container.
+        self.sequence += 1
+        return 'be_{}_{}'.format(cores.replace(",", "_"), self.sequence)
+
+    def _sort_queue(self):
+        self.queue.sort(key=self.estimator.estimate, reverse=True)
+
+    def _select_be(self):
+        return self.queue.pop(0)
+
+    def _reserve(self, cores_needed, now, placements):
+        """ Estimated time at which cores_needed cores are free, as the running and the just placed BEs end. """
+
+        ends = [(max(self.slot_started[i] + self.estimator.estimate(be), now), len(self.slot_cores[i]))
+                for i, be in enumerate(self.slot_bes) if be is not None]
+        ends += [(now + self.estimator.estimate(be), len(cores)) for be, cores in placements]
+        free = len(self.free_cores)
+        for end, cores in sorted(ends):
+            free += cores
+            if free >= cores_needed:
+                return end
+        return float('inf')  # not reached, BEs never ask for more than the BE cores
+
+    def _place(self):
+        """ Longest processing time first with EASY backfilling. Returns a list of (be, cores) placements. """
+
+        placements = []
+        now = time.time()
+        reservation = None  # start time reserved for the first job that does not fit
+        i = 0
+        while i < len(self.queue):
+            be = self.queue[i]
+            cores_needed = self.be_cores(be)
+            fits = cores_needed <= len(self.free_cores)
+            if fits and (reservation is None or now + self.estimator.estimate(be) <= reservation):
+                self.queue.pop(i)
+                placements.append((be, self.free_cores[:cores_needed]))
+                self.free_cores = self.free_cores[cores_needed:]
+            else:
+                if not fits and reservation is None:
+                    reservation = self._reserve(cores_needed, now, placements)
+                i += 1
+        return placements
+
+    def _free_slot(self):
+        """ Returns the index of a slot that runs nothing, a new slot is added if there is none. """
+
+        for i, be in enumerate(self.slot_bes):
+            if be is None and i not in self.pending:
+                return i
+        self.container_bes.append(None)
+        self.slot_bes.append(None)
+        self.slot_cores.append(None)
+        self.slot_started.append(None)
+        return len(self.slot_bes) - 1
+
+    def _launch(self, placements):
+        for be, cores in placements:
+            i = self._free_slot()
+            self.slot_cores[i] = cores
+            self.slot_bes[i] = be
+            self.slot_started[i] = time.time()
+            log.info('Selected Job: {} on core(s) {} (estimated runtime {:.0f}s)'.format(
+                be, self.cores_map(i), self.estimator.estimate(be)))
+            self.pending[i] = self.executor.submit(self._run_be, be, self.cores_map(i),
+                                                   self._container_name(self.cores_map(i)))
+
+    def start_bes(self):
+        self.free_cores = list(self.cores_pids_be_range)
+        self.slot_cores, self.slot_started = [], []
+        self._sort_queue()
+        self._launch(self._place())
+        wait(list(self.pending.values()))
+        self._collect_pending()
+
+        self.start_time_bes = time.time()
+
+    def reissue_bes(self, have_finished):
+        for i, has_finished in enumerate(have_finished):
+            if has_finished:
+                self.estimator.update(self.slot_bes[i], self.exit_times.pop(i, time.time()) - self.slot_started[i])
+                self._untrack_pids(i)
+                self.executor.submit(self._stop_be, self.container_bes[i])  # only cleanup, the container has exited
+                self.free_cores = sorted(self.free_cores + self.slot_cores[i])
+                self.container_bes[i] = None
+                self.slot_bes[i] = None
+                log.info("Finished Bes: {}/{}".format(self.finished_bes, self.num_total_bes))
+
+        if any(have_finished):
+            self._sort_queue()
+            self._launch(self._place())
+
+    def reset(self):
+        self.queue = ast.literal_eval(self.bes_list)
+        self._restart_scheduling()
@@ -0,0 +1,400 @@
+import ast
+import math
+import random
+import logging
+from loader import Loader
+from utils.functions import parse_num_list, read_avail_dockers
+from utils.config_constants import *
+
+log = logging.getLogger('simpleExample')
+
+# Analytic model of a socket where a latency critical (LC) service and a group of Best Effort (BE) applications share
+# the LLC and the memory bandwidth. It stands in for PqosHandler, Loader and Scheduler so that the whole control stack
+# runs without the lab server, on a virtual clock that advances by one action interval per step.
+
+CACHE_LINE = 64  # bytes
+
+# working set in MB, LLC accesses per kilo instruction, IPC with a perfect LLC, instructions in billions
+BE_PROFILES = {
+    'graphs': (60., 25., 1.1, 2400.),
+    'in-memory': (40., 18., 1.3, 1800.),
+    'in-memory-small': (12., 14., 1.4, 300.),
+    'DecisionTreeClassification': (20., 12., 1.5, 600.),
+    'GradientBoostedTreeRegressor': (22., 14., 1.4, 900.),
+    'LinearSVC': (16., 10., 1.6, 500.),
+    'LogisticRegressionWithElasticNet': (18., 11., 1.5, 550.),
+    'RandomForestClassifier': (24., 13., 1.4, 800.),
+    'libquantum': (32., 30., 0.9, 700.),
+    'mcf': (50., 35., 0.6, 500.),
+    'lbm': (45., 32., 0.8, 650.),
+    'astar': (10., 8., 1.2, 450.),
+    'hmmer': (2., 3., 2.2, 600.),
+    'gems': (36., 26., 0.9, 700.),
+}
+
+
+def be_profile(name):
+    """ Returns the profile of a BE. Unknown BEs get a profile that is derived deterministically from their name. """
+
+    if name in BE_PROFILES:
+        return BE_PROFILES[name]
+    generator = random.Random(name)
+    return generator.uniform(4, 50), generator.uniform(3, 30), generator.uniform(0.8, 2.), generator.uniform(300, 2000)
+
+
+def miss_ratio(capacity, working_set, compulsory=0.02):
+    """ Miss curve of an application, misses fall quadratically until the working set fits in the capacity. """
+
+    if working_set <= 0:
+        return compulsory
+    uncovered = max(0., 1. - capacity / working_set)
+    return compulsory + (1. - compulsory) * uncovered ** 2
+
+
+class Group:
+    """ Cumulative counters of a monitoring group, mirrors the fields of the values of a pqos monitoring group. """
+
+    def __init__(self):
+        self.cycles = 0.
+        self.instructions = 0.
+        self.misses = 0.
+        self.mbl = 0.  # bytes
+        self.llc = 0.  # MB, occupancy is a gauge and not a counter
+
+    def snapshot(self):
+        return self.cycles, self.instructions, self.misses, self.mbl, self.llc
+
+
+class ContentionModel:
+    """ Shared state of the simulated socket. """
+
+    def __init__(self, config=None, seed=None):
+        """
+        Parameters:
+            config: the simulator section of the config, every parameter falls back to a default
+            seed: seed of the noise generator
+        """
+        get = (lambda key, default: config.getfloat(key, fallback=default)) if config is not None else \
+            (lambda key, default: default)
+        self.num_ways = int(get(SIM_NUM_WAYS, 20))
+        self.llc_mb = get(SIM_LLC_MB, 25.)
+        self.frequency = get(SIM_FREQUENCY, 2.2) * 1e9
+        self.mem_latency = get(SIM_MEM_LATENCY, 90.) * 1e-9  # seconds
+        self.peak_bandwidth = get(SIM_PEAK_BW, 3 * 1e4) * 1024 * 1024  # bytes/s
+        self.lc_working_set = get(SIM_LC_WS, 8.)
+        self.lc_accesses = get(SIM_LC_ACCESSES, 200.)  # LLC accesses per request
+        self.lc_service = get(SIM_LC_SERVICE, 40.) * 1e-6  # seconds per request with a perfect LLC
+        self.lc_ipc = get(SIM_LC_IPC, 1.5)  # IPC of the LC service with a perfect LLC
+        self.noise = get(SIM_NOISE, 0.05)
+        self.generator = random.Random(seed)
+
+        self.clock = 0.
+        self.ways_be = None  # None means that all ways are shared
+        self.mba_be = 100.  # percentage of the peak bandwidth the BEs may use
+        self.rps = 0.
+        self.lc_cores = 1
+        self.jobs = {}  # slot -> [name, remaining instructions, cores]
+        self.be_instructions_ps = {}  # slot -> (BE, its instructions per second) in the last advance
+        self.lc = Group()
+        self.be = Group()
+        self.slots = {}  # slot -> Group of the BE that runs there, as per slot monitoring groups
+        self.last_latency = 0.
+
+    def set_allocation(self, ways_be):
+        """ Ways given to the BEs, the rest are given to the LC service. None shares all ways between the two. """
+
+        self.ways_be = ways_be
+
+    def set_throttle(self, mba_be):
+        """ MBA level of the BEs, in percent of the peak bandwidth. """
+
+        self.mba_be = mba_be
+
+    def _be_instructions_ps(self, slot):
+        """ Instructions per second of the BE of a slot, as of the last advance, or without misses if it just started.
+        """
+
+        name, _, cores = self.jobs[slot]
+        last_name, instructions_ps = self.be_instructions_ps.get(slot, (None, 0.))
+        if last_name == name:
+            return instructions_ps
+        return cores * self.frequency * be_profile(name)[2]
+
+    def _capacities(self, be_ws):
+        """ LLC capacity in MB of the LC service and the BEs. """
+
+        way_mb = self.llc_mb / self.num_ways
+        if self.ways_be is None:  # shared cache, capacity is split by the LLC accesses per second of each group
+            lc_pressure = self.rps * self.lc_accesses
+            be_pressure = sum(self._be_instructions_ps(slot) * be_profile(name)[1] / 1000.
+                              for slot, (name, _, _) in self.jobs.items())
+            total = lc_pressure + be_pressure
+            lc_share = lc_pressure / total if total > 0 else 1.
+            lc_capacity = min(self.lc_working_set, self.llc_mb * lc_share)
+            return lc_capacity, self.llc_mb - lc_capacity
+        be_capacity = self.ways_be * way_mb
+        return self.llc_mb - be_capacity, be_capacity
+
+    def advance(self, dt, quantile):
+        """ Advances the virtual clock by dt seconds. Returns the tail latency in ms and the served rps. """
+
+        be_ws = sum(be_profile(job[0])[0] for job in self.jobs.values())
+        lc_capacity, be_capacity = self._capacities(be_ws)
+        lc_miss = miss_ratio(lc_capacity, self.lc_working_set)
+
+        # memory latency depends on the bandwidth utilisation that depends on the latency, a few iterations suffice
+        latency_factor = 1.
+        for _ in range(3):
+            mem_latency = self.mem_latency * latency_factor
+            be_rates = {}
+            be_bandwidth = 0.
+            for slot, (name, remaining, cores) in self.jobs.items():
+                working_set, apki, ipc_ideal, _ = be_profile(name)
+                share = be_capacity * working_set / be_ws if be_ws > 0 else 0.
+                miss = miss_ratio(share, working_set)
+                cpi = 1. / ipc_ideal + apki / 1000. * miss * mem_latency * self.frequency
+                instructions_ps = cores * self.frequency / cpi
+                misses_ps = instructions_ps * apki / 1000. * miss
+                be_rates[slot] = (instructions_ps, misses_ps)
+                be_bandwidth += misses_ps * CACHE_LINE
+            # MBA delays the requests of the BEs, modelled as a cap on their bandwidth that slows them down
+            be_cap = self.peak_bandwidth * self.mba_be / 100.
+            if be_bandwidth > be_cap:
+                throttle = be_cap / be_bandwidth
+                be_rates = {slot: (instructions_ps * throttle, misses_ps * throttle)
+                            for slot, (instructions_ps, misses_ps) in be_rates.items()}
+                be_bandwidth = be_cap
+            lc_misses_ps = self.rps * self.lc_accesses * lc_miss
+            utilisation = min((be_bandwidth + lc_misses_ps * CACHE_LINE) / self.peak_bandwidth, 0.95)
+            latency_factor = 1. / (1. - utilisation)
+
+        # LC service as an M/M/1 queue per core, the response time is exponential with rate mu - lambda
+        service = self.lc_service + self.lc_accesses * lc_miss * mem_latency
+        mu = self.lc_cores / service
+        lam = self.rps
+        if lam < mu:
+            tail = -math.log(1. - quantile) / (mu - lam) * 1000.
+        else:
+            tail = 1000.  # saturated
+        tail *= math.exp(self.generator.gauss(0., self.noise))
+        self.last_latency = tail
+
+        # integrate the counters
+        served = min(lam, mu) * dt
+        self.lc.cycles += served * service * self.frequency
+        self.lc.instructions += served * self.lc_service * self.frequency * self.lc_ipc
+        self.lc.misses += lc_misses_ps * dt
+        self.lc.mbl += lc_misses_ps * CACHE_LINE * dt
+        self.lc.llc = min(lc_capacity, self.lc_working_set)
+        for slot, (instructions_ps, misses_ps) in be_rates.items():
+            job = self.jobs[slot]
+            job[1] -= instructions_ps * dt
+            for group in (self.be, self.slots.setdefault(slot, Group())):
+                group.cycles += job[2] * self.frequency * dt
+                group.instructions += instructions_ps * dt
+                group.misses += misses_ps * dt
+                group.mbl += misses_ps * CACHE_LINE * dt
+        self.be.llc = min(be_capacity, be_ws)
+        self.be_instructions_ps = {slot: (self.jobs[slot][0], instructions_ps)
+                                   for slot, (instructions_ps, _) in be_rates.items()}
+
+        self.clock += dt
+
+        return tail, min(lam, mu)
+
+
+def _group_metrics(previous, current, time_interval):
+    """ Same output as pqos_handler.get_metrics for the deltas between two snapshots of a simulated group. """
+
+    cycles, instructions, misses, mbl = [current[i] - previous[i] for i in range(4)]
+    llc = current[4]
+    ipc = instructions / cycles if cycles > 0 else 0.
+    mbl_ps = mbl / (1024. * 1024.) / time_interval if time_interval > 0 else 0.
+
+    return ipc, misses, llc, mbl_ps, 0., cycles, instructions
+
+
+class PqosHandlerSim:
+    """ Simulated pqos handler, allocation decisions are applied to the contention model. """
+
+    def __init__(self, model, mba_levels=None):
+        self.model = model
+        self.num_ways = model.num_ways
+        if mba_levels is None:
+            mba_levels = [100]
+        elif mba_levels == 'auto':
+            mba_levels = list(range(10, 101, 10))
+        self.mba_levels = sorted(mba_levels)
+        self.previous = self._snapshot()
+        self.current = dict(self.previous)
+
+    def setup_groups(self):
+        pass
+
+    def reset(self):
+        self.model.set_allocation(None)
+        self.model.set_throttle(100.)
+
+    def _snapshot(self):
+        snapshot = {'hp': self.model.lc.snapshot(), 'be': self.model.be.snapshot()}
+        snapshot.update((slot, group.snapshot()) for slot, group in self.model.slots.items())
+        return snapshot
+
+    def update(self):
+        self.previous = self.current
+        self.current = self._snapshot()
+
+    def get_hp_metrics(self, time_interval):
+        return _group_metrics(self.previous['hp'], self.current['hp'], time_interval)
+
+    def get_be_metrics(self, time_interval):
+        return _group_metrics(self.previous['be'], self.current['be'], time_interval)
+
+    def get_slot_metrics(self, time_interval):
+        """ Same as PqosHandlerCore.get_slot_metrics, slots that have not run yet report nothing. """
+
+        num_slots = len(self.model.slots)
+        return [_group_metrics(self.previous[slot], self.current[slot], time_interval)
+                if slot in self.previous and slot in self.current else None for slot in range(num_slots)]
+
+    def stop(self):
+        pass
+
+    def set_association_class(self):
+        pass
+
+    @property
+    def monitors_slots(self):
+        """ The model always tracks its BEs per slot. """
+        return True
+
+    @property
+    def num_actions(self):
+        """ Same as PqosHandler with one bit as the minimum mask, HP keeps at least one way. """
+
+        return self.num_ways - 1
+
+    def set_allocation_class(self, ways_be):
+        """ Same semantics as PqosHandler.set_allocation_class, action i gives i + 1 ways to the BEs. """
+
+        self.model.set_allocation(None if ways_be == -1 else min(ways_be + 1, self.num_ways - 1))
+
+    def set_mba_class(self, level):
+        """ Same semantics as PqosHandler.set_mba_class. """
+
+        self.model.set_throttle(100. if level == -1 else self.mba_levels[level])
+
+    def reset_allocation_association(self):
+        self.model.set_allocation(None)
+        self.model.set_throttle(100.)
+
+    def print_association_config(self):
+        pass
+
+    def print_allocation_config(self):
+        log.debug("Simulated allocation: BE ways {}, BE MBA {}%".format(self.model.ways_be, self.model.mba_be))
+
+    def finish(self):
+        pass
+
+
+class LoaderSim(Loader):
+    """ Simulated service loader. A request for stats advances the virtual clock by one measurement interval
+    and returns immediately. """
+
+    def __init__(self, config, model):
+        super().__init__(config)
+        self.model = model
+        self.model.rps = self.rps
+        self.model.lc_cores = config.getint(SIM_LC_CORES, fallback=1)
+
+    def start(self):
+        self.client = True
+        log.debug("Simulated loader started.")
+
+    def stop(self):
+        self.client = None
+
+    def is_running(self):
+        return self.client is not None
+
+    def clear_stats(self):
+        pass
+
+    def now(self):
+        return self.model.clock
+
+    def get_stats(self):
+        return self.model.advance(int(self.measurement_interval) / 1000., float(self.quantile))
+
+
+class SchedulerSim:
+    """ Simulated scheduler, BEs are jobs of the contention model that finish once they retire their instructions.
+    Jobs are selected as in a queue, when the queue is exhausted they are selected randomly. """
+
+    def __init__(self, config, model):
+        self.model = model
+        self.cores_per_be = config.getint(CORES_PER_BE)
+        self.cores_pids_be_range = parse_num_list(config[CORES_BE])
+        self.bes_available = read_avail_dockers(config[DOCKER_FILE])
+        self.bes_list = config.get(BES_LIST, '[]')
+        self.num_total_bes = config.getint(NUM_BES)
+        self.seed = config.getint(SEED, fallback=1)
+        self.scale = config.getfloat(SIM_BE_SCALE, fallback=1.)  # scales the length of the BEs
+
+        self.bes_selected = []
+        self.generator = random.Random(self.seed)
+        self.finished_bes = 0
+        self.start_time_bes = None
+        self.experiment_duration = 0
+
+    def cores_map(self, i):
+        cores_range = self.cores_pids_be_range[i * self.cores_per_be: (i + 1) * self.cores_per_be]
+        return ','.join(map(str, cores_range))
+
+    @property
+    def slot_bes(self):
+        """ Name of the BE that runs in each slot. """
+
+        return [self.model.jobs[slot][0] if slot in self.model.jobs else None
+                for slot in range(len(self.cores_pids_be_range) // self.cores_per_be)]
+
+    def _select_be(self):
+        if self.bes_selected:
+            return self.bes_selected.pop(0)
+        return self.generator.choice(list(self.bes_available.keys()))
+
+    def _start_be(self, slot):
+        be = self._select_be()
+        log.info('Selected Job: {}'.format(be))
+        self.model.jobs[slot] = [be, be_profile(be)[3] * 1e9 * self.scale, self.cores_per_be]
+
+    def reset(self):
+        self.bes_selected = ast.literal_eval(self.bes_list)
+        self.num_total_bes = min(self.num_total_bes, len(self.bes_selected)) if self.bes_selected else \
+            self.num_total_bes
+        self.generator = random.Random(self.seed)
+        self.finished_bes = 0
+        self.model.jobs.clear()
+        for i in range(len(self.cores_pids_be_range) // self.cores_per_be):
+            self._start_be(i)
+        self.start_time_bes = self.model.clock
+
+    def update_status(self):
+        for slot, job in list(self.model.jobs.items()):
+            if job[1] <= 0:
+                self.finished_bes += 1
+                log.info("Finished Bes: {}/{}".format(self.finished_bes, self.num_total_bes))
+                self._start_be(slot)
+
+        done = self.finished_bes >= self.num_total_bes
+        if done:
+            self.experiment_duration = (self.model.clock - self.start_time_bes) / 60
+
+        return done
+
+    def stop_bes(self):
+        self.model.jobs.clear()
+
+    def get_experiment_duration(self):
+        return self.experiment_duration
@@ -0,0 +1,190 @@
+import time
+import json
+import threading
+import itertools
+import configparser
+import pytest
+from scheduler import QueueScheduler, MakespanScheduler, QueueEventSource
+
+# The scheduler runs here without a docker daemon: containers come from a client stand in and their exits are emitted
+# by hand through a QueueEventSource, as the daemon would stream them.
+
+
+class FakeContainer:
+    ids = itertools.count()
+
+    def __init__(self, containers, image, name):
+        self.id = 'c{}'.format(next(self.ids))
+        self.containers = containers
+        self.image = image
+        self.name = name
+        self.status = 'running'
+        self.attrs = {'State': {'Pid': 0}}
+
+    def reload(self):
+        pass
+
+    def stop(self):
+        self.status = 'exited'
+
+    def remove(self, force=False):
+        self.containers.by_name.pop(self.name, None)
+
+
+class FakeContainers:
+    """ Names are unique as in docker. A failed run has already created its container, as when starting it fails. """
+
+    def __init__(self):
+        self.started = []
+        self.by_name = {}
+        self.failures = 0  # runs that fail before the next one succeeds
+
+    def run(self, image, command=None, name=None, cpuset_cpus=None, volumes_from=None, detach=True):
+        if name in self.by_name:
+            raise RuntimeError('Conflict, the name {} is already in use'.format(name))
+        container = FakeContainer(self, image, name)
+        self.by_name[name] = container
+        if self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError('daemon unavailable')
+        self.started.append(container)
+        return container
+
+    def list(self, all=False, filters=None):
+        name = filters['name'].strip('^$')
+        return [self.by_name[name]] if name in self.by_name else []
+
+
+class FakeClient:
+    def __init__(self):
+        self.containers = FakeContainers()
+
+
+def build_scheduler(tmp_path, bes_list):
+    docker_file = tmp_path / 'dockers.txt'
+    docker_file.write_text("{'a': ('image_a', 'run_a', None), 'b': ('image_b', 'run_b', None)}")
+    config = configparser.ConfigParser()
+    config['scheduler'] = {'cores_be': '0-3', 'cores_per_be': '2', 'docker_file': str(docker_file),
+                           'be_repeated': '1', 'num_bes': str(len(bes_list)), 'bes_list': str(bes_list)}
+    source = QueueEventSource()
+    client = FakeClient()
+
+    return QueueScheduler(config['scheduler'], source, client), source, client
+
+
+def wait_for(condition, timeout=5.):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition was not met in time"
+        time.sleep(0.01)
+
+
+def test_completion_watcher_drives_reissue(tmp_path):
+    scheduler, source, client = build_scheduler(tmp_path, ['a', 'b', 'a'])
+    try:
+        scheduler.reset()
+        assert scheduler.event_driven
+        assert [container.image for container in client.containers.started] == ['image_a', 'image_b']
+        assert not scheduler.update_status()
+
+        first = scheduler.container_bes[0]
+        source.emit(first.id, first.name)
+        wait_for(lambda: first.id in scheduler.watcher.exited)
+        assert not scheduler.update_status()
+        assert scheduler.finished_bes == 1
+
+        wait_for(lambda: len(client.containers.started) == 3)
+        wait_for(lambda: not scheduler.update_status() and scheduler.container_bes[0] is not None)
+        assert scheduler.slot_bes == ['a', 'b']
+
+        for container in scheduler.container_bes:
+            source.emit(container.id, container.name)
+        wait_for(lambda: len(scheduler.watcher.exited) == 2)
+        assert scheduler.update_status()
+    finally:
+        scheduler.stop_bes()
+
+    assert not scheduler.watcher.is_alive()
+
+
+def test_exits_of_other_containers_are_ignored(tmp_path):
+    scheduler, source, client = build_scheduler(tmp_path, ['a', 'b'])
+    try:
+        scheduler.reset()
+        source.emit('other', 'memcached')
+        source.emit(scheduler.container_bes[0].id, scheduler.container_bes[0].name, status='start')
+        first = scheduler.container_bes[1]
+        source.emit(first.id, first.name)
+        wait_for(lambda: first.id in scheduler.watcher.exited)
+        assert set(scheduler.watcher.exited) == {first.id}
+    finally:
+        scheduler.stop_bes()
+
+
+def test_failed_start_is_retried(tmp_path):
+    scheduler, source, client = build_scheduler(tmp_path, ['a', 'b'])
+    client.containers.failures = 1
+    try:
+        scheduler.reset()
+        assert scheduler.container_bes.count(None) == 1
+        wait_for(lambda: not scheduler.update_status() and None not in scheduler.container_bes)
+        assert sorted(container.image for container in client.containers.started) == ['image_a', 'image_b']
+        assert sorted(client.containers.by_name) == ['be_0_1', 'be_2_3']
+    finally:
+        scheduler.stop_bes()
+
+
+def build_makespan(tmp_path, bes_list, runtimes, cores_be='0-3'):
+    docker_file = tmp_path / 'dockers.txt'
+    docker_file.write_text("{'big': ('image_big', 'run', None, 4), 'a': ('image_a', 'run', None), "
+                           "'quick': ('image_quick', 'run', None), 'slow': ('image_slow', 'run', None)}")
+    runtime_db = tmp_path / 'runtimes.json'
+    runtime_db.write_text(json.dumps({be: [runtime, 1] for be, runtime in runtimes.items()}))
+    config = configparser.ConfigParser()
+    config['scheduler'] = {'cores_be': cores_be, 'cores_per_be': '2', 'docker_file': str(docker_file),
+                           'be_repeated': '1', 'num_bes': str(len(bes_list)), 'bes_list': str(bes_list),
+                           'runtime_db': str(runtime_db)}
+
+    return MakespanScheduler(config['scheduler'], QueueEventSource(), FakeClient())
+
+
+def test_backfill_does_not_delay_the_reserved_job(tmp_path):
+    scheduler = build_makespan(tmp_path, ['big', 'slow', 'quick'], {'a': 30., 'big': 100., 'quick': 10., 'slow': 50.})
+    try:
+        # a runs on two of the cores, big needs all four and waits for it
+        scheduler.slot_bes, scheduler.slot_cores, scheduler.slot_started = ['a'], [[0, 1]], [time.time()]
+        scheduler.free_cores = [2, 3]
+        scheduler.queue = ['big', 'slow', 'quick']  # longest first
+        placements = scheduler._place()
+        assert placements == [('quick', [2, 3])]  # slow fits too, but would still run when a ends
+        assert scheduler.queue == ['big', 'slow']
+    finally:
+        scheduler.stop_bes()
+
+
+def test_too_big_bes_are_rejected_before_the_watcher_starts(tmp_path):
+    threads = threading.active_count()
+    with pytest.raises(ValueError):
+        build_makespan(tmp_path, ['a', 'big'], {}, cores_be='0-1')
+    assert threading.active_count() == threads
+
+
+def test_retry_removes_the_container_that_was_not_stopped(tmp_path):
+    scheduler, source, client = build_scheduler(tmp_path, ['a', 'b', 'a'])
+    try:
+        scheduler.reset()
+        first = scheduler.container_bes[0]
+
+        def remove(force=False):  # the plain remove of the replacement fails, the forced one of the retry works
+            if not force:
+                raise RuntimeError('removal of container {} is already in progress'.format(first.name))
+            client.containers.by_name.pop(first.name)
+
+        first.remove = remove
+        source.emit(first.id, first.name)
+        wait_for(lambda: first.id in scheduler.watcher.exited)
+        scheduler.update_status()
+        wait_for(lambda: not scheduler.update_status() and scheduler.container_bes[0] is not None)
+        assert scheduler.container_bes[0] is not first and scheduler.start_failures == {}
+    finally:
+        scheduler.stop_bes()
@@ -3,7 +3,8 @@ import argparse
 
 def cmd_parser():
     """
-    Parses command line arguments.
+    Parses command line arguments. The entry points parse their args before importing the heavy backends (torch,
+    tensorboard, pqos, docker), so --help and usage errors exit without paying for them, see utils/startup_benchmark.py.
 
     Returns:
         an object with parsed command line arguments
@@ -29,6 +30,15 @@ def cmd_parser():
     parser.add_argument('-q', '--quantile', default='.95', help='Choose quantile for which stats will be reported')
     parser.add_argument('-f', '--feature', default='MPKC', help='Hw feature to be used as input')
     parser.add_argument('-d', '--decay', default='0.0005', help='Epsilon decay rate')
+    parser.add_argument('--async-learner', action='store_true', help='Train in a separate learner process')
+    parser.add_argument('--updates-per-step', type=int, default=1, help='Gradient steps of the learner per env step')
+    parser.add_argument('--metrics-policy', default='drop', choices=['drop', 'block'],
+                        help='What to do with metrics when the background writer falls behind')
+    parser.add_argument('--step-log-dir', default='', help='Dir of the columnar step log, off unless set')
+    parser.add_argument('--replay', nargs='+', default=None, help='Step logs to replay instead of using the hardware')
+    parser.add_argument('--simulate', action='store_true', help='Use the analytic contention simulator as backend')
+    parser.add_argument('--scheduler', default='queue', choices=['queue', 'random', 'makespan'],
+                        help='Scheduler of the BEs')
     # parser.add_argument('--path-mem', help='')
     # nargs='+' all command-line args present are gathered into a list
 
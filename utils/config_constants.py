@@ -4,16 +4,33 @@ LOADER = "loader"
 SCHEDULER = "scheduler"
 AGENT = "agent"
 PQOS = "pqos"
+SIMULATOR = "simulator"
 
 # env
 LATENCY_thr = "latency_thr"
 NUM_WAYS = 'num_ways'
 PEN_COEF = 'pen_coef'
 FEATURE = 'feature'
+REPLAY_MODE = 'replay_mode'
+REPLAY_STEPS = 'replay_steps'
+REWARD = 'reward'
+BE_BASELINES = 'be_baselines'
+WATCHDOG_FRACTION = 'watchdog_fraction'
+WATCHDOG_INTERVAL = 'watchdog_interval'
 
 # PQOS
 PQOS_INTERFACE = 'pqos_interface'
 CORES_LC = "cores_lc"
+SAMPLE_INTERVAL = 'sample_interval'
+BE_GROUPS = 'be_groups'
+MBA_LEVELS = 'mba_levels'
+SLOT_GROUPS = 'slot_groups'
+
+# Multi socket
+MULTISOCKET = 'multisocket'
+SOCKETS = 'sockets'
+SOCKET_SECTION = 'socket{}'
+CORES_CONTROL = 'cores_control'  # cores of the controller of a socket, its loader cores by default
 # needs also cores be
 
 # loader
@@ -28,6 +45,14 @@ LOADER_CONN = 'loader_conn'
 QUANTILE = 'quantile'
 EXP_DIST = 'exp_dist'
 GET_SET_RATIO = 'ratio'
+STATS_TIMEOUT_MARGIN = 'stats_timeout_margin'
+STATS_STALE_AFTER = 'stats_stale_after'
+LOADER_READY_TIMEOUT = 'ready_timeout'
+LOADER_SOFT_RESET = 'soft_reset'
+STATS_MODE = 'stats_mode'
+STREAM_PORT = 'stream_port'
+STREAM_SUB_INTERVAL = 'stream_sub_interval'
+STREAM_WATCH_WINDOW = 'stream_watch_window'
 
 # scheduler
 BE_REPEATED = 'be_repeated'
@@ -35,10 +60,28 @@ CORES_BE = 'cores_be'
 CORES_PER_BE = 'cores_per_be'
 NUM_BES = 'num_bes'
 DOCKER_FILE = 'docker_file'
+LIFECYCLE_WORKERS = 'lifecycle_workers'
+BE_COMPLETION = 'be_completion'
+PREWARM = 'prewarm'
+PREWARM_SIZE = 'prewarm_size'
 # scheduler subclasses
 SEED = 'seed'
 BES_LIST = 'bes_list'
+RUNTIME_DB = 'runtime_db'
 
+# simulator
+SIM_NUM_WAYS = 'num_ways'
+SIM_LLC_MB = 'llc_mb'
+SIM_FREQUENCY = 'frequency_ghz'
+SIM_MEM_LATENCY = 'mem_latency_ns'
+SIM_PEAK_BW = 'peak_bandwidth_mbps'
+SIM_LC_WS = 'lc_working_set_mb'
+SIM_LC_ACCESSES = 'lc_accesses_per_req'
+SIM_LC_SERVICE = 'lc_service_us'
+SIM_LC_IPC = 'lc_ipc'
+SIM_LC_CORES = 'sim_lc_cores'
+SIM_NOISE = 'noise'
+SIM_BE_SCALE = 'sim_be_scale'
 
 # TODO get most or maybe even all these constants from suite library
 # agent
@@ -6,13 +6,27 @@ LOGGER_PATH = 'logging.conf'
 LC_TAG = "Latency Critical"
 BE_TAG = "Best Effort"
 
+# order of the values returned by PqosHandler.get_hp_metrics/get_be_metrics
+pqos_counters = ['ipc', 'misses', 'llc', 'mbl', 'mbr', 'cycles', 'instructions']
+
 metric_names = ['IPC', 'Misses per k. cycles', 'LLC Occupancy', 'Bandwidth L.', 'Bandwidth R.', 'Latency', 'RPS']
 
+SLOT_TAG = "BE Slot {}"
+PROGRESS_TAG = "BE Progress"
+
+
+class Rewards(str, Enum):
+    WAYS = "ways"  # ways given to the BEs, as a proxy of their progress
+    THROUGHPUT = "throughput"  # measured progress of the BEs relative to running alone
+
 
 class Loaders(str, Enum):
     MEMCACHED = "memcached"
+    SIMULATED = "simulated"
 
 
 class Schedulers(str, Enum):
     RANDOM = "random"
     QUEUE = "queue"
+    MAKESPAN = "makespan"
+    SIMULATED = "simulated"
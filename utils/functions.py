@@ -1,7 +1,22 @@
-from utils.constants import metric_names
+from utils.constants import metric_names, pqos_counters, LC_TAG, BE_TAG, LOGGER_PATH
+import os
+import logging.config
 import re
+import ast
 import configparser
 
+_logging_configured = False
+
+
+def setup_logging(path=LOGGER_PATH):
+    """ Configures logging from the config file, once per process. Called by the entry points, modules only get their
+    logger. """
+
+    global _logging_configured
+    if not _logging_configured:
+        logging.config.fileConfig(path, disable_existing_loggers=False)
+        _logging_configured = True
+
 
 def config_parser(filename):
     config = configparser.ConfigParser()
@@ -21,13 +36,53 @@ def parse_num_list(string):
     return list(range(int(start), int(end)+1))
 
 
+def read_avail_dockers(docker_file):
+    """ Gets a dictionary with the available BEs and their parameters needed for execution. """
+
+    with open(docker_file, "r") as file:
+        contents = file.read()
+        bes = ast.literal_eval(contents)
+
+        return bes
+
+
+def process_tree(pid):
+    """ Returns the pid and the pids of all its descendants, processes that exit while walking are skipped. """
+
+    pids = []
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            tasks = os.listdir('/proc/{}/task'.format(current))
+        except FileNotFoundError:
+            continue
+        pids.append(current)
+        for task in tasks:
+            try:
+                with open('/proc/{}/task/{}/children'.format(current, task)) as f:
+                    pending.extend(int(child) for child in f.read().split())
+            except FileNotFoundError:
+                continue
+
+    return pids
+
+
 def write_metrics(tboard_writer, tag, metrics, step):
     """ Used to write to Tensorboard environment related metrics. """
     header = '{}/'.format(tag)
     for metric, metric_name in zip(metrics, metric_names):
         if metric is not None:
             tboard_writer.add_scalar(header + metric_name, metric, step)
-    tboard_writer.flush()
+
+
+def write_aggregates(tboard_writer, aggregates, step, counters=('misses', 'mbl')):
+    """ Used to write to Tensorboard the per window aggregates of the pqos sampler for some of the counters. """
+    for group, tag in (('hp', LC_TAG), ('be', BE_TAG)):
+        for stat in ('max', 'p95', 'slope'):
+            for counter in counters:
+                value = aggregates[group][stat][pqos_counters.index(counter)]
+                tboard_writer.add_scalar('{}/{} {}'.format(tag, counter, stat), value, step)
 
 
 def form_duration(duration_minutes):
@@ -0,0 +1,136 @@
+import time
+import queue
+import logging
+import threading
+from utils.constants import LOGGER
+
+log = logging.getLogger(LOGGER)
+
+DROP = 'drop'
+BLOCK = 'block'
+
+
+class MetricsSink:
+    """ Non blocking front end of a Tensorboard writer. Records are enqueued by the control loop and written in
+    batches by a background thread, so no file I/O takes place on the control path. The queue is bounded, when it is
+    full records are either dropped or the caller blocks, depending on the policy. """
+
+    def __init__(self, writer, max_size=10000, policy=DROP, batch_size=256, flush_interval=1.0):
+        """
+        Parameters:
+            writer: the SummaryWriter that the records end up at
+            max_size: max number of records waiting to be written
+            policy: 'drop' or 'block', what to do when the queue is full
+            batch_size: max number of records written between two flushes of the writer
+            flush_interval: max time in seconds that a record may wait before being flushed
+        """
+        if policy not in (DROP, BLOCK):
+            raise ValueError("Metrics sink policy {} is not supported".format(policy))
+        self.writer = writer
+        self.policy = policy
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.records = queue.Queue(maxsize=max_size)
+
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0  # records of the batches that the writer failed on
+        self.flushes = 0
+        self.flush_time_total = 0.
+        self.flush_time_max = 0.
+        self.max_depth = 0
+
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-sink', daemon=True)
+        self._thread.start()
+
+    def _put(self, record):
+        if not self._thread.is_alive():
+            raise RuntimeError("Metrics sink thread is not running, records can not be written")
+        if self.policy == BLOCK:
+            while True:  # wake up once in a while, the thread may die while the queue is full
+                try:
+                    self.records.put(record, timeout=1.0)
+                    return
+                except queue.Full:
+                    if not self._thread.is_alive():
+                        raise RuntimeError("Metrics sink thread is not running, records can not be written")
+        else:
+            try:
+                self.records.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+
+    def add_scalar(self, tag, value, step):
+        """ Same signature as SummaryWriter.add_scalar, it only enqueues the record. """
+
+        self._put(('add_scalar', (tag, value, step)))
+
+    def add_hparams(self, hparams, metrics):
+        self._put(('add_hparams', (hparams, metrics)))
+
+    def add_text(self, tag, text):
+        self._put(('add_text', (tag, text)))
+
+    def add_graph(self, model, input_to_model):
+        self._put(('add_graph', (model, input_to_model)))
+
+    def flush(self):
+        """ Flushing is handled by the background thread, kept for compatibility with SummaryWriter. """
+        pass
+
+    def _write_batch(self, batch):
+        """ Writes a batch of records and flushes the writer once. """
+
+        start = time.time()
+        for method, args in batch:
+            getattr(self.writer, method)(*args)
+        self.writer.flush()
+        flush_time = time.time() - start
+
+        self.written += len(batch)
+        self.flushes += 1
+        self.flush_time_total += flush_time
+        self.flush_time_max = max(self.flush_time_max, flush_time)
+
+        # the sink reports its own cost, step is the number of batches written so far
+        self.writer.add_scalar('Sink/Flush Time', flush_time * 1000, self.flushes)
+        self.writer.add_scalar('Sink/Batch Size', len(batch), self.flushes)
+        self.writer.add_scalar('Sink/Queue Depth', self.records.qsize(), self.flushes)
+        self.writer.add_scalar('Sink/Dropped', self.dropped, self.flushes)
+
+    def _run(self):
+        while not (self._closed.is_set() and self.records.empty()):
+            batch = []
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    if self._closed.is_set():
+                        batch.append(self.records.get_nowait())  # drain as fast as possible
+                    else:
+                        timeout = deadline - time.time()
+                        if timeout <= 0:
+                            break
+                        batch.append(self.records.get(timeout=timeout))
+                except queue.Empty:
+                    break
+                self.max_depth = max(self.max_depth, self.records.qsize() + 1)
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception:  # the thread must outlive a bad record, or the control loop would block or drop
+                    self.failed += len(batch)
+                    log.exception("Metrics sink failed to write a batch of {} records".format(len(batch)))
+
+    def close(self):
+        """ Writes all the pending records and closes the writer. """
+
+        self._closed.set()
+        self._thread.join()
+
+        mean_flush = self.flush_time_total / self.flushes * 1000 if self.flushes > 0 else 0.
+        log.info("Metrics sink: {} records written in {} flushes, {} dropped, {} failed, max queue depth {}, "
+                 "flush time mean {:.2f}ms max {:.2f}ms".format(self.written, self.flushes, self.dropped, self.failed,
+                                                               self.max_depth, mean_flush, self.flush_time_max * 1000))
+        self.writer.flush()
+        self.writer.close()
@@ -0,0 +1,179 @@
+import os
+import json
+import argparse
+import numpy as np
+from utils.constants import LC_TAG, BE_TAG, pqos_counters
+
+# Columnar log of every step of a run. Rows have a fixed dtype and are appended in place to a memory mapped file, so
+# appending does not allocate and the resident memory stays bounded no matter how long the run is. The file starts
+# with a fixed size JSON header that describes the dtype and the number of valid rows, followed by the rows.
+
+MAGIC = b'RDTSTEPLOG\n'
+HEADER_SIZE = 4096
+CHUNK_ROWS = 1 << 14  # file grows by that many rows at a time
+
+STEP_DTYPE = np.dtype([('step', np.int64), ('time', np.float64), ('interval', np.float64), ('action', np.int32)] +
+                      [('lc_' + counter, np.float64) for counter in pqos_counters] +
+                      [('be_' + counter, np.float64) for counter in pqos_counters] +
+                      [('latency', np.float64), ('rps', np.float64), ('reward', np.float64),
+                       ('epsilon', np.float64)])
+
+
+def _write_header(file, dtype, rows):
+    header = MAGIC + json.dumps({'dtype': dtype.descr, 'rows': rows}).encode()
+    assert len(header) <= HEADER_SIZE, "Step log header does not fit"
+    file.seek(0)
+    file.write(header.ljust(HEADER_SIZE, b'\0'))
+    file.flush()
+
+
+def _read_header(file):
+    header = file.read(HEADER_SIZE)
+    if not header.startswith(MAGIC):
+        raise ValueError("Not a step log file")
+    meta = json.loads(header[len(MAGIC):].rstrip(b'\0'))
+    dtype = np.dtype([tuple(field) for field in meta['dtype']])
+
+    return dtype, meta['rows']
+
+
+class RunLog:
+    """ Appends the steps of a run to a memory mapped step log file. """
+
+    def __init__(self, path, dtype=STEP_DTYPE, chunk_rows=CHUNK_ROWS, sync_every=1000):
+        """
+        Parameters:
+            path: file of the step log, it is overwritten if it exists
+            dtype: structured dtype of the rows
+            chunk_rows: number of rows the file grows by each time it gets full
+            sync_every: number of appends between two syncs of the header and the dirty pages to disk
+        """
+        self.path = path
+        self.dtype = dtype
+        self.chunk_rows = chunk_rows
+        self.sync_every = sync_every
+        self.rows = 0
+        self.capacity = 0
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.file = open(path, 'w+b')
+        _write_header(self.file, dtype, 0)
+        self.mm = None
+        self._grow()
+
+    def _grow(self):
+        """ Extends the file by one chunk and maps it again. """
+
+        if self.mm is not None:
+            self.mm.flush()
+            del self.mm
+        self.capacity += self.chunk_rows
+        self.file.truncate(HEADER_SIZE + self.capacity * self.dtype.itemsize)
+        self.mm = np.memmap(self.file, dtype=self.dtype, mode='r+', offset=HEADER_SIZE, shape=(self.capacity,))
+
+    def append(self, step, action, reward, epsilon, measurements):
+        """ Writes one row directly into the mapped file.
+
+        Parameters:
+            step: step of the run
+            action: action taken at this step
+            reward: reward received
+            epsilon: exploration rate of the agent, nan if not applicable
+            measurements: dict of the rest of the fields, as provided by Rdt.measurements
+        """
+        if self.rows == self.capacity:
+            self._grow()
+
+        row = self.mm[self.rows]
+        row['step'] = step
+        row['action'] = action
+        row['reward'] = reward
+        row['epsilon'] = epsilon
+        for field, value in measurements.items():
+            row[field] = np.nan if value is None else value
+        self.rows += 1
+
+        if self.rows % self.sync_every == 0:
+            self.sync()
+
+    def sync(self):
+        """ Persists the rows written so far, so that the log can be read while the run is in progress. """
+
+        self.mm.flush()
+        _write_header(self.file, self.dtype, self.rows)
+
+    def close(self):
+        """ Syncs and trims the file to the rows actually written. """
+
+        self.sync()
+        del self.mm
+        self.mm = None
+        self.file.truncate(HEADER_SIZE + self.rows * self.dtype.itemsize)
+        self.file.close()
+
+
+def load_run_log(path):
+    """ Maps a step log in read only mode. Columns are accessed by name without copying, e.g. log['latency']. """
+
+    with open(path, 'rb') as file:
+        dtype, rows = _read_header(file)
+    if rows == 0:
+        return np.empty(0, dtype=dtype)
+
+    return np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(rows,))
+
+
+def _per_k_cycles(row, prefix, columns):
+    """ Values of a row with the misses normalised per k. cycles, as they are written under 'Misses per k. cycles'
+    during a run. """
+
+    values = [row[column] for column in columns]
+    cycles = row[prefix + '_cycles']
+    values[1] = values[1] / (cycles / 1000.) if cycles > 0 else 0.
+
+    return values
+
+
+def export_tensorboard(path, logdir=None, comment=''):
+    """ Writes a step log to Tensorboard with the same tags as the ones written online during a run. """
+
+    from torch.utils.tensorboard import SummaryWriter
+    from utils.functions import write_metrics
+
+    steps = load_run_log(path)
+    writer = SummaryWriter(log_dir=logdir, comment=comment)
+    # values follow the order of utils.constants.metric_names
+    lc_columns = ['lc_ipc', 'lc_misses', 'lc_llc', 'lc_mbl', 'lc_mbr', 'latency', 'rps']
+    be_columns = ['be_ipc', 'be_misses', 'be_llc', 'be_mbl', 'be_mbr']
+    for row in steps:
+        step = int(row['step'])
+        write_metrics(writer, LC_TAG, _per_k_cycles(row, 'lc', lc_columns), step)
+        write_metrics(writer, BE_TAG, _per_k_cycles(row, 'be', be_columns), step)
+        writer.add_scalar('Agent/Action', row['action'], step)
+        writer.add_scalar('Agent/Reward', row['reward'], step)
+        if not np.isnan(row['epsilon']):
+            writer.add_scalar('Agent/Epsilon', row['epsilon'], step)
+    writer.flush()
+    writer.close()
+
+    return len(steps)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Step log tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='Export a step log to Tensorboard')
+    export_parser.add_argument('path', help='Path to the step log')
+    export_parser.add_argument('--logdir', default=None, help='Tensorboard log dir, defaults to runs/')
+    summary_parser = subparsers.add_parser('summary', help='Print a summary of a step log')
+    summary_parser.add_argument('path', help='Path to the step log')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        print("Exported {} steps.".format(export_tensorboard(args.path, args.logdir)))
+    else:
+        log = load_run_log(args.path)
+        print("Steps: {}".format(len(log)))
+        for field in log.dtype.names:
+            print("{:>16}: mean {:.4g} min {:.4g} max {:.4g}".format(field, np.nanmean(log[field]),
+                                                                    np.nanmin(log[field]), np.nanmax(log[field])))
@@ -0,0 +1,160 @@
+import re
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+# Measures the import time of the entry points with python -X importtime. Every entry point is run with --help, it
+# exits right after parsing its args, so the measured time is what a run pays before doing any work. Entry points should
+# import the heavy backends (torch, tensorboard, pqos, docker) only after their args are parsed and env_builder only
+# once a backend is selected. --help never reaches the env, so the build paths are also run: they construct an env with
+# EnvBuilder, as an entry point does, without stepping it, and are timed end to end with their own budget. A build path
+# also fails if it imports a backend that it does not select, e.g. pqos for the mock handler. Exits with 1 if an entry
+# point or a build path is over budget or imports a backend it should not.
+#
+#   python utils/startup_benchmark.py --budget-ms 800 --build-budget-ms 3000
+
+ENTRY_POINTS = ('main_agent.py', 'main_measurements.py', 'main_vec_agent.py', 'main_multisocket.py',
+                'main_inference.py', 'main_controller.py')
+BACKENDS = ('torch', 'tensorboard', 'pqos', 'docker', 'gym', 'rlsuite')
+LIGHT_MODULES = ('env_builder',)  # modules that should not import any backend
+
+# the --simulate path of the entry points, with the defaults of their args
+SIMULATED_ENV = """
+from env_builder import EnvBuilder
+from utils.config_constants import *
+from utils.constants import Loaders, Schedulers
+from utils.functions import config_parser
+config = config_parser('configs/local')
+config[LOADER][ACTION_INTERVAL] = '200'
+config[LOADER][QUANTILE] = '.95'
+config[ENV][FEATURE] = 'MPKC'
+env = EnvBuilder() \\
+    .build_simulation(config[SIMULATOR]) \\
+    .build_pqos('SIM', config[PQOS][CORES_LC], config[SCHEDULER][CORES_BE]) \\
+    .build_loader(Loaders.SIMULATED, config[LOADER]) \\
+    .build_scheduler(Schedulers.SIMULATED, config[SCHEDULER]) \\
+    .build(config[ENV])
+"""
+# the pqos handler of the default config, pqos_interface = none, that runs on a machine without the pqos library
+MOCK_PQOS = """
+from env_builder import EnvBuilder
+from utils.config_constants import *
+from utils.functions import config_parser
+config = config_parser('configs/local')
+EnvBuilder().build_pqos(config[PQOS][PQOS_INTERFACE], config[PQOS][CORES_LC], config[SCHEDULER][CORES_BE])
+"""
+# name -> (code, backends that it must not import)
+BUILD_PATHS = {'simulated env': (SIMULATED_ENV, ('pqos', 'docker')), 'mock pqos': (MOCK_PQOS, BACKENDS)}
+
+IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)')
+
+
+def parse_importtime(stderr):
+    """
+    Parses the output of -X importtime.
+
+    Returns:
+        a list of (module, cumulative us) of the top level imports and the set of all the imported modules
+    """
+
+    top_level, modules = [], set()
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match is None:
+            continue
+        _, cumulative, indent, module = match.groups()
+        modules.add(module)
+        if len(indent) == 1:
+            top_level.append((module, int(cumulative)))
+
+    return top_level, modules
+
+
+def measure(args, cwd, repeat):
+    """ Runs python -X importtime with args, returns the import time, the wall time in ms, the top level imports and
+    the modules of the fastest run. """
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime'] + args, cwd=cwd, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, universal_newlines=True)
+        wall_ms = (time.perf_counter() - start) * 1000
+        top_level, modules = parse_importtime(result.stderr)
+        if result.returncode != 0:
+            errors = [line for line in result.stderr.splitlines() if not line.startswith('import time:')]
+            raise RuntimeError("exited with {}: {}".format(result.returncode, errors[-1:]))
+        total = sum(cumulative for _, cumulative in top_level)
+        if best is None or total < best[0]:
+            best = (total, wall_ms, top_level, modules)
+
+    return best
+
+
+def loaded_backends(modules):
+    return sorted({module.split('.')[0] for module in modules} & set(BACKENDS))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Startup time of the entry points, with a regression budget')
+    parser.add_argument('--budget-ms', type=float, default=1000., help='Import time allowed to every entry point')
+    parser.add_argument('--build-budget-ms', type=float, default=3000.,
+                        help='Wall time allowed to every build path, interpreter start up included')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each entry point, the fastest one counts')
+    parser.add_argument('--top', type=int, default=5, help='Slowest top level imports shown per entry point')
+    parser.add_argument('entry_points', nargs='*', default=ENTRY_POINTS, help='Scripts to measure')
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    failed = False
+
+    for module in LIGHT_MODULES:
+        try:
+            _, _, _, modules = measure(['-c', 'import {}'.format(module)], root, 1)
+        except RuntimeError as e:
+            print("{:<22} FAILED {}".format(module, e))
+            failed = True
+            continue
+        backends = loaded_backends(modules)
+        if backends:
+            print("{:<22} FAILED imports backends at import: {}".format(module, ', '.join(backends)))
+            failed = True
+        else:
+            print("{:<22} ok, no backend imported".format(module))
+
+    for entry_point in args.entry_points:
+        try:
+            total, _, top_level, modules = measure([entry_point, '--help'], root, args.repeat)
+        except RuntimeError as e:
+            print("{:<22} FAILED {}".format(entry_point, e))
+            failed = True
+            continue
+        total_ms = total / 1000.
+        over = total_ms > args.budget_ms
+        failed |= over
+        print("{:<22} {:8.1f}ms {} backends: {}".format(entry_point, total_ms, 'OVER BUDGET' if over else 'ok',
+                                                       ', '.join(loaded_backends(modules)) or '-'))
+        for module, cumulative in sorted(top_level, key=lambda item: -item[1])[:args.top]:
+            print("    {:<30} {:8.1f}ms".format(module, cumulative / 1000.))
+
+    for name, (code, forbidden) in BUILD_PATHS.items():
+        try:
+            total, wall_ms, top_level, modules = measure(['-c', code], root, args.repeat)
+        except RuntimeError as e:
+            print("{:<22} FAILED {}".format(name, e))
+            failed = True
+            continue
+        over = wall_ms > args.build_budget_ms
+        unexpected = sorted(set(loaded_backends(modules)) & set(forbidden))
+        failed |= over or bool(unexpected)
+        status = 'OVER BUDGET' if over else 'ok'
+        if unexpected:
+            status = 'FAILED imports {}'.format(', '.join(unexpected))
+        print("{:<22} {:8.1f}ms {} imports {:.1f}ms backends: {}".format(
+            name, wall_ms, status, total / 1000., ', '.join(loaded_backends(modules)) or '-'))
+        for module, cumulative in sorted(top_level, key=lambda item: -item[1])[:args.top]:
+            print("    {:<30} {:8.1f}ms".format(module, cumulative / 1000.))
+
+    sys.exit(1 if failed else 0)
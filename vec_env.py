@@ -0,0 +1,146 @@
+import numpy as np
+import multiprocessing as mp
+import logging
+
+log = logging.getLogger('simpleExample')
+
+STEP = 'step'
+RESET = 'reset'
+STOP = 'stop'
+SPACES = 'spaces'
+
+
+def transition_next_states(next_states, dones, infos):
+    """ Next states of the transitions of a step. Environments that are done have already been reset, the next state
+    of their transition is the terminal state and not the first state after the reset. """
+
+    if not dones.any():
+        return next_states
+    next_states = next_states.copy()
+    for i in np.flatnonzero(dones):
+        next_states[i] = infos[i]['terminal_state']
+
+    return next_states
+
+
+class VecRdt:
+    """ Steps N independent environments in the same process. States are returned stacked in one array, so that the
+    actions of all the environments can be selected with a single forward pass. An environment that is done is reset
+    automatically, its last state is kept in the info under 'terminal_state'. """
+
+    def __init__(self, env_fns):
+        """
+        Parameters:
+            env_fns: a list of callables, each one builds an environment
+        """
+        self.envs = [env_fn() for env_fn in env_fns]
+        self.num_envs = len(self.envs)
+        self.observation_space = self.envs[0].observation_space
+        self.action_space = self.envs[0].action_space
+        self.episodes = np.zeros(self.num_envs, dtype=np.int64)  # finished episodes per environment
+
+    def reset(self):
+        return np.stack([np.float32(env.reset()) for env in self.envs])
+
+    def step(self, actions):
+        """ Performs one step on every environment.
+
+        Returns:
+            states (N x observations), rewards (N), dones (N) and a list of N info dicts
+        """
+        states, rewards, dones, infos = [], [], [], []
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            state, reward, done, info = env.step(int(action))
+            if done:
+                info['terminal_state'] = state
+                state = env.reset()
+                self.episodes[i] += 1
+            states.append(np.float32(state))
+            rewards.append(reward)
+            dones.append(done)
+            infos.append(info)
+
+        return np.stack(states), np.array(rewards, dtype=np.float32), np.array(dones), infos
+
+    def get_violations(self):
+        return np.array([env.violations for env in self.envs])
+
+    def stop(self):
+        for env in self.envs:
+            env.stop()
+
+
+def _worker(remote, env_fns):
+    """ Runs a group of environments in a subprocess and serves the commands of the parent. """
+
+    envs = VecRdt(env_fns)
+    try:
+        while True:
+            command, data = remote.recv()
+            if command == STEP:
+                remote.send(envs.step(data) + (envs.get_violations(), envs.episodes.copy()))
+            elif command == RESET:
+                remote.send(envs.reset())
+            elif command == SPACES:
+                remote.send((envs.observation_space, envs.action_space))
+            elif command == STOP:
+                envs.stop()
+                remote.send(None)
+                break
+    finally:
+        remote.close()
+
+
+class SubprocVecRdt:
+    """ Same interface as VecRdt, the environments are split among a pool of worker processes that are stepped in
+    parallel. """
+
+    def __init__(self, env_fns, num_workers=None):
+        """
+        Parameters:
+            env_fns: a list of callables, each one builds an environment
+            num_workers: number of worker processes, defaults to one per environment
+        """
+        num_workers = min(num_workers or len(env_fns), len(env_fns))
+        # fork so that env_fns do not need to be picklable
+        ctx = mp.get_context('fork')
+        self.num_envs = len(env_fns)
+        self.groups = np.array_split(np.arange(self.num_envs), num_workers)
+        self.remotes, self.processes = [], []
+        for group in self.groups:
+            parent, child = ctx.Pipe()
+            process = ctx.Process(target=_worker, args=(child, [env_fns[i] for i in group]), daemon=True)
+            process.start()
+            child.close()
+            self.remotes.append(parent)
+            self.processes.append(process)
+
+        self.remotes[0].send((SPACES, None))
+        self.observation_space, self.action_space = self.remotes[0].recv()
+        self.violations = np.zeros(self.num_envs, dtype=np.int64)
+        self.episodes = np.zeros(self.num_envs, dtype=np.int64)
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send((RESET, None))
+        return np.concatenate([remote.recv() for remote in self.remotes])
+
+    def step(self, actions):
+        for remote, group in zip(self.remotes, self.groups):
+            remote.send((STEP, actions[group]))
+        results = [remote.recv() for remote in self.remotes]
+        states, rewards, dones, infos, violations, episodes = zip(*results)
+        self.violations = np.concatenate(violations)
+        self.episodes = np.concatenate(episodes)
+
+        return np.concatenate(states), np.concatenate(rewards), np.concatenate(dones), sum(infos, [])
+
+    def get_violations(self):
+        return self.violations
+
+    def stop(self):
+        for remote in self.remotes:
+            remote.send((STOP, None))
+        for remote, process in zip(self.remotes, self.processes):
+            remote.recv()
+            process.join()
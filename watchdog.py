@@ -0,0 +1,70 @@
+import time
+import queue
+import threading
+import logging
+
+log = logging.getLogger('simpleExample')
+
+
+class LatencySource:
+    """ Interface of a streaming source of the tail latency of the LC service. """
+
+    def latest(self):
+        """ Returns the most recent (timestamp, tail latency in ms) or None if there is nothing yet. """
+        raise NotImplementedError
+
+
+class QueueLatencySource(LatencySource):
+    """ Source fed by pushing samples, used where there is no streaming loader or to inject latencies. """
+
+    def __init__(self):
+        self.samples = queue.Queue()
+        self.last = None
+
+    def push(self, latency, timestamp=None):
+        self.samples.put((timestamp if timestamp is not None else time.time(), latency))
+
+    def latest(self):
+        while True:
+            try:
+                self.last = self.samples.get_nowait()
+            except queue.Empty:
+                return self.last
+
+
+class LatencyWatchdog(threading.Thread):
+    """ Safety path that runs next to the agent. It polls a latency source at a much shorter period than the action
+    interval and, when the tail latency crosses a fraction of the threshold, gives the LC service as many ways (and
+    the BEs as little bandwidth) as possible without waiting for the next decision. The policy takes over again at
+    its next step, every override is recorded in the events of the env. """
+
+    def __init__(self, env, source, fraction=0.9, interval_ms=5):
+        """
+        Parameters:
+            env: the Rdt environment whose allocation is overridden
+            source: a LatencySource
+            fraction: the watchdog fires when latency > fraction * latency_thr
+            interval_ms: polling period of the source
+        """
+        super().__init__(name='latency-watchdog', daemon=True)
+        self.env = env
+        self.source = source
+        self.limit = fraction * env.latency_thr
+        self.interval = interval_ms / 1000.
+        self.last_timestamp = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            sample = self.source.latest()
+            if sample is None or sample[0] == self.last_timestamp:
+                continue
+            self.last_timestamp, latency = sample
+            if latency > self.limit:
+                self.env.override(latency)
+
+    def stop(self):
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
+        log.info("Latency watchdog overrode the agent {} times.".format(len(self.env.events)))